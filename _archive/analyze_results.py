@@ -4,20 +4,35 @@ CSRD Report Analysis Utilities
 =============================
 
 This script provides analysis and visualization tools for the generated
-CSRD CO₂ reporting output.
+CSRD CO₂ reporting output. It reads the rollup tables written next to the
+report (carbomatch_rollup) and its summary (carbomatch_summary); reports
+without them are rolled up once.
 
 Usage:
     python analyze_results.py
 """
 
+import os
+import sys
 import pandas as pd
 import numpy as np
 from datetime import datetime
+from pathlib import Path
+
+# Add project to path
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from carbomatch_co2e import CALCULATION_CODE_LABELS, CALC_SUCCESS
+from carbomatch_rollup import RollupBuilder, read_rollups, rollup, rollups_path
+from carbomatch_summary import SUMMARY_FORMAT, read_summary, summarize, summary_path
 
 def load_report(filename="csrd_co2e_report.csv"):
     """Load and return the CSRD report"""
     try:
-        df = pd.read_csv(filename, sep=';', encoding='utf-8-sig')
+        if filename.endswith('.parquet'):
+            df = pd.read_parquet(filename)  # typed report, no re-parsing
+        else:
+            df = pd.read_csv(filename, sep=';', encoding='utf-8-sig')
         print(f"✅ Loaded report: {len(df)} records from {filename}")
         return df
     except FileNotFoundError:
@@ -27,42 +42,64 @@ def load_report(filename="csrd_co2e_report.csv"):
         print(f"❌ Error loading report: {e}")
         return None
 
-def analyze_calculation_status(df):
+def load_rollups(filename="csrd_co2e_report.csv"):
+    """Load the report rollups, rolling up the report rows when none were written"""
+    path = rollups_path(filename)
+    if os.path.exists(path) and (not os.path.exists(filename) or os.path.getmtime(path) >= os.path.getmtime(filename)):
+        rollups = read_rollups(path)
+        print(f"✅ Loaded rollups: {len(rollups)} rows from {path}")
+        return rollups
+    
+    df = load_report(filename)
+    if df is None:
+        return None
+    if 'calculation_code' not in df.columns:
+        # Reports without numeric status columns: only success is known
+        success = df['calculation_status'].str.startswith('Success', na=False)
+        df['calculation_code'] = np.where(success, CALC_SUCCESS, np.nan)
+    if 'mass_kg' not in df.columns:
+        # Menge is in the delivery unit (Stück, Bündel, ...), not kg - mass unknown
+        df['mass_kg'] = np.nan
+    builder = RollupBuilder()
+    builder.add(df)
+    return builder.result()
+
+def analyze_calculation_status(rollups):
     """Analyze the success/failure rates of calculations"""
     print("\n" + "="*60)
     print("📊 CALCULATION STATUS ANALYSIS")
     print("="*60)
     
-    status_counts = df['calculation_status'].value_counts()
-    total = len(df)
+    status_counts = rollup(rollups, 'status').sort_values('items', ascending=False)
+    project = rollup(rollups, 'project').iloc[0]
+    total = int(project['items'])
     
     print(f"\n📈 Success/Error Breakdown:")
-    for status, count in status_counts.items():
-        percentage = (count / total) * 100
-        print(f"   • {status}: {count:,} ({percentage:.1f}%)")
+    for code, row in status_counts.iterrows():
+        status = CALCULATION_CODE_LABELS.get(int(code), code) if code else 'Error (uncoded status)'
+        percentage = (row['items'] / total) * 100
+        print(f"   • {status}: {int(row['items']):,} ({percentage:.1f}%)")
     
     # Successful calculations only
-    successful = df[df['calculation_status'].str.contains('Success', na=False)]
-    if len(successful) > 0:
-        print(f"\n✅ Successful Calculations: {len(successful)}/{total} ({len(successful)/total*100:.1f}%)")
-        print(f"   • Total CO₂e from successful: {successful['total_co2e'].sum():,.2f} kg CO₂e")
-        print(f"   • Average CO₂e per item: {successful['total_co2e'].mean():,.2f} kg CO₂e")
+    if str(CALC_SUCCESS) in status_counts.index:
+        successful = status_counts.loc[str(CALC_SUCCESS)]
+        print(f"\n✅ Successful Calculations: {int(successful['items'])}/{total} ({successful['items']/total*100:.1f}%)")
+        print(f"   • Total CO₂e from successful: {successful['total_co2e']:,.2f} kg CO₂e")
+        print(f"   • Average CO₂e per item: {successful['total_co2e'] / successful['items']:,.2f} kg CO₂e")
 
-def analyze_suppliers(df):
+def analyze_suppliers(rollups):
     """Analyze CO₂e by supplier"""
     print("\n" + "="*60)
     print("🏢 SUPPLIER ANALYSIS")
     print("="*60)
     
-    supplier_summary = df.groupby('Lieferant').agg({
-        'Menge': 'sum',
-        'total_co2e': 'sum',
-        'Artikel': 'count'
-    }).round(2)
+    suppliers = rollup(rollups, 'supplier')
+    supplier_summary = suppliers[['mass_kg', 'total_co2e', 'items']].round(2)
     
     supplier_summary.columns = ['Total_Weight_kg', 'Total_CO2e_kg', 'Item_Count']
-    supplier_summary['CO2e_Intensity'] = (supplier_summary['Total_CO2e_kg'] / 
-                                         supplier_summary['Total_Weight_kg']).round(4)
+    # CO₂e of the known-mass rows over their mass (carbomatch_summary.INTENSITY_BASIS)
+    supplier_summary['CO2e_Intensity'] = (suppliers['mass_co2e'] /
+                                         suppliers['mass_kg'].where(suppliers['mass_kg'] > 0)).round(4)
     
     # Sort by total CO₂e
     supplier_summary = supplier_summary.sort_values('Total_CO2e_kg', ascending=False)
@@ -70,62 +107,71 @@ def analyze_suppliers(df):
     print(f"\n📋 Top Suppliers by CO₂e Impact:")
     for i, (supplier, row) in enumerate(supplier_summary.head(5).iterrows(), 1):
         print(f"   {i}. {supplier}")
-        print(f"      • Items: {row['Item_Count']} | Weight: {row['Total_Weight_kg']:,.0f} kg")
+        print(f"      • Items: {int(row['Item_Count'])} | Weight: {row['Total_Weight_kg']:,.0f} kg")
         print(f"      • CO₂e: {row['Total_CO2e_kg']:,.0f} kg | Intensity: {row['CO2e_Intensity']:.4f} kg CO₂e/kg")
 
-def analyze_materials(df):
+def analyze_materials(rollups):
     """Analyze CO₂e by material categories"""
     print("\n" + "="*60)
     print("🔬 MATERIAL CATEGORY ANALYSIS")
     print("="*60)
     
-    # Group by matched category
-    category_summary = df.groupby('matched_category').agg({
-        'total_co2e': ['sum', 'count', 'mean'],
-        'similarity_score': 'mean'
+    # Matched category rollup
+    categories = rollup(rollups, 'category')
+    category_summary = pd.DataFrame({
+        'Total_CO2e': categories['total_co2e'],
+        'Item_Count': categories['items'],
+        'Avg_CO2e_per_Item': categories['total_co2e'] / categories['items'],
+        'Avg_Similarity': categories['similarity_sum'] / categories['items'],
     }).round(2)
-    
-    category_summary.columns = ['Total_CO2e', 'Item_Count', 'Avg_CO2e_per_Item', 'Avg_Similarity']
     category_summary = category_summary.sort_values('Total_CO2e', ascending=False)
     
     print(f"\n📋 Top Material Categories by CO₂e:")
     for i, (category, row) in enumerate(category_summary.head(5).iterrows(), 1):
         category_short = category[:50] + "..." if len(category) > 50 else category
         print(f"   {i}. {category_short}")
-        print(f"      • Total CO₂e: {row['Total_CO2e']:,.0f} kg | Items: {row['Item_Count']}")
+        print(f"      • Total CO₂e: {row['Total_CO2e']:,.0f} kg | Items: {int(row['Item_Count'])}")
         print(f"      • Avg per item: {row['Avg_CO2e_per_Item']:,.0f} kg | Match quality: {row['Avg_Similarity']:.3f}")
 
-def analyze_units(df):
-    """Analyze unit distribution and success rates"""
+def analyze_units(rollups):
+    """Analyze delivery unit distribution and success rates"""
     print("\n" + "="*60)
     print("📏 UNIT ANALYSIS")
     print("="*60)
     
-    unit_analysis = df.groupby(['matched_oeko_unit', 'calculation_status']).size().unstack(fill_value=0)
+    unit_analysis = rollup(rollups, 'unit').sort_values('items', ascending=False)
     
     print(f"\n📊 Unit Distribution and Success Rates:")
-    for unit in unit_analysis.index:
-        total = unit_analysis.loc[unit].sum()
-        successful = unit_analysis.loc[unit].get('Success: kg unit', 0) + \
-                    unit_analysis.loc[unit].get('Success: m³ unit', 0)
-        success_rate = (successful / total * 100) if total > 0 else 0
+    for unit, row in unit_analysis.iterrows():
+        total = int(row['items'])
+        success_rate = (row['successful_items'] / total * 100) if total > 0 else 0
         
-        print(f"   • {unit}: {total} items ({success_rate:.1f}% success)")
+        print(f"   • {unit or 'n/a'}: {total} items ({success_rate:.1f}% success)")
+
+def load_summary(rollups, filename="csrd_co2e_report.csv"):
+    """Load the report summary, deriving it from the rollups when none was written"""
+    path = summary_path(filename)
+    if os.path.exists(path) and (not os.path.exists(filename) or os.path.getmtime(path) >= os.path.getmtime(filename)):
+        summary = read_summary(path)
+        # Older summary formats define the intensity differently
+        if summary.get('format') == SUMMARY_FORMAT:
+            return summary
+    return summarize(rollups)
 
-def generate_executive_summary(df):
+def generate_executive_summary(summary):
     """Generate a comprehensive executive summary"""
     print("\n" + "="*80)
     print("📋 EXECUTIVE SUMMARY - DETAILED ANALYSIS")
     print("="*80)
     
-    total_items = len(df)
-    total_weight = df['Menge'].sum()
-    total_material_co2e = df['calculated_co2e_a1_a3'].sum()
-    total_transport_co2e = df['calculated_co2e_a4'].sum()
-    total_co2e = df['total_co2e'].sum()
+    total_items = summary['total_items']
+    total_weight = summary['total_mass_kg']
+    total_material_co2e = summary['material_co2e']
+    total_transport_co2e = summary['transport_co2e']
+    total_co2e = summary['total_co2e']
     
-    successful_calcs = len(df[df['calculation_status'].str.contains('Success', na=False)])
-    avg_similarity = df['similarity_score'].mean()
+    successful_calcs = summary['successful_items']
+    avg_similarity = summary['avg_similarity'] or 0
     
     print(f"📅 Analysis Date: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
     print(f"📊 Dataset Overview:")
@@ -140,10 +186,15 @@ def generate_executive_summary(df):
     print(f"   • TOTAL PROJECT CO₂e: {total_co2e:,.2f} kg CO₂e")
     
     print(f"\n📈 Key Performance Indicators:")
-    co2e_intensity = total_co2e / total_weight if total_weight > 0 else 0
-    print(f"   • Overall CO₂e intensity: {co2e_intensity:.4f} kg CO₂e/kg material")
-    
-    material_transport_ratio = total_material_co2e / total_transport_co2e if total_transport_co2e > 0 else 0
+    co2e_intensity = summary['intensity']
+    if co2e_intensity is None or 'intensity_basis' not in summary:
+        print(f"   • Overall CO₂e intensity: n/a (report predates known-mass CO₂e - rerun the pipeline)")
+        co2e_intensity = float('nan')
+    else:
+        print(f"   • Overall CO₂e intensity: {co2e_intensity:.4f} kg CO₂e/kg material "
+              f"({summary['intensity_basis']}, {summary['known_mass_pct']:.1f}% of items)")
+    
+    material_transport_ratio = summary['material_transport_ratio'] or 0
     print(f"   • Material:Transport ratio: {material_transport_ratio:.1f}:1")
     
     # Equivalent conversions
@@ -157,20 +208,20 @@ def main():
     print("🔍 CSRD REPORT ANALYSIS TOOL")
     print("=" * 40)
     
-    # Load the report
-    df = load_report()
-    if df is None:
+    # Load the report rollups
+    rollups = load_rollups()
+    if rollups is None:
         return
     
     # Run all analyses
-    analyze_calculation_status(df)
-    analyze_suppliers(df)
-    analyze_materials(df)
-    analyze_units(df)
-    generate_executive_summary(df)
+    analyze_calculation_status(rollups)
+    analyze_suppliers(rollups)
+    analyze_materials(rollups)
+    analyze_units(rollups)
+    generate_executive_summary(load_summary(rollups))
     
     print(f"\n✅ Analysis completed!")
-    print(f"📄 Analyzed {len(df)} records from CSRD report")
+    print(f"📄 Analyzed {int(rollup(rollups, 'project').iloc[0]['items'])} records from CSRD report")
 
 if __name__ == "__main__":
     main()
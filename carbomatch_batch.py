@@ -0,0 +1,251 @@
+#!/usr/bin/env python3
+"""
+CarbonMatch - Multi-Site Batch Runner
+=====================================
+
+Runs the CarbonMatch pipeline for a portfolio of construction sites while
+loading the expensive shared state only once:
+- Ökobaudat catalog (loaded and cleaned once)
+- Catalog embedding index (embedded once)
+- Azure OpenAI client and embedding cache (shared by all sites)
+
+Each site gets its own report, report rollups and rejects file; a portfolio
+rollup with one row per site plus a portfolio total is written next to them,
+together with the site rollups combined per supplier, category, material,
+unit and status (`portfolio_report.rollups.csv`, see carbomatch_rollup) and
+the portfolio summary (`portfolio_report.summary.json`, see carbomatch_summary).
+Site totals come from each site's report summary, not from its rows. With
+--store all sites load their rows into one SQLite report store
+(carbomatch_store) for indexed portfolio queries; with --history each site run
+is recorded in the run history (carbomatch_history). With --parquet
+all sites also write into one typed report dataset partitioned by site
+(`portfolio_report.parquet/site=.../`, see carbomatch_report).
+
+Usage:
+    python carbomatch_batch.py sites.csv --oekobaudat oekobaudat.csv --workers 4
+
+The site manifest is a semicolon-separated CSV with columns `site` and
+`deliveries` (path to the site's delivery workbook).
+"""
+
+from __future__ import annotations
+
+import argparse
+import logging
+import os
+import re
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional, Tuple
+
+from carbomatch_geo import OSRMRouter, RoutingService
+from carbomatch_lazy import lazy_import
+from carbomatch_report import SITE_COLUMN
+from carbomatch_rollup import combine_rollups, write_rollups
+from carbomatch_summary import summarize, write_summary
+from carbomatch_store import STORE_FILE
+from carbomatch_history import HISTORY_DIR
+from carbomatch_pipeline import (
+    OUTPUT_FILE,
+    REJECTS_FILE,
+    SUBSCRIPTION_KEY,
+    CarbonMatchPipeline,
+    configure_logging,
+)
+
+pd = lazy_import("pandas")
+
+logger = logging.getLogger(__name__)
+
+PORTFOLIO_DIR = "portfolio_reports"
+ROLLUP_FILE = "portfolio_rollup.csv"
+PORTFOLIO_ROLLUPS = "portfolio_report.rollups.csv"
+PORTFOLIO_SUMMARY = "portfolio_report.summary.json"
+PORTFOLIO_DATASET = "portfolio_report.parquet"
+PORTFOLIO_TOTAL_LABEL = "PORTFOLIO TOTAL"
+
+
+def load_site_manifest(path: str) -> List[Tuple[str, str]]:
+    """
+    Read the site manifest
+
+    Args:
+        path: Semicolon-separated CSV with `site` and `deliveries` columns
+
+    Returns:
+        List of (site_id, deliveries_path) tuples
+    """
+    manifest = pd.read_csv(path, sep=';', dtype=str, encoding='utf-8-sig')
+    missing = [col for col in ['site', 'deliveries'] if col not in manifest.columns]
+    if missing:
+        raise ValueError(f"Site manifest is missing required columns: {missing}")
+    if manifest['site'].duplicated().any():
+        raise ValueError(f"Duplicate site ids in manifest: {sorted(manifest.loc[manifest['site'].duplicated(), 'site'])}")
+    return list(zip(manifest['site'], manifest['deliveries']))
+
+
+def site_directory(output_dir: str, site_id: str) -> str:
+    """Filesystem-safe output directory for a site"""
+    return os.path.join(output_dir, re.sub(r'[^\w.-]+', '_', site_id))
+
+
+class PortfolioRunner:
+    """Processes many site delivery sets against one shared catalog and index"""
+
+    def __init__(self, oekobaudat_path: str = "oekobaudat.csv", api_key: str = "",
+                 output_dir: str = PORTFOLIO_DIR, factors_path: Optional[str] = None,
+                 transport_path: Optional[str] = None, distances_path: Optional[str] = None,
+                 geocodes_path: Optional[str] = None, router: Optional[RoutingService] = None,
+                 parquet: bool = False, partition_by: Optional[List[str]] = None,
+                 store_path: Optional[str] = None, history_dir: Optional[str] = None):
+        """
+        Load the Ökobaudat catalog and build the embedding index once
+
+        Args:
+            oekobaudat_path: Path to Ökobaudat database (CSV)
+            api_key: Azure OpenAI API key (defaults to OPENAI_API_KEY)
+            output_dir: Directory receiving per-site reports and the rollup
+            factors_path: Conversion factor tables (defaults to carbomatch_factors.json)
+            transport_path: Transport vehicles and defaults (defaults to carbomatch_transport.json)
+            distances_path: Supplier → site distance table (defaults to carbomatch_distances.csv, if present)
+            geocodes_path: Supplier / site coordinates (defaults to carbomatch_geocodes.csv, if present)
+            router: Routing service for geocoded pairs (geodesic distances when None)
+            parquet: Also write the typed portfolio dataset (PORTFOLIO_DATASET)
+            partition_by: Partition columns after `site` (e.g. ['Lieferant'])
+            store_path: SQLite report store receiving the rows of every site
+            history_dir: Run history recording every site run
+        """
+        self.output_dir = output_dir
+        self.dataset_path = os.path.join(output_dir, PORTFOLIO_DATASET) if parquet or partition_by else None
+        self.store_path = store_path
+        self.history_dir = history_dir
+        self.partition_by = [SITE_COLUMN] + [col for col in partition_by or [] if col != SITE_COLUMN]
+        self.shared = CarbonMatchPipeline(api_key=api_key, factors_path=factors_path,
+                                          transport_path=transport_path, distances_path=distances_path,
+                                          geocodes_path=geocodes_path, router=router)
+        self.shared.load_embedding_cache()
+        self.shared.conversion_cache.load()
+        self.shared.load_catalog(oekobaudat_path)
+        self.shared.build_catalog_index()
+        self.site_rollups: Dict[str, pd.DataFrame] = {}
+        self.summary: Optional[Dict] = None  # portfolio summary of the last run
+
+    def run_site(self, site_id: str, deliveries_path: str) -> Dict:
+        """
+        Run steps 1a-5 for one site against the shared catalog state
+
+        Returns:
+            Site rollup row (totals and output paths)
+        """
+        logger.info(f"=== SITE {site_id}: {deliveries_path} ===")
+        site_dir = site_directory(self.output_dir, site_id)
+        os.makedirs(site_dir, exist_ok=True)
+        report_path = os.path.join(site_dir, OUTPUT_FILE)
+
+        pipeline = CarbonMatchPipeline(site_id=site_id, shared=self.shared)
+        pipeline.load_deliveries(deliveries_path, rejects_path=os.path.join(site_dir, REJECTS_FILE))
+        pipeline.generate_embeddings_and_match()
+        pipeline.calculate_all_co2e()
+        pipeline.simulate_transport_co2e()
+        summary = pipeline.generate_final_report(output_path=report_path, print_summary=False,
+                                                 parquet_path=self.dataset_path, partition_by=self.partition_by,
+                                                 store_path=self.store_path, history_dir=self.history_dir)
+
+        self.site_rollups[site_id] = pipeline.rollups
+        return {
+            'site': site_id,
+            'delivery_rows': summary['total_items'],
+            'rejected_rows': len(pipeline.rejects_df),
+            'successful_calcs': summary['successful_items'],
+            'total_mass_kg': summary['total_mass_kg'],
+            'calculated_co2e_a1_a3': summary['material_co2e'],
+            'calculated_co2e_a4': summary['transport_co2e'],
+            'total_co2e': summary['total_co2e'],
+            'report_path': report_path,
+        }
+
+    def run(self, sites: List[Tuple[str, str]], workers: int = 1,
+            rollup_path: Optional[str] = None) -> pd.DataFrame:
+        """
+        Process all sites and write the portfolio rollup
+
+        Args:
+            sites: (site_id, deliveries_path) tuples
+            workers: Number of sites processed concurrently (1 = sequential)
+            rollup_path: Rollup CSV path (default: <output_dir>/portfolio_rollup.csv)
+
+        Returns:
+            Rollup frame with one row per site plus the portfolio total
+        """
+        os.makedirs(self.output_dir, exist_ok=True)
+
+        if workers > 1:
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                rows = list(executor.map(lambda site: self.run_site(*site), sites))
+        else:
+            rows = [self.run_site(site_id, path) for site_id, path in sites]
+
+        rollup = pd.DataFrame(rows)
+        totals = rollup.drop(columns=['site', 'report_path']).sum().to_frame().T
+        totals.insert(0, 'site', PORTFOLIO_TOTAL_LABEL)
+        totals['report_path'] = ''
+        rollup = pd.concat([rollup, totals.astype(rollup.dtypes.to_dict())], ignore_index=True)
+
+        rollup_path = rollup_path or os.path.join(self.output_dir, ROLLUP_FILE)
+        rollup.to_csv(rollup_path, sep=';', index=False, encoding='utf-8-sig')
+        logger.info(f"Portfolio rollup for {len(rows)} sites exported to {rollup_path}")
+        portfolio_rollups = combine_rollups(self.site_rollups[site_id] for site_id, _ in sites)
+        write_rollups(portfolio_rollups, os.path.join(self.output_dir, PORTFOLIO_ROLLUPS))
+        self.summary = summarize(portfolio_rollups, sites=[site_id for site_id, _ in sites],
+                                 factor_table_version=self.shared.factor_tables.version_label)
+        write_summary(self.summary, os.path.join(self.output_dir, PORTFOLIO_SUMMARY))
+
+        # Persist embeddings and conversions gathered across all sites once
+        self.shared.save_embedding_cache()
+        self.shared.conversion_cache.save()
+        self.shared.save_route_cache()
+        return rollup
+
+
+def main(argv: Optional[List[str]] = None):
+    """Batch execution entry point"""
+    parser = argparse.ArgumentParser(description="Run CarbonMatch for a portfolio of construction sites")
+    parser.add_argument('manifest', help="site manifest CSV (columns: site;deliveries)")
+    parser.add_argument('--oekobaudat', default="oekobaudat.csv", help="Ökobaudat database CSV")
+    parser.add_argument('--output-dir', default=PORTFOLIO_DIR, help=f"output directory (default: {PORTFOLIO_DIR})")
+    parser.add_argument('--workers', type=int, default=1, help="sites processed concurrently (default: 1)")
+    parser.add_argument('--factors', default=None, help="conversion factor tables JSON (default: carbomatch_factors.json)")
+    parser.add_argument('--transport', default=None, help="transport vehicles JSON (default: carbomatch_transport.json)")
+    parser.add_argument('--distances', default=None, help="supplier → site distance table CSV (site = manifest site id)")
+    parser.add_argument('--geocodes', default=None, help="supplier / site coordinates CSV (default: carbomatch_geocodes.csv)")
+    parser.add_argument('--routing-url', default=None, help="OSRM server for road distances (default: geodesic × detour)")
+    parser.add_argument('--parquet', action='store_true',
+                        help=f"also write the typed report dataset {PORTFOLIO_DATASET}, partitioned by site")
+    parser.add_argument('--partition-by', type=lambda value: [col.strip() for col in value.split(',') if col.strip()],
+                        default=None, metavar='COLUMNS', help="further partition columns after site (e.g. Lieferant)")
+    parser.add_argument('--store', nargs='?', const=STORE_FILE, default=None, metavar='PATH',
+                        help=f"also load all site rows into the SQLite report store (default: {STORE_FILE})")
+    parser.add_argument('--history', nargs='?', const=HISTORY_DIR, default=None, metavar='DIR',
+                        help=f"also record every site run for carbomatch_history.py diffs (default: {HISTORY_DIR}/)")
+    args = parser.parse_args(argv)
+    configure_logging()
+
+    sites = load_site_manifest(args.manifest)
+    print(f"🏗️  CarbonMatch portfolio run: {len(sites)} sites, {args.workers} worker(s)")
+
+    runner = PortfolioRunner(oekobaudat_path=args.oekobaudat, api_key=SUBSCRIPTION_KEY,
+                             output_dir=args.output_dir, factors_path=args.factors,
+                             transport_path=args.transport, distances_path=args.distances,
+                             geocodes_path=args.geocodes,
+                             router=OSRMRouter(args.routing_url) if args.routing_url else None,
+                             parquet=args.parquet, partition_by=args.partition_by, store_path=args.store,
+                             history_dir=args.history)
+    rollup = runner.run(sites, workers=args.workers)
+
+    total = rollup.iloc[-1]
+    print(f"\n📊 PORTFOLIO TOTAL CO₂e: {total['total_co2e']:,.2f} kg CO₂e "
+          f"(A1-A3 {total['calculated_co2e_a1_a3']:,.2f} | A4 {total['calculated_co2e_a4']:,.2f})")
+    print(f"📄 Rollup exported to: {os.path.join(args.output_dir, ROLLUP_FILE)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,293 @@
+#!/usr/bin/env python3
+"""
+CarbonMatch - Benchmarks
+========================
+
+Small benchmark harness for performance-sensitive paths.
+
+Usage:
+    python carbomatch_bench.py import [--repeat 5]
+    python carbomatch_bench.py uncertainty [--rows 100000] [--samples 1000]
+    python carbomatch_bench.py transport [--rows 1000000] [--suppliers 2000] [--sites 200]
+    python carbomatch_bench.py report [--rows 1000000]
+    python carbomatch_bench.py xlsx [--rows 50000]
+
+Benchmarks:
+- import: cold-process wall time of `import carbomatch_pipeline`, the short
+  `status` / `cache` CLI commands, and a pandas+numpy import for reference
+- uncertainty: Monte Carlo sampling (carbomatch_uncertainty.simulate_co2e)
+  over synthetic rows with 5 match candidates each
+- transport: A4 recomputation of a synthetic portfolio after a distance
+  table update (carbomatch_transport.TransportModel.apply)
+- report: streaming a synthetic portfolio report to CSV, gzip CSV, Parquet
+  and a site-partitioned dataset (carbomatch_report.ReportWriter) and loading
+  it back (read_report, full and with a dashboard-style column projection)
+- xlsx: exporting a synthetic report with status text to XLSX
+  (carbomatch_xlsx, with and without per-supplier sheets) against the CSV
+  export and openpyxl's write-only mode - wall time and peak traced memory
+"""
+
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import time
+from typing import Dict, List, Optional
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+
+def time_command(cmd: List[str], repeat: int) -> Dict[str, float]:
+    """
+    Run a command in fresh processes and time it
+
+    Returns:
+        Dict with median and min wall time in milliseconds
+    """
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        subprocess.run(cmd, cwd=HERE, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, check=True)
+        timings.append((time.perf_counter() - start) * 1000)
+    return {'median_ms': statistics.median(timings), 'min_ms': min(timings)}
+
+
+def bench_import(repeat: int) -> None:
+    """Import-time benchmark for the pipeline module and short CLI commands"""
+    python = sys.executable
+    cases = [
+        ("python (baseline)", [python, '-c', 'pass']),
+        ("import carbomatch_pipeline", [python, '-c', 'import carbomatch_pipeline']),
+        ("carbomatch_pipeline.py status", [python, 'carbomatch_pipeline.py', 'status']),
+        ("carbomatch_pipeline.py cache", [python, 'carbomatch_pipeline.py', 'cache']),
+        ("import pandas, numpy (reference)", [python, '-c', 'import pandas, numpy']),
+    ]
+
+    print(f"⏱️  Import-time benchmark ({repeat} fresh processes each)")
+    for label, cmd in cases:
+        result = time_command(cmd, repeat)
+        print(f"   • {label:<36} median {result['median_ms']:8.1f} ms | min {result['min_ms']:8.1f} ms")
+
+
+def bench_uncertainty(rows: int, samples: int, articles: int) -> None:
+    """Monte Carlo throughput on synthetic rows (5 candidates, mixed distributions)"""
+    import numpy as np
+    from carbomatch_uncertainty import DEFAULT_UNCERTAINTY, candidate_probabilities, simulate_co2e
+
+    rng = np.random.default_rng(0)
+    top_k = 5
+    base = rng.gamma(2.0, 100.0, (rows, top_k))
+    dist = rng.integers(0, 3, (articles, top_k)).astype(np.int8)
+    spread = rng.uniform(0.0, 0.5, (articles, top_k))
+    probabilities = candidate_probabilities(rng.uniform(0.7, 0.9, (articles, top_k)), 0.01)
+    artikel_codes = rng.integers(0, articles, rows)
+    suppliers = rng.integers(0, 50, rows)
+
+    print(f"⏱️  Uncertainty benchmark ({rows:,} rows × {samples:,} samples, {articles:,} articles)")
+    start = time.perf_counter()
+    simulate_co2e(base, dist, spread, probabilities, artikel_codes, suppliers, samples,
+                  DEFAULT_UNCERTAINTY['gwp'])
+    elapsed = time.perf_counter() - start
+    print(f"   • simulate_co2e {elapsed:8.2f} s | {rows * samples / elapsed / 1e6:,.1f} M row-samples/s")
+
+
+def bench_transport(rows: int, suppliers: int, sites: int) -> None:
+    """A4 for a synthetic portfolio, before and after replacing the distance table"""
+    import numpy as np
+    import pandas as pd
+    from carbomatch_transport import load_transport_model
+
+    rng = np.random.default_rng(0)
+    supplier_names = np.array([f"Supplier {i}" for i in range(suppliers)], dtype=object)
+    site_names = np.array([f"Site {i}" for i in range(sites)], dtype=object)
+    lieferant = pd.Series(supplier_names[rng.integers(0, suppliers, rows)])
+    site = pd.Series(site_names[rng.integers(0, sites, rows)])
+    mass = pd.Series(rng.gamma(2.0, 500.0, rows))
+
+    model = load_transport_model()
+    vehicles = np.array(list(model.vehicle_factors), dtype=object)
+
+    def distance_table(seed: int) -> pd.DataFrame:
+        table_rng = np.random.default_rng(seed)
+        pairs = pd.DataFrame({'Lieferant': lieferant, 'site': site}).drop_duplicates().sample(frac=0.5, random_state=seed)
+        pairs['distance_km'] = table_rng.uniform(5, 600, len(pairs))
+        pairs['vehicle'] = vehicles[table_rng.integers(0, len(vehicles), len(pairs))]
+        supplier_rows = pd.DataFrame({'Lieferant': supplier_names, 'site': '',
+                                      'distance_km': table_rng.uniform(5, 600, suppliers), 'vehicle': ''})
+        return pd.concat([pairs, supplier_rows], ignore_index=True)
+
+    print(f"⏱️  Transport benchmark ({rows:,} rows, {suppliers:,} suppliers × {sites:,} sites)")
+    for label, seed in [("initial table", 1), ("updated table", 2)]:
+        table = distance_table(seed)
+        start = time.perf_counter()
+        transport = model.with_distances(table).apply(lieferant, mass, site=site)
+        elapsed = time.perf_counter() - start
+        print(f"   • {label:<14} {len(table):>9,} entries {elapsed:8.3f} s | "
+              f"A4 {transport['calculated_co2e_a4'].sum():,.0f} kg CO₂e")
+
+
+def synthetic_report(rows: int, suppliers: int = 500, sites: int = 50):
+    """Report frame with REPORT_COLUMNS and realistic value repetition"""
+    import numpy as np
+    import pandas as pd
+    from carbomatch_report import REPORT_COLUMNS, SITE_COLUMN, type_report
+
+    rng = np.random.default_rng(0)
+    articles = np.array([f"Artikel {i} Betonstahl {i % 40} mm" for i in range(20000)], dtype=object)
+
+    def labels(prefix: str, n: int) -> np.ndarray:
+        return np.array([f"{prefix} {i}" for i in range(n)], dtype=object)[rng.integers(0, n, rows)]
+
+    df = pd.DataFrame({col: rng.gamma(2.0, 100.0, rows) for col in REPORT_COLUMNS})
+    for col, prefix, n in [('Lieferant', 'Supplier', suppliers), ('Einheit', 'unit', 12),
+                           ('matched_material', 'Material', 3000), ('matched_category', 'Category', 40),
+                           ('matched_oeko_unit', 'ref', 5), ('distance_source', 'source', 5),
+                           ('transport_vehicle', 'vehicle', 8), ('converted_unit', 'cu', 4),
+                           ('factor_table_version', 'v', 1)]:
+        df[col] = labels(prefix, n)
+    df['Artikel'] = articles[rng.integers(0, len(articles), rows)]
+    df['Artikel-Nummer'] = labels('A', 20000)
+    df['delivery_fingerprint'] = [f"{i:016x}" for i in rng.integers(0, 2**62, rows)]
+    for col in ['mass_source', 'calculation_code', 'conversion_path']:
+        df[col] = rng.integers(0, 4, rows)
+    df[SITE_COLUMN] = labels('Site', sites)
+    return type_report(df)
+
+
+def bench_report(rows: int, directory: str) -> None:
+    """Report export and load times per format"""
+    from carbomatch_report import SITE_COLUMN, ReportWriter, read_report
+
+    df = synthetic_report(rows)
+    csv_path = os.path.join(directory, 'bench_report.csv')
+    gzip_path = os.path.join(directory, 'bench_report.csv.gz')
+    parquet_path = os.path.join(directory, 'bench_report.parquet')
+    dataset_path = os.path.join(directory, 'bench_report_by_site')
+    columns = ['Lieferant', 'Artikel', 'Menge', 'Einheit', 'mass_kg', 'calculated_co2e_a1_a3',
+               'calculated_co2e_a4', 'total_co2e', 'calculation_code', 'conversion_path']
+
+    print(f"⏱️  Report benchmark ({rows:,} rows × {df.shape[1]} columns)")
+    writers = [
+        ("CSV", csv_path, None),
+        ("CSV gzip", gzip_path, None),
+        ("Parquet", parquet_path, None),
+        ("Parquet by site", dataset_path, [SITE_COLUMN]),
+    ]
+    for label, path, partition_by in writers:
+        start = time.perf_counter()
+        with ReportWriter(path, columns=list(df.columns), partition_by=partition_by) as writer:
+            writer.write(df)
+        written = time.perf_counter() - start
+        size = (sum(os.path.getsize(os.path.join(root, name)) for root, _, names in os.walk(path) for name in names)
+                if os.path.isdir(path) else os.path.getsize(path))
+        start = time.perf_counter()
+        read_report(path)
+        full = time.perf_counter() - start
+        start = time.perf_counter()
+        read_report(path, columns=columns)
+        projected = time.perf_counter() - start
+        print(f"   • {label:<16} write {written:6.2f} s | {size / 1e6:8.1f} MB | "
+              f"load {full:6.2f} s | {len(columns)} columns {projected:6.2f} s")
+    start = time.perf_counter()
+    site = read_report(dataset_path, columns=columns, filters=[(SITE_COLUMN, '==', 'Site 0')])
+    print(f"   • one site of the dataset: {len(site):,} rows in {time.perf_counter() - start:6.3f} s")
+
+
+def bench_xlsx(rows: int, directory: str) -> None:
+    """XLSX export time and peak memory against CSV and openpyxl's write-only mode"""
+    import tracemalloc
+    import numpy as np
+    from carbomatch_lazy import module_available
+    from carbomatch_report import ReportWriter
+
+    df = synthetic_report(rows)
+    # Long, repeated status texts as in an audit export
+    statuses = np.array([f"Success: Converted: {i} m² × 0.0{i % 9 + 1}m × {i % 50 * 25 + 400}.0 kg/m³ = {i * 1.5:.2f} kg"
+                         for i in range(2000)], dtype=object)
+    df['calculation_status'] = statuses[np.random.default_rng(1).integers(0, len(statuses), rows)]
+
+    def openpyxl_write_only(path: str) -> None:
+        import openpyxl
+
+        workbook = openpyxl.Workbook(write_only=True)
+        sheet = workbook.create_sheet('Report')
+        sheet.append(list(df.columns))
+        columns = [df[col].astype(object).where(df[col].notna(), None).tolist() for col in df.columns]
+        for row in zip(*columns):
+            sheet.append(row)
+        workbook.save(path)
+
+    def report_writer(path: str, sheet_by: Optional[str] = None):
+        def write(_: str) -> None:
+            with ReportWriter(path, columns=list(df.columns), sheet_by=sheet_by) as writer:
+                writer.write(df)
+        return write
+
+    cases = [
+        ("CSV", os.path.join(directory, 'bench_report.csv'), None),
+        ("XLSX", os.path.join(directory, 'bench_report.xlsx'), None),
+        ("XLSX + supplier sheets", os.path.join(directory, 'bench_report_suppliers.xlsx'), 'Lieferant'),
+    ]
+    print(f"⏱️  XLSX export benchmark ({rows:,} rows × {df.shape[1]} columns)")
+    runs = [(label, path, report_writer(path, sheet_by)) for label, path, sheet_by in cases]
+    if module_available("openpyxl"):
+        path = os.path.join(directory, 'bench_openpyxl.xlsx')
+        runs.append(("openpyxl write-only", path, openpyxl_write_only))
+    for label, path, write in runs:
+        start = time.perf_counter()
+        write(path)
+        elapsed = time.perf_counter() - start
+        # Second pass traced: tracing slows the export, so it is not timed
+        tracemalloc.start()
+        write(path)
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        print(f"   • {label:<24} {elapsed:7.2f} s | peak {peak / 1e6:8.1f} MB | {os.path.getsize(path) / 1e6:8.1f} MB file")
+
+
+def main(argv: Optional[List[str]] = None):
+    """Benchmark entry point"""
+    parser = argparse.ArgumentParser(description="CarbonMatch benchmarks")
+    subparsers = parser.add_subparsers(dest='benchmark', required=True)
+
+    import_parser = subparsers.add_parser('import', help="module import and CLI startup time")
+    import_parser.add_argument('--repeat', type=int, default=5, help="processes per case (default: 5)")
+
+    uncertainty_parser = subparsers.add_parser('uncertainty', help="Monte Carlo uncertainty throughput")
+    uncertainty_parser.add_argument('--rows', type=int, default=100000, help="rows (default: 100000)")
+    uncertainty_parser.add_argument('--samples', type=int, default=1000, help="draws (default: 1000)")
+    uncertainty_parser.add_argument('--articles', type=int, default=20000, help="distinct articles (default: 20000)")
+
+    transport_parser = subparsers.add_parser('transport', help="A4 recomputation after a distance table update")
+    transport_parser.add_argument('--rows', type=int, default=1000000, help="rows (default: 1000000)")
+    transport_parser.add_argument('--suppliers', type=int, default=2000, help="distinct suppliers (default: 2000)")
+    transport_parser.add_argument('--sites', type=int, default=200, help="distinct sites (default: 200)")
+
+    report_parser = subparsers.add_parser('report', help="report export and load per format")
+    report_parser.add_argument('--rows', type=int, default=1000000, help="rows (default: 1000000)")
+    report_parser.add_argument('--dir', default=None, help="scratch directory (default: a temporary one)")
+
+    xlsx_parser = subparsers.add_parser('xlsx', help="XLSX export against CSV and openpyxl write-only")
+    xlsx_parser.add_argument('--rows', type=int, default=50000, help="rows (default: 50000)")
+    xlsx_parser.add_argument('--dir', default=None, help="scratch directory (default: a temporary one)")
+
+    args = parser.parse_args(argv)
+    if args.benchmark == 'import':
+        bench_import(args.repeat)
+    elif args.benchmark == 'uncertainty':
+        bench_uncertainty(args.rows, args.samples, args.articles)
+    elif args.benchmark == 'transport':
+        bench_transport(args.rows, args.suppliers, args.sites)
+    elif args.benchmark in ('report', 'xlsx'):
+        bench = bench_report if args.benchmark == 'report' else bench_xlsx
+        if args.dir:
+            bench(args.rows, args.dir)
+        else:
+            import tempfile
+            with tempfile.TemporaryDirectory() as directory:
+                bench(args.rows, directory)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,162 @@
+#!/usr/bin/env python3
+"""
+CarbonMatch - Stage Checkpoints
+===============================
+
+Persists the output frame of a pipeline stage (validated deliveries,
+cleaned Ökobaudat catalog, matched and calculated frames) so a later run can
+resume from it instead of repeating ingestion and embedding.
+
+Each checkpoint is keyed by a hash of everything its stage depends on:
+input file contents, the key of the previous stage and the relevant
+configuration (embedding model, factor table version). A checkpoint is valid
+only for exactly that key, so changing an input or a setting reruns the
+stage and everything after it.
+
+Checkpoints belong to a scope (checkpoint_scope(): site id and delivery
+file), and pruning keeps the newest checkpoints per stage and scope, so
+runs of different sites do not evict each other's checkpoints.
+
+Frames are written as Parquet; frames pyarrow cannot store (mixed-type
+object columns) fall back to pickle.
+"""
+
+from __future__ import annotations
+
+import glob
+import hashlib
+import json
+import logging
+import os
+from typing import Dict, List, Optional
+
+from carbomatch_lazy import lazy_import
+
+pd = lazy_import("pandas")
+
+logger = logging.getLogger(__name__)
+
+CHECKPOINT_DIR = "carbomatch_checkpoints"
+CHECKPOINT_FORMAT = 2          # bump when the stored frames change shape
+DEFAULT_KEEP = 3               # checkpoints kept per stage and scope (newest first)
+
+STAGE_DELIVERIES = 'deliveries'
+STAGE_REJECTS = 'rejects'
+STAGE_CATALOG = 'catalog'
+STAGE_MATCHED = 'matched'
+STAGE_CALCULATED = 'calculated'
+
+FORMATS = ['parquet', 'pkl']
+
+
+def file_digest(path: str) -> str:
+    """SHA-256 of a file's contents (hex, 16 characters)"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()[:16]
+
+
+def frame_digest(values) -> str:
+    """Order-sensitive hash of a frame's or column's values"""
+    hashes = pd.util.hash_pandas_object(values, index=False)
+    return hashlib.sha256(hashes.to_numpy().tobytes()).hexdigest()[:16]
+
+
+def stage_key(*parts) -> str:
+    """Checkpoint key from the stage's inputs and configuration"""
+    payload = json.dumps([CHECKPOINT_FORMAT, *parts], default=str)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()[:16]
+
+
+def checkpoint_scope(*parts) -> str:
+    """Scope id of a run's checkpoints (e.g. site id and delivery file; '' for none)"""
+    if not any(parts):
+        return ''
+    payload = json.dumps([str(part or '') for part in parts])
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()[:8]
+
+
+class CheckpointStore:
+    """Directory of stage checkpoints (`<stage>[-<scope>]-<key>.parquet|pkl`)"""
+
+    def __init__(self, directory: str = CHECKPOINT_DIR, keep: int = DEFAULT_KEEP):
+        """
+        Args:
+            directory: Checkpoint directory (created on first save)
+            keep: Checkpoints kept per stage and scope; older ones are deleted on save
+        """
+        self.directory = directory
+        self.keep = keep
+
+    def path(self, stage: str, key: str, fmt: str, scope: str = '') -> str:
+        name = f"{stage}-{scope}-{key}" if scope else f"{stage}-{key}"
+        return os.path.join(self.directory, f"{name}.{fmt}")
+
+    def save(self, stage: str, key: str, frame: pd.DataFrame, scope: str = '') -> str:
+        """
+        Write a stage checkpoint atomically
+
+        Args:
+            stage: Stage name
+            key: Stage key (stage_key())
+            frame: Stage output
+            scope: Scope the checkpoint is pruned in (checkpoint_scope())
+
+        Returns:
+            Path of the written checkpoint
+        """
+        os.makedirs(self.directory, exist_ok=True)
+        path = self.path(stage, key, 'parquet', scope)
+        tmp_path = f"{path}.tmp"
+        try:
+            frame.to_parquet(tmp_path, index=False)
+        except (ImportError, ValueError, TypeError) as e:
+            # pyarrow missing or a column it cannot type
+            logger.info(f"Checkpoint {stage} stored as pickle ({type(e).__name__}: {e})")
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            path = self.path(stage, key, 'pkl', scope)
+            tmp_path = f"{path}.tmp"
+            frame.to_pickle(tmp_path)
+        os.replace(tmp_path, path)
+        self._prune(stage, scope)
+        logger.info(f"💾 Checkpoint {stage} ({len(frame)} rows) saved to {path}")
+        return path
+
+    def load(self, stage: str, key: str, scope: str = '') -> Optional[pd.DataFrame]:
+        """Checkpoint of a stage for exactly this key (within a scope), or None"""
+        for fmt in FORMATS:
+            path = self.path(stage, key, fmt, scope)
+            if not os.path.exists(path):
+                continue
+            try:
+                frame = pd.read_parquet(path) if fmt == 'parquet' else pd.read_pickle(path)
+            except Exception as e:
+                logger.warning(f"Ignoring unreadable checkpoint {path}: {e}")
+                return None
+            os.utime(path)  # keep recently used checkpoints when pruning
+            logger.info(f"⏩ Resumed {stage} ({len(frame)} rows) from {path}")
+            return frame
+        return None
+
+    def entries(self, stage: Optional[str] = None) -> List[Dict]:
+        """Checkpoint files (stage, scope, key, path, size_bytes, modified), newest first"""
+        pattern = f"{stage}-*" if stage else "*-*"
+        entries = []
+        for path in glob.glob(os.path.join(self.directory, pattern)):
+            name, fmt = os.path.basename(path).rsplit('.', 1)
+            if fmt not in FORMATS:
+                continue
+            entry_stage, rest = name.split('-', 1)
+            scope, key = rest.rsplit('-', 1) if '-' in rest else ('', rest)
+            entries.append({'stage': entry_stage, 'scope': scope, 'key': key, 'path': path,
+                            'size_bytes': os.path.getsize(path), 'modified': os.path.getmtime(path)})
+        return sorted(entries, key=lambda entry: entry['modified'], reverse=True)
+
+    def _prune(self, stage: str, scope: str = '') -> None:
+        """Delete all but the `keep` most recent checkpoints of a stage in a scope"""
+        entries = [entry for entry in self.entries(stage) if entry['scope'] == scope]
+        for entry in entries[self.keep:]:
+            os.remove(entry['path'])
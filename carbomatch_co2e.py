@@ -0,0 +1,203 @@
+#!/usr/bin/env python3
+"""
+CarbonMatch - Columnar CO₂e Engine
+==================================
+
+Material CO₂e (A1-A3) as array arithmetic over typed columns:
+
+    calculated_co2e_a1_a3 = quantity × GWP    (kg / m³ rows)
+
+The quantity is the row mass for kg-referenced GWP and the volume for m³
+(carbomatch_mass.reference_quantity), so an unconverted count of pieces,
+bundles or metres is never multiplied by a per-kg factor. Rows without one
+get CALC_UNIT_MISMATCH.
+
+Each row gets an integer `calculation_code` instead of a status string. The
+human-readable audit text ("Success: Converted: ...", "Error: GWP missing")
+is rendered on demand from the code, the conversion path and the factor
+columns, so the hot path never formats strings. The report stores the same
+numeric STATUS_COLUMNS; readers render the text only for the rows they show.
+"""
+
+from __future__ import annotations
+
+from carbomatch_lazy import lazy_import
+from carbomatch_conversion import (
+    PATH_AREA_TO_MASS, PATH_AREA_TO_VOLUME, PATH_LINEAR_TO_MASS, PATH_MESH_TO_MASS, PATH_PIECE_TO_MASS,
+    render_conversion_status,
+)
+from carbomatch_mass import MASS_DELIVERY, MASS_VOLUME_DENSITY, derive_mass, reference_quantity
+
+np = lazy_import("numpy")
+pd = lazy_import("pandas")
+
+# Calculation reason codes
+CALC_SUCCESS = 0            # CO₂e calculated
+CALC_GWP_MISSING = 1        # matched Ökobaudat entry has no GWP
+CALC_INVALID_QUANTITY = 2   # converted quantity is zero or negative
+CALC_UNSUPPORTED_UNIT = 3   # quantity could not be converted to kg / m³
+CALC_UNIT_MISMATCH = 4      # delivery unit gives no mass / volume for the kg / m³ reference unit
+
+CALCULATION_CODE_LABELS = {
+    CALC_SUCCESS: 'Success',
+    CALC_GWP_MISSING: 'Error: GWP missing',
+    CALC_INVALID_QUANTITY: 'Error: Invalid quantity after conversion',
+    CALC_UNSUPPORTED_UNIT: 'Error: Unit not supported',
+    CALC_UNIT_MISMATCH: 'Error: No mass or volume for the delivery unit',
+}
+
+CALCULATION_COLUMNS = ['calculation_code', 'gwp_factor', 'calculated_co2e_a1_a3']
+
+# Version of the calculation rules; bump when results change - calculated-stage
+# checkpoints of other versions are not reused
+CALCULATION_VERSION = 2
+
+# Numeric audit columns written to the report instead of the status text;
+# together with Menge and matched_oeko_unit they reproduce it exactly
+STATUS_COLUMNS = [
+    'calculation_code', 'conversion_path', 'converted_unit', 'unit_quantity', 'pack_factor',
+    'converted_quantity', 'thickness_m', 'density_kg_m3', 'weight_per_piece_kg',
+    'weight_per_meter_kg', 'mesh_weight_kg_m2',
+]
+
+CO2E_UNITS = ['kg', 'm3']
+CONVERTED_PATHS = [PATH_AREA_TO_MASS, PATH_AREA_TO_VOLUME, PATH_MESH_TO_MASS, PATH_PIECE_TO_MASS, PATH_LINEAR_TO_MASS]
+
+
+def calculate_co2e(gwp: pd.Series, conversions: pd.DataFrame, quantity=None) -> pd.DataFrame:
+    """
+    Calculate material CO₂e for all rows at once
+
+    Args:
+        gwp: Typed GWP per matched reference unit (NaN when missing)
+        conversions: Output of carbomatch_conversion.convert_units()
+        quantity: Quantity in the reference unit per row
+                  (carbomatch_mass.reference_quantity); NaN marks a unit
+                  mismatch. Defaults to `converted_quantity`
+
+    Returns:
+        Frame aligned with conversions.index holding CALCULATION_COLUMNS
+    """
+    gwp_factor = pd.to_numeric(gwp, errors='coerce').to_numpy(dtype=float)
+    converted = conversions['converted_quantity'].to_numpy(dtype=float)
+    quantity = converted if quantity is None else np.asarray(quantity, dtype=float)
+    supported = np.asarray(conversions['converted_unit'].isin(CO2E_UNITS), dtype=bool)
+    mismatch = supported & np.isnan(quantity) & ~np.isnan(converted)
+
+    # Precedence mirrors the checks of the single-row calculation
+    code = np.select(
+        [np.isnan(gwp_factor), mismatch, quantity <= 0, ~supported],
+        [CALC_GWP_MISSING, CALC_UNIT_MISMATCH, CALC_INVALID_QUANTITY, CALC_UNSUPPORTED_UNIT],
+        default=CALC_SUCCESS,
+    ).astype(np.int8)
+
+    co2e = quantity * gwp_factor
+    co2e = np.where((code == CALC_SUCCESS) & (co2e > 0), co2e, 0.0)
+
+    return pd.DataFrame({
+        'calculation_code': code,
+        'gwp_factor': gwp_factor,
+        'calculated_co2e_a1_a3': co2e,
+    }, index=conversions.index)
+
+
+def calculate_frame_co2e(frame: pd.DataFrame, conversions: pd.DataFrame) -> pd.DataFrame:
+    """
+    Row masses and material CO₂e of a matched frame
+
+    Args:
+        frame: Matched frame with `matched_gwp` and the columns
+               carbomatch_mass.derive_mass() reads
+        conversions: Conversion columns aligned with frame
+
+    Returns:
+        Frame aligned with frame.index holding CALCULATION_COLUMNS and
+        carbomatch_mass.MASS_COLUMNS
+    """
+    mass = derive_mass(frame, conversions)
+    quantity = reference_quantity(frame, conversions, mass['mass_kg'])
+    results = calculate_co2e(frame['matched_gwp'], conversions, quantity)
+    return pd.concat([results, mass], axis=1)
+
+
+def render_calculation_status(menge: pd.Series, oeko_unit: pd.Series, conversions: pd.DataFrame,
+                              calculation_code: pd.Series) -> pd.Series:
+    """
+    Render the audit text of each row from its calculation code and factors
+
+    Args:
+        menge: Delivery quantities
+        oeko_unit: Raw matched Ökobaudat units
+        conversions: Conversion columns (see carbomatch_conversion.CONVERSION_COLUMNS),
+                     optionally with `mass_source` (see carbomatch_mass)
+        calculation_code: Codes returned by calculate_co2e()
+
+    Returns:
+        Series of strings such as "Success: kg unit" or "Error: GWP missing"
+    """
+    code = calculation_code.to_numpy()
+    converted_unit = conversions['converted_unit'].astype(object).to_numpy()
+    converted_path = np.isin(conversions['conversion_path'].to_numpy(), CONVERTED_PATHS)
+    conversion_status = render_conversion_status(menge, oeko_unit, conversions).to_numpy(dtype=object)
+
+    status = np.full(len(code), CALCULATION_CODE_LABELS[CALC_GWP_MISSING], dtype=object)
+
+    success = code == CALC_SUCCESS
+    status[success & converted_path] = "Success: " + conversion_status[success & converted_path]
+    status[success & ~converted_path & (converted_unit == 'kg')] = "Success: kg unit"
+    status[success & ~converted_path & (converted_unit == 'm3')] = "Success: m³ unit"
+    if 'mass_source' in conversions.columns:
+        # The delivered mass / volume, not the conversion, gave the quantity (see reference_quantity)
+        source = conversions['mass_source'].to_numpy()
+        status[success & (source == MASS_DELIVERY) & (converted_unit == 'kg')] = "Success: delivered mass"
+        status[success & (source == MASS_DELIVERY) & (converted_unit == 'm3')] = "Success: delivered mass / density"
+        status[success & (source == MASS_VOLUME_DENSITY) & (converted_unit == 'kg')] = "Success: delivered m³ × density"
+
+    status[code == CALC_INVALID_QUANTITY] = CALCULATION_CODE_LABELS[CALC_INVALID_QUANTITY]
+    status[code == CALC_UNIT_MISMATCH] = CALCULATION_CODE_LABELS[CALC_UNIT_MISMATCH]
+
+    m = code == CALC_UNSUPPORTED_UNIT
+    if m.any():
+        status[m] = ("Error: Unit '" + converted_unit[m].astype(str).astype(object) + "' not supported - "
+                     + conversion_status[m])
+
+    return pd.Series(status, index=conversions.index, dtype=object)
+
+
+def render_report_status(report: pd.DataFrame) -> pd.Series:
+    """
+    Render `calculation_status` for report rows (e.g. read back from the CSV)
+
+    Call on the rows actually displayed or exported; reports written before
+    the STATUS_COLUMNS existed keep their stored text.
+
+    Args:
+        report: Frame with Menge, matched_oeko_unit and STATUS_COLUMNS, or a
+                `calculation_status` column
+
+    Returns:
+        Series of status strings aligned with report.index
+    """
+    if 'calculation_code' not in report.columns:
+        return report['calculation_status']
+    coded = report['calculation_code'].notna().to_numpy()
+    rows = report[coded]
+    rendered = render_calculation_status(rows['Menge'], rows['matched_oeko_unit'], rows,
+                                         rows['calculation_code'].astype(int))
+    if coded.all():
+        return rendered
+    # Rows merged in from an older report keep their stored text
+    stored = report['calculation_status'] if 'calculation_status' in report.columns else pd.Series(None, index=report.index)
+    return stored.astype(object).where(~coded, rendered.reindex(report.index))
+
+
+def status_labels(calculation_code: pd.Series) -> pd.Series:
+    """Categorical outcome label per row ('Success', 'Error: GWP missing', ...)"""
+    codes = list(CALCULATION_CODE_LABELS)
+    return pd.Series(pd.Categorical(calculation_code, categories=codes).rename_categories(
+        [CALCULATION_CODE_LABELS[c] for c in codes]), index=calculation_code.index)
+
+
+def is_success(calculation_code: pd.Series) -> pd.Series:
+    """Boolean mask of rows with a successful CO₂e calculation"""
+    return calculation_code == CALC_SUCCESS
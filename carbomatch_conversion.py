@@ -0,0 +1,363 @@
+#!/usr/bin/env python3
+"""
+CarbonMatch - Unit Conversion Rule Engine
+=========================================
+
+Vectorized conversion of delivery quantities to the supported kg / m³ units.
+
+The factors come from the versioned tables in carbomatch_factors: ordered
+keyword rules (first match wins) and value tables keyed on dimensions that
+carbomatch_dimensions extracts from the article text (bar diameter, mesh
+type, pack length, piece area). Every table is matched once per *distinct*
+text and the per-text results are gathered back onto the rows through the
+factorize codes. Converting a frame therefore costs a few array operations
+plus one scan per distinct Artikel, material and unit value.
+
+Delivery quantities in packs ("Bund á 200 m") or pieces of a stated size
+("250 x 60 cm") are first expressed in the matched Ökobaudat unit
+(`unit_quantity`, with `pack_factor` recording the multiplier).
+
+Every converted row records the rule that supplied its factor
+(`conversion_rule`, plus `material_rule` for piece weights), so a factor
+change can be applied to the affected rows only.
+"""
+
+from __future__ import annotations
+
+from typing import Optional, Tuple
+
+from carbomatch_lazy import lazy_import
+from carbomatch_dimensions import DIMENSION_COLUMNS, extract_dimensions
+from carbomatch_factors import (
+    AREA_THICKNESS, LINEAR_WEIGHT, MESH_WEIGHT, PIECE_MATERIAL_FACTOR, PIECE_WEIGHT, REBAR_WEIGHT,
+    FactorTables, load_factor_tables,
+)
+
+np = lazy_import("numpy")
+pd = lazy_import("pandas")
+
+# Conversion path codes
+PATH_NONE = 0              # kg / m³ - no conversion needed
+PATH_AREA_TO_MASS = 1      # m² × thickness × density
+PATH_AREA_TO_VOLUME = 2    # m² × thickness (no density available)
+PATH_PIECE_TO_MASS = 3     # pieces × weight per piece
+PATH_LINEAR_TO_MASS = 4    # metres × weight per metre
+PATH_UNKNOWN_UNIT = 5      # no conversion available
+PATH_MESH_TO_MASS = 6      # m² of reinforcement mesh × mesh weight per m²
+
+# Normalized Ökobaudat reference units per conversion family
+DIRECT_UNITS = ['kg', 'm3']
+AREA_UNITS = ['qm', 'm2']
+PIECE_UNITS = ['pcs.', 'pcs', 'stk', 'st', 'stück']
+LINEAR_UNITS = ['m']
+
+# Delivery units (lower-cased `Einheit`) that count packs / single pieces
+PACK_DELIVERY_UNITS = ['bund', 'bündel', 'rolle', 'rolle(n)', 'rollen', 'ring']
+PIECE_DELIVERY_UNITS = ['stk', 'st', 'stück', 'pcs', 'pcs.']
+
+# Smaller sizes are part dimensions (drills, fasteners), not sheet areas
+MIN_PIECE_AREA_M2 = 0.05
+
+# Version of the conversion rules and dimension extraction (carbomatch_dimensions);
+# bump when their results change - cached conversions and calculated-stage
+# checkpoints of other versions are not reused
+CONVERSION_VERSION = 2
+
+# Columns that determine a row's conversion (besides the linear `Menge`)
+KEY_COLUMNS = ['Artikel', 'matched_oeko_unit', 'matched_material', 'matched_rohdichte', 'Einheit']
+
+CONVERSION_COLUMNS = [
+    'unit_norm', 'conversion_path', 'unit_quantity', 'pack_factor', 'converted_quantity', 'converted_unit',
+    'conversion_factor', 'thickness_m', 'density_kg_m3', 'weight_per_piece_kg', 'weight_per_meter_kg',
+    'mesh_weight_kg_m2', 'conversion_rule', 'material_rule',
+]
+
+
+def normalize_unit(unit) -> str:
+    """Normalize an Ökobaudat reference unit ('m³' -> 'm3', 'Stk' -> 'stk', ...)"""
+    return str(unit).strip().lower().replace('^', '').replace('\u00b3', '3').strip()
+
+
+def conversion_keys(df: pd.DataFrame) -> Tuple[np.ndarray, pd.DataFrame]:
+    """
+    Group rows by the values that determine their conversion
+
+    Args:
+        df: Matched frame (see convert_units)
+
+    Returns:
+        Tuple of (key code per row, one representative row per key ordered by
+        code, holding the KEY_COLUMNS plus any DIMENSION_COLUMNS of df)
+    """
+    columns = [col for col in KEY_COLUMNS if col in df.columns]
+    codes = df.groupby(columns, sort=False, dropna=False).ngroup().to_numpy()
+    # Groups are numbered in order of first appearance, so first occurrences are in code order
+    first_rows = np.flatnonzero(~pd.Series(codes).duplicated().to_numpy())
+    carried = columns + [col for col in DIMENSION_COLUMNS if col in df.columns]
+    return codes, df[carried].iloc[first_rows].reset_index(drop=True)
+
+
+def convert_units(df: pd.DataFrame, tables: Optional[FactorTables] = None, cache=None) -> pd.DataFrame:
+    """
+    Convert all rows to kg or m³ using material-specific factors
+
+    Conversion is linear in `Menge`, so factors are computed once per distinct
+    key (see conversion_keys) and multiplied onto the row quantities.
+
+    Args:
+        df: Matched frame with `Menge`, `Artikel`, `matched_oeko_unit`,
+            `matched_material` and `matched_rohdichte`; optionally `Einheit`
+            and DIMENSION_COLUMNS (extracted here when absent)
+        tables: Compiled factor tables (defaults to carbomatch_factors.json)
+        cache: Optional ConversionCache (carbomatch_conversion_cache) that
+               memoizes per-key results across calls and runs
+
+    Returns:
+        Frame aligned with df.index holding CONVERSION_COLUMNS; factor and rule
+        columns are NaN where they do not apply to a row's conversion path
+    """
+    tables = tables or load_factor_tables()
+    codes, keys = conversion_keys(df)
+    keys['Menge'] = 1.0
+    per_key = convert_keys(keys, tables) if cache is None else cache.lookup(keys, tables, convert_keys)
+    return expand_conversions(per_key, codes, df['Menge'], tables)
+
+
+def expand_conversions(per_key: pd.DataFrame, codes: np.ndarray, menge: pd.Series,
+                       tables: FactorTables) -> pd.DataFrame:
+    """
+    Gather per-key conversions (computed at Menge = 1) onto the rows
+
+    Args:
+        per_key: Output of convert_keys() (or a cache lookup), one row per key code
+        codes: Key code per row
+        menge: Delivery quantities, aligned with the rows
+        tables: Factor tables the rule labels refer to
+
+    Returns:
+        Frame aligned with menge.index holding CONVERSION_COLUMNS
+    """
+    quantity = menge.to_numpy(dtype=float)
+    columns = {}
+    for col in CONVERSION_COLUMNS:
+        values = per_key[col]
+        if col in ('conversion_rule', 'material_rule'):
+            labels = pd.Categorical(values.astype(object), categories=tables.rule_labels)
+            columns[col] = pd.Categorical.from_codes(labels.codes[codes], categories=tables.rule_labels)
+        elif col in ('unit_norm', 'converted_unit'):
+            labels = pd.Categorical(values.astype(object))
+            columns[col] = pd.Categorical.from_codes(labels.codes[codes], categories=labels.categories)
+        elif col == 'conversion_path':
+            columns[col] = values.to_numpy(dtype=np.int8)[codes]
+        else:
+            # Cached results hold None for missing factors
+            columns[col] = pd.to_numeric(values, errors='coerce').to_numpy(dtype=float)[codes]
+
+    # Per-key quantities are per unit of Menge; re-apply the gathered factors in
+    # the same order as convert_keys so results match a direct conversion
+    path = columns['conversion_path']
+    unit_quantity = quantity * columns['unit_quantity']
+    volume_m3 = unit_quantity * columns['thickness_m']
+    converted = np.select(
+        [path == PATH_AREA_TO_MASS, path == PATH_AREA_TO_VOLUME, path == PATH_MESH_TO_MASS,
+         path == PATH_PIECE_TO_MASS, path == PATH_LINEAR_TO_MASS],
+        [volume_m3 * columns['density_kg_m3'], volume_m3, unit_quantity * columns['mesh_weight_kg_m2'],
+         unit_quantity * columns['weight_per_piece_kg'], unit_quantity * columns['weight_per_meter_kg']],
+        default=quantity,
+    )
+    with np.errstate(divide='ignore', invalid='ignore'):
+        columns['conversion_factor'] = np.where(quantity != 0, converted / quantity, np.nan)
+    columns['unit_quantity'] = unit_quantity
+    columns['converted_quantity'] = converted
+    return pd.DataFrame(columns, index=menge.index)
+
+
+def convert_keys(df: pd.DataFrame, tables: FactorTables) -> pd.DataFrame:
+    """
+    Apply the conversion rules to every row of df (call on distinct keys)
+
+    Args:
+        df: Rows with `Menge` and the KEY_COLUMNS; optionally DIMENSION_COLUMNS
+        tables: Compiled factor tables
+
+    Returns:
+        Frame aligned with df.index holding CONVERSION_COLUMNS
+    """
+    menge = df['Menge'].to_numpy(dtype=float)
+    rohdichte = pd.to_numeric(df['matched_rohdichte'], errors='coerce').to_numpy(dtype=float)
+
+    # Distinct values are scanned once, results gathered back through the codes
+    unit_codes, unit_uniques = pd.factorize(df['matched_oeko_unit'], use_na_sentinel=False)
+    artikel_codes, artikel_uniques = pd.factorize(df['Artikel'], use_na_sentinel=False)
+    material_codes, material_uniques = pd.factorize(df['matched_material'], use_na_sentinel=False)
+
+    # Several raw spellings can share one normalized unit, so normalized units get their own codes
+    unit_norm_codes, unit_categories = pd.factorize(np.array([normalize_unit(u) for u in unit_uniques], dtype=object))
+    unit_categories = list(unit_categories) + [u for u in DIRECT_UNITS if u not in set(unit_categories)]
+    unit_code = unit_norm_codes[unit_codes]
+    artikel_lower = pd.Series([str(a).lower() for a in artikel_uniques], dtype=object)
+    material_lower = pd.Series([str(m).lower() for m in material_uniques], dtype=object)
+
+    # Dimensions per distinct Artikel (reuse the frame's columns when present)
+    if all(col in df.columns for col in DIMENSION_COLUMNS):
+        first_rows = np.unique(artikel_codes, return_index=True)[1]
+        dimensions = df[DIMENSION_COLUMNS].iloc[first_rows].reset_index(drop=True)
+    else:
+        dimensions = extract_dimensions(pd.Series(artikel_uniques, dtype=object))
+    diameter_mm = dimensions['diameter_mm'].fillna(dimensions['nominal_mm']).to_numpy(dtype=float)
+
+    # Rule index and factor per distinct text; rule codes are global indices into tables.rule_labels
+    thickness_idx = tables[AREA_THICKNESS].match(artikel_lower)
+    piece_idx = tables[PIECE_WEIGHT].match(artikel_lower)
+    material_idx = tables[PIECE_MATERIAL_FACTOR].match(material_lower)
+    rebar_idx, rebar_factor = tables[REBAR_WEIGHT].match_values(diameter_mm)
+    linear_idx = tables[LINEAR_WEIGHT].match(artikel_lower)
+    mesh_idx, mesh_factor = tables[MESH_WEIGHT].match_values(dimensions['mesh_type'].to_numpy(dtype=object))
+    is_rebar = tables[REBAR_WEIGHT].gate_mask(artikel_lower)
+
+    thickness_rule = (tables.offsets[AREA_THICKNESS] + thickness_idx)[artikel_codes]
+    piece_rule = (tables.offsets[PIECE_WEIGHT] + piece_idx)[artikel_codes]
+    material_rule = (tables.offsets[PIECE_MATERIAL_FACTOR] + material_idx)[material_codes]
+    linear_rule = np.where(is_rebar, tables.offsets[REBAR_WEIGHT] + rebar_idx,
+                           tables.offsets[LINEAR_WEIGHT] + linear_idx)[artikel_codes]
+    mesh_rule = (tables.offsets[MESH_WEIGHT] + mesh_idx)[artikel_codes]
+
+    thickness_m = tables[AREA_THICKNESS].factors[thickness_idx][artikel_codes]
+    weight_per_piece_kg = (tables[PIECE_WEIGHT].factors[piece_idx][artikel_codes]
+                           * tables[PIECE_MATERIAL_FACTOR].factors[material_idx][material_codes])
+    weight_per_meter_kg = np.where(is_rebar, rebar_factor, tables[LINEAR_WEIGHT].factors[linear_idx])[artikel_codes]
+    mesh_weight_kg_m2 = mesh_factor[artikel_codes]
+
+    # Resolve the conversion path per row (unit family first, then mesh / density availability)
+    categories = np.array(unit_categories, dtype=object)
+    family = np.select(
+        [np.isin(categories, DIRECT_UNITS), np.isin(categories, AREA_UNITS),
+         np.isin(categories, PIECE_UNITS), np.isin(categories, LINEAR_UNITS)],
+        [PATH_NONE, PATH_AREA_TO_MASS, PATH_PIECE_TO_MASS, PATH_LINEAR_TO_MASS],
+        default=PATH_UNKNOWN_UNIT,
+    ).astype(np.int8)[unit_code]
+    has_density = rohdichte > 0  # False for NaN
+    is_area = family == PATH_AREA_TO_MASS
+    path = np.select(
+        [is_area & ~np.isnan(mesh_weight_kg_m2), is_area & ~has_density],
+        [PATH_MESH_TO_MASS, PATH_AREA_TO_VOLUME],
+        default=family,
+    ).astype(np.int8)
+
+    # Express pack / sized-piece deliveries in the matched unit
+    pack_factor = np.full(len(df), np.nan)
+    if 'Einheit' in df.columns:
+        delivery_codes, delivery_uniques = pd.factorize(df['Einheit'], use_na_sentinel=False)
+        delivery_unit = np.array([str(u).strip().lower() for u in delivery_uniques], dtype=object)
+        is_pack = np.isin(delivery_unit, PACK_DELIVERY_UNITS)[delivery_codes]
+        is_piece = np.isin(delivery_unit, PIECE_DELIVERY_UNITS)[delivery_codes]
+        pack_length_m = dimensions['pack_length_m'].to_numpy(dtype=float)[artikel_codes]
+        piece_area_m2 = dimensions['area_m2'].to_numpy(dtype=float)[artikel_codes]
+        pack_factor = np.select(
+            [is_pack & (family == PATH_LINEAR_TO_MASS), is_piece & is_area & (piece_area_m2 >= MIN_PIECE_AREA_M2)],
+            [pack_length_m, piece_area_m2],
+            default=np.nan,
+        )
+    unit_quantity = np.where(np.isnan(pack_factor), menge, menge * pack_factor)
+
+    volume_m3 = unit_quantity * thickness_m
+    converted = np.select(
+        [path == PATH_AREA_TO_MASS, path == PATH_AREA_TO_VOLUME, path == PATH_MESH_TO_MASS,
+         path == PATH_PIECE_TO_MASS, path == PATH_LINEAR_TO_MASS],
+        [volume_m3 * rohdichte, volume_m3, unit_quantity * mesh_weight_kg_m2,
+         unit_quantity * weight_per_piece_kg, unit_quantity * weight_per_meter_kg],
+        default=menge,
+    )
+    is_mass_path = np.isin(path, [PATH_AREA_TO_MASS, PATH_MESH_TO_MASS, PATH_PIECE_TO_MASS, PATH_LINEAR_TO_MASS])
+    converted_code = np.where(is_mass_path, unit_categories.index('kg'),
+                              np.where(path == PATH_AREA_TO_VOLUME, unit_categories.index('m3'), unit_code))
+
+    is_area_path = (path == PATH_AREA_TO_MASS) | (path == PATH_AREA_TO_VOLUME)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        factor = np.where(menge != 0, converted / menge, np.nan)
+
+    # Rule that supplied each row's factor (-1 = no rule involved)
+    conversion_rule = np.select(
+        [is_area_path, path == PATH_MESH_TO_MASS, path == PATH_PIECE_TO_MASS, path == PATH_LINEAR_TO_MASS],
+        [thickness_rule, mesh_rule, piece_rule, linear_rule],
+        default=-1,
+    )
+    is_converted = is_mass_path | (path == PATH_AREA_TO_VOLUME)
+
+    return pd.DataFrame({
+        'unit_norm': pd.Categorical.from_codes(unit_code, categories=unit_categories),
+        'conversion_path': path,
+        'unit_quantity': np.where(is_converted, unit_quantity, menge),
+        'pack_factor': np.where(is_converted, pack_factor, np.nan),
+        'converted_quantity': converted,
+        'converted_unit': pd.Categorical.from_codes(converted_code, categories=unit_categories),
+        'conversion_factor': factor,
+        'thickness_m': np.where(is_area_path, thickness_m, np.nan),
+        'density_kg_m3': np.where(path == PATH_AREA_TO_MASS, rohdichte, np.nan),
+        'weight_per_piece_kg': np.where(path == PATH_PIECE_TO_MASS, weight_per_piece_kg, np.nan),
+        'weight_per_meter_kg': np.where(path == PATH_LINEAR_TO_MASS, weight_per_meter_kg, np.nan),
+        'mesh_weight_kg_m2': np.where(path == PATH_MESH_TO_MASS, mesh_weight_kg_m2, np.nan),
+        'conversion_rule': pd.Categorical.from_codes(conversion_rule, categories=tables.rule_labels),
+        'material_rule': pd.Categorical.from_codes(np.where(path == PATH_PIECE_TO_MASS, material_rule, -1),
+                                                   categories=tables.rule_labels),
+    }, index=df.index)
+
+
+def _fmt(values: np.ndarray, spec: str) -> np.ndarray:
+    """Format a float array with a printf-style spec ('%.2f'), or repr-style for spec ''"""
+    if spec:
+        return np.char.mod(spec, values).astype(object)
+    return pd.Series(values, dtype=float).astype(str).to_numpy(dtype=object)
+
+
+def render_conversion_status(menge: pd.Series, oeko_unit: pd.Series, conversions: pd.DataFrame) -> pd.Series:
+    """
+    Render the human-readable conversion audit text for each row
+
+    Args:
+        menge: Delivery quantities (as delivered, before pack scaling)
+        oeko_unit: Raw matched Ökobaudat units (used for unknown-unit messages)
+        conversions: Output of convert_units()
+
+    Returns:
+        Series of strings such as "Converted: 10.0 pcs × 1.000 kg/pc = 10.00 kg"
+    """
+    path = conversions['conversion_path'].to_numpy()
+    q = _fmt(conversions['unit_quantity'].to_numpy(dtype=float), '')
+    packed = conversions['pack_factor'].notna().to_numpy()
+    if packed.any():
+        # "2.0 × 200.0 m/pack = 400.0" - the quantity in the matched unit follows
+        pack_unit = np.where(path[packed] == PATH_LINEAR_TO_MASS, " m/pack = ", " m²/pc = ").astype(object)
+        q[packed] = (_fmt(menge.to_numpy(dtype=float)[packed], '') + " × "
+                     + _fmt(conversions['pack_factor'].to_numpy()[packed].round(6), '') + pack_unit
+                     + _fmt(conversions['unit_quantity'].to_numpy(dtype=float)[packed].round(6), ''))
+    out = _fmt(conversions['converted_quantity'].to_numpy(dtype=float), '%.2f')
+    status = np.full(len(path), "No conversion needed", dtype=object)
+
+    m = path == PATH_AREA_TO_MASS
+    if m.any():
+        status[m] = ("Converted: " + q[m] + " m² × " + _fmt(conversions['thickness_m'].to_numpy()[m], '')
+                     + "m × " + _fmt(conversions['density_kg_m3'].to_numpy()[m], '')
+                     + " kg/m³ = " + out[m] + " kg")
+    m = path == PATH_AREA_TO_VOLUME
+    if m.any():
+        status[m] = ("Converted: " + q[m] + " m² × " + _fmt(conversions['thickness_m'].to_numpy()[m], '')
+                     + "m = " + _fmt(conversions['converted_quantity'].to_numpy(dtype=float)[m], '%.3f') + " m³")
+    m = path == PATH_MESH_TO_MASS
+    if m.any():
+        status[m] = ("Converted: " + q[m] + " m² × " + _fmt(conversions['mesh_weight_kg_m2'].to_numpy()[m], '%.3f')
+                     + " kg/m² = " + out[m] + " kg")
+    m = path == PATH_PIECE_TO_MASS
+    if m.any():
+        status[m] = ("Converted: " + q[m] + " pcs × " + _fmt(conversions['weight_per_piece_kg'].to_numpy()[m], '%.3f')
+                     + " kg/pc = " + out[m] + " kg")
+    m = path == PATH_LINEAR_TO_MASS
+    if m.any():
+        status[m] = ("Converted: " + q[m] + " m × " + _fmt(conversions['weight_per_meter_kg'].to_numpy()[m], '%.3f')
+                     + " kg/m = " + out[m] + " kg")
+    m = path == PATH_UNKNOWN_UNIT
+    if m.any():
+        raw_unit = oeko_unit.astype(str).str.strip().to_numpy(dtype=object)
+        status[m] = "Unknown unit '" + raw_unit[m] + "' - no conversion available"
+
+    return pd.Series(status, index=conversions.index, dtype=object)
@@ -0,0 +1,192 @@
+#!/usr/bin/env python3
+"""
+CarbonMatch - Conversion Cache
+==============================
+
+Memoized unit conversions per distinct key (Artikel, matched unit, matched
+material, density, delivery unit - see carbomatch_conversion.KEY_COLUMNS).
+
+Conversions are linear in `Menge`, so a key's result at Menge = 1 holds for
+every delivery of it. The cache keeps those per-key results in a bounded LRU
+that is shared by the sites of a batch run and persisted between runs in
+`carbomatch_conversions.json`. Entries belong to one factor table version;
+loading other tables empties the cache. A persisted cache written by other
+conversion code (carbomatch_conversion.CONVERSION_VERSION) is not loaded.
+"""
+
+from __future__ import annotations
+
+import json
+import logging
+import math
+import os
+import threading
+from collections import OrderedDict
+from typing import Callable, Dict, List, Optional
+
+from carbomatch_lazy import lazy_import
+from carbomatch_conversion import CONVERSION_VERSION, KEY_COLUMNS
+
+np = lazy_import("numpy")
+pd = lazy_import("pandas")
+
+logger = logging.getLogger(__name__)
+
+CONVERSION_CACHE_FILE = "carbomatch_conversions.json"
+DEFAULT_MAX_ENTRIES = 50000
+
+KEY_SEPARATOR = '\x1f'
+
+
+def _plain(value):
+    """JSON-friendly Python scalar (None for missing values)"""
+    if value is None or (isinstance(value, float) and math.isnan(value)):
+        return None
+    if isinstance(value, (np.integer, np.floating, np.bool_)):
+        value = value.item()
+        return None if isinstance(value, float) and math.isnan(value) else value
+    return value if isinstance(value, (int, float, str)) else str(value)
+
+
+class ConversionCache:
+    """Bounded LRU of per-key conversion results for one factor table version"""
+
+    def __init__(self, max_entries: int = DEFAULT_MAX_ENTRIES):
+        """
+        Args:
+            max_entries: Maximum number of keys kept (least recently used are evicted)
+        """
+        self.max_entries = max_entries
+        self.version: Optional[str] = None
+        self.columns: List[str] = []
+        self.entries: OrderedDict = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def _use_version(self, version: str) -> None:
+        """Drop all entries when the factor table version changes (lock held)"""
+        if self.version != version:
+            if self.entries:
+                logger.info(f"Conversion cache reset: factor tables {self.version} -> {version}")
+            self.entries.clear()
+            self.version = version
+
+    @staticmethod
+    def key_strings(keys: pd.DataFrame) -> List[str]:
+        """One string per key row (the cache and file key)"""
+        parts = [[str(_plain(v)) for v in keys[col].astype(object)] for col in keys.columns]
+        return [KEY_SEPARATOR.join(values) for values in zip(*parts)] if parts else []
+
+    def lookup(self, keys: pd.DataFrame, tables, compute: Callable) -> pd.DataFrame:
+        """
+        Per-key conversion results, computing only the keys not cached yet
+
+        Args:
+            keys: One row per key (KEY_COLUMNS, Menge = 1, optional dimension columns)
+            tables: FactorTables the results are computed with
+            compute: Function (keys, tables) -> per-key conversion frame
+
+        Returns:
+            Per-key frame aligned with keys.index
+        """
+        names = self.key_strings(keys[[col for col in KEY_COLUMNS if col in keys.columns]])
+
+        with self._lock:
+            self._use_version(tables.version_label)
+            records = []
+            for name in names:
+                record = self.entries.get(name)
+                if record is not None:
+                    self.entries.move_to_end(name)
+                records.append(record)
+            missing = [i for i, record in enumerate(records) if record is None]
+            self.hits += len(names) - len(missing)
+            self.misses += len(missing)
+
+        if missing:
+            computed = compute(keys.iloc[missing], tables)
+            columns = list(computed.columns)
+            rows = [[_plain(v) for v in row] for row in computed.astype(object).itertuples(index=False)]
+            with self._lock:
+                if self.version == tables.version_label:
+                    self.columns = columns
+                    for i, row in zip(missing, rows):
+                        self.entries[names[i]] = row
+                        self.entries.move_to_end(names[i])
+                    while len(self.entries) > self.max_entries:
+                        self.entries.popitem(last=False)
+            for i, row in zip(missing, rows):
+                records[i] = row
+        else:
+            columns = self.columns
+
+        logger.info(f"Conversion keys: {len(names) - len(missing)} cached, {len(missing)} computed")
+        return pd.DataFrame.from_records(records, columns=columns, index=keys.index)
+
+    def load(self, path: str = CONVERSION_CACHE_FILE) -> None:
+        """Restore persisted entries (ignored when missing or unreadable)"""
+        if not os.path.exists(path):
+            return
+        try:
+            with open(path, encoding='utf-8') as f:
+                data = json.load(f)
+            version, columns, entries = data['factor_table_version'], data['columns'], data['entries']
+        except (OSError, ValueError, KeyError, TypeError) as e:
+            logger.warning(f"Ignoring unreadable conversion cache {path}: {e}")
+            return
+        if data.get('conversion_version') != CONVERSION_VERSION:
+            logger.info(f"Ignoring conversion cache {path}: written by conversion rules "
+                        f"v{data.get('conversion_version', 1)}, current v{CONVERSION_VERSION}")
+            return
+        with self._lock:
+            self.version = version
+            self.columns = list(columns)
+            self.entries = OrderedDict((key, row) for key, row in entries[-self.max_entries:])
+        logger.info(f"Loaded {len(self.entries)} cached conversions ({version}) from {path}")
+
+    def save(self, path: str = CONVERSION_CACHE_FILE) -> None:
+        """Persist the entries in LRU order (least recently used first)"""
+        if not self.entries:
+            return
+        with self._lock:
+            data = {
+                'factor_table_version': self.version,
+                'conversion_version': CONVERSION_VERSION,
+                'columns': self.columns,
+                'entries': [[key, row] for key, row in self.entries.items()],
+            }
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(data, f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+        logger.info(f"Saved {len(data['entries'])} cached conversions to {path}")
+
+
+def inspect_conversion_cache(path: str = CONVERSION_CACHE_FILE) -> Dict:
+    """
+    Summarize a persisted conversion cache without loading pandas
+
+    Returns:
+        Dict with path, exists, entries, factor_table_version,
+        conversion_version, current (written by this conversion code) and
+        size_bytes
+    """
+    info = {'path': path, 'exists': os.path.exists(path), 'entries': 0,
+            'factor_table_version': None, 'conversion_version': None, 'current': False, 'size_bytes': 0}
+    if not info['exists']:
+        return info
+    info['size_bytes'] = os.path.getsize(path)
+    try:
+        with open(path, encoding='utf-8') as f:
+            data = json.load(f)
+        info['entries'] = len(data.get('entries', []))
+        info['factor_table_version'] = data.get('factor_table_version')
+        info['conversion_version'] = data.get('conversion_version', 1)
+        info['current'] = info['conversion_version'] == CONVERSION_VERSION
+    except (OSError, ValueError) as e:
+        info['error'] = str(e)
+    return info
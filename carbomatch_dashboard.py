@@ -16,6 +16,41 @@ import plotly.express as px
 from datetime import datetime
 import numpy as np
 
+import hashlib
+import os
+
+from carbomatch_checkpoint import file_digest
+from carbomatch_co2e import CALCULATION_CODE_LABELS, CALC_SUCCESS, STATUS_COLUMNS, render_report_status, status_labels
+from carbomatch_report import read_report, strip_compression
+from carbomatch_rollup import TOP_DIMENSION, RollupBuilder, read_rollups, rollup, rollups_path
+from carbomatch_summary import SUMMARY_FORMAT, read_summary, summarize, summary_path
+from carbomatch_store import STORE_FILE, ReportStore
+
+# Report columns the dashboard reads (projection); missing ones are skipped for older reports
+DASHBOARD_COLUMNS = [
+    'Lieferant', 'Artikel-Nummer', 'Artikel', 'Menge', 'Einheit', 'mass_kg',
+    'matched_material', 'similarity_score', 'matched_oeko_unit',
+    'calculated_co2e_a1_a3', 'calculated_co2e_a4', 'total_co2e',
+    *STATUS_COLUMNS, 'calculation_status',
+]
+
+# Report versions (and their rollups / summaries) kept in the data cache;
+# older ones are evicted, so switching between runs does not grow memory
+REPORT_CACHE_ENTRIES = 3
+
+# Audit table: columns shown, number formats (applied by the table, values stay numeric), page sizes
+AUDIT_COLUMNS = [
+    'Lieferant', 'Artikel-Nummer', 'Artikel', 'Menge', 'Einheit', 'mass_kg',
+    'matched_material', 'similarity_score', 'matched_oeko_unit',
+    'calculated_co2e_a1_a3', 'calculated_co2e_a4', 'total_co2e',
+]
+# ("accounting": two decimals with thousands separators, as the former f"{x:,.2f}" text)
+AUDIT_NUMBER_FORMATS = {
+    'mass_kg': "accounting", 'similarity_score': "%.2f",
+    'calculated_co2e_a1_a3': "accounting", 'calculated_co2e_a4': "accounting", 'total_co2e': "accounting",
+}
+AUDIT_PAGE_SIZES = [50, 100, 500, 1000]
+
 # Page configuration
 st.set_page_config(
     page_title="CarbonMatch - Dashboard",
@@ -59,54 +94,140 @@ st.markdown("""
     """, unsafe_allow_html=True)
 
 
-@st.cache_data
+def report_source(filepath="carbomatch_report.csv"):
+    """Typed Parquet report written next to the CSV (when at least as new), else the CSV"""
+    parquet_path = os.path.splitext(strip_compression(filepath))[0] + '.parquet'
+    if os.path.exists(parquet_path) and (
+            not os.path.exists(filepath) or os.path.getmtime(parquet_path) >= os.path.getmtime(filepath)):
+        return parquet_path
+    return filepath
+
+
+@st.cache_data(max_entries=16, show_spinner=False)
+def _content_digest(path, mtime_ns, size):
+    """Content hash of a file, computed once per (mtime, size) it is seen with"""
+    return file_digest(path)
+
+
+def source_identity(path):
+    """
+    Identity of a report source: content hash of a file, or of a dataset
+    directory's file listing (names, sizes, modification times)
+    
+    Files are hashed only when their modification time or size changed, so
+    an unchanged report costs one stat() per rerun, and a rewrite with the
+    same content keeps its cached data.
+    """
+    if not os.path.exists(path):
+        return ''
+    if os.path.isdir(path):
+        listing = []
+        for root, _, names in os.walk(path):
+            for name in names:
+                stat = os.stat(os.path.join(root, name))
+                listing.append((os.path.relpath(os.path.join(root, name), path), stat.st_size, stat.st_mtime_ns))
+        return hashlib.sha256(repr(sorted(listing)).encode()).hexdigest()[:16]
+    stat = os.stat(path)
+    return _content_digest(path, stat.st_mtime_ns, stat.st_size)
+
+
+def report_key(filepath="carbomatch_report.csv"):
+    """Cache key of the current report: (source path, source identity)"""
+    source = report_source(filepath)
+    return source, source_identity(source)
+
+
 def load_data(filepath="carbomatch_report.csv"):
-    """Load and cache the CarbonMatch report data"""
+    """
+    Load the CarbonMatch report data, cached per report version
+    
+    The cache is keyed on the report's identity (report_key), not its path,
+    so a new pipeline run shows up on the next rerun without clearing the
+    cache; the REPORT_CACHE_ENTRIES most recent versions stay cached.
+    """
+    return _load_report(*report_key(filepath))
+
+
+@st.cache_data(max_entries=REPORT_CACHE_ENTRIES, show_spinner="Loading report...")
+def _load_report(source, identity):
+    """
+    Load and cache one report version (identity is only part of the cache key)
+    
+    Reads only DASHBOARD_COLUMNS, from the typed Parquet report when one was
+    written (see carbomatch_report.read_report); CSV factor columns are parsed
+    round-trip exactly, so rendered status text matches the pipeline's.
+    Adds `status_label` (categorical outcome) and `is_success` once, so
+    filters and KPIs never scan status strings.
+    """
     try:
-        df = pd.read_csv(filepath, sep=';', encoding='utf-8-sig')
-        # Ensure numeric columns
-        numeric_cols = ['Menge', 'similarity_score', 'calculated_co2e_a1_a3', 
-                       'calculated_co2e_a4', 'total_co2e']
-        for col in numeric_cols:
-            if col in df.columns:
-                df[col] = pd.to_numeric(df[col], errors='coerce')
+        df = read_report(source, columns=DASHBOARD_COLUMNS)
+        
+        if 'calculation_code' in df.columns:
+            df['status_label'] = status_labels(df['calculation_code'])
+            df['is_success'] = df['calculation_code'] == CALC_SUCCESS
+        else:
+            # Reports written before the numeric status columns existed
+            df['is_success'] = df['calculation_status'].str.startswith('Success', na=False)
+            df['status_label'] = df['calculation_status'].where(
+                ~df['is_success'], CALCULATION_CODE_LABELS[CALC_SUCCESS]).astype('category')
         return df
     except Exception as e:
         st.error(f"Error loading data: {e}")
         return None
 
 
-def calculate_kpis(df):
-    """Calculate key performance indicators"""
-    if df is None or len(df) == 0:
+@st.cache_data(max_entries=REPORT_CACHE_ENTRIES)
+def load_rollups(filepath="carbomatch_report.csv", key=None, _df=None):
+    """
+    Load and cache the report rollups (carbomatch_rollup)
+    
+    Reads the rollup table the pipeline wrote next to the report; reports
+    written before rollups existed (or newer than their rollups) are rolled
+    up once from the loaded rows (_df, not hashed by the cache). Pass the
+    report_key() so a new report version is not served stale rollups.
+    """
+    path = rollups_path(filepath)
+    source = report_source(filepath)
+    if os.path.exists(path) and (not os.path.exists(source) or os.path.getmtime(path) >= os.path.getmtime(source)):
+        return read_rollups(path)
+    if _df is None:
+        return None
+    rows = _df
+    if 'calculation_code' not in rows.columns:
+        # Reports without numeric status columns: only success is known
+        rows = rows.assign(calculation_code=np.where(rows['is_success'], CALC_SUCCESS, np.nan))
+    if 'mass_kg' not in rows.columns:
+        # Reports written before `mass_kg` existed: Menge is in the delivery unit, not kg - mass unknown
+        rows = rows.assign(mass_kg=np.nan)
+    builder = RollupBuilder()
+    builder.add(rows)
+    return builder.result()
+
+
+@st.cache_data(max_entries=REPORT_CACHE_ENTRIES)
+def load_summary(filepath="carbomatch_report.csv", key=None, _rollups=None):
+    """
+    Load and cache the report summary (carbomatch_summary) holding the KPIs
+    
+    Reads the summary JSON the pipeline wrote next to the report; without a
+    current one the summary is derived from the rollups (_rollups). Keyed
+    like load_rollups().
+    """
+    path = summary_path(filepath)
+    source = report_source(filepath)
+    if os.path.exists(path) and (not os.path.exists(source) or os.path.getmtime(path) >= os.path.getmtime(source)):
+        summary = read_summary(path)
+        # Older summary formats define the intensity differently
+        if summary.get('format') == SUMMARY_FORMAT:
+            return summary
+    if _rollups is None or len(_rollups) == 0:
         return {}
-    
-    total_co2e = df['total_co2e'].sum()
-    material_co2e = df['calculated_co2e_a1_a3'].sum()
-    transport_co2e = df['calculated_co2e_a4'].sum()
-    
-    # Calculate success rate - check for 'Success' in calculation_status
-    successful = df[df['calculation_status'].str.contains('Success', na=False)]
-    success_rate = (len(successful) / len(df) * 100) if len(df) > 0 else 0
-    
-    # Material percentage
-    material_pct = (material_co2e / total_co2e * 100) if total_co2e > 0 else 0
-    
-    return {
-        'total_co2e': total_co2e,
-        'material_co2e': material_co2e,
-        'transport_co2e': transport_co2e,
-        'success_rate': success_rate,
-        'material_pct': material_pct,
-        'total_items': len(df),
-        'successful_items': len(successful),
-        'failed_items': len(df) - len(successful)
-    }
+    return summarize(_rollups)
 
 
-def create_supplier_category_chart(df):
+def create_supplier_category_chart(rollups):
     """Create pie chart for supplier emissions - group small ones as 'Others'"""
-    supplier_emissions = df.groupby('Lieferant')['calculated_co2e_a1_a3'].sum().sort_values(ascending=False)
+    supplier_emissions = rollup(rollups, 'supplier')['calculated_co2e_a1_a3'].sort_values(ascending=False)
     total_emissions = supplier_emissions.sum()
     
     # Calculate percentages
@@ -149,14 +270,12 @@ def create_supplier_category_chart(df):
     return fig, others_count, len(major_suppliers)
 
 
-def create_top_emitters_chart(df, top_n=10):
-    """Create horizontal bar chart for top material emitters"""
-    top_items = df.nlargest(top_n, 'calculated_co2e_a1_a3')[
-        ['Artikel', 'calculated_co2e_a1_a3', 'Lieferant']
-    ].copy()
+def create_top_emitters_chart(rollups, top_n=10):
+    """Create horizontal bar chart for top material emitters (top_n up to ROLLUP_TOP_ROWS)"""
+    top_items = rollup(rollups, TOP_DIMENSION).nlargest(top_n, 'calculated_co2e_a1_a3')
     
     # Truncate artikel names for display
-    top_items['Artikel_short'] = top_items['Artikel'].str[:40]
+    top_items['Artikel_short'] = top_items.index.str[:40]
     
     fig = go.Figure(data=[go.Bar(
         y=top_items['Artikel_short'],
@@ -182,12 +301,10 @@ def create_top_emitters_chart(df, top_n=10):
     return fig
 
 
-def create_supplier_emissions_chart(df):
+def create_supplier_emissions_chart(rollups):
     """Create stacked bar chart for emissions by supplier"""
-    supplier_data = df.groupby('Lieferant').agg({
-        'calculated_co2e_a1_a3': 'sum',
-        'calculated_co2e_a4': 'sum'
-    }).reset_index()
+    supplier_data = rollup(rollups, 'supplier')[['calculated_co2e_a1_a3', 'calculated_co2e_a4']].rename_axis(
+        'Lieferant').reset_index()
     
     supplier_data['total'] = supplier_data['calculated_co2e_a1_a3'] + supplier_data['calculated_co2e_a4']
     supplier_data = supplier_data.sort_values('total', ascending=True)  # Ascending for horizontal stacking
@@ -230,15 +347,20 @@ def create_supplier_emissions_chart(df):
     return fig
 
 
-def create_status_distribution_chart(df):
+def create_status_distribution_chart(rollups):
     """Create pie chart for calculation status distribution"""
-    status_counts = df['calculation_status'].value_counts().reset_index()
-    status_counts.columns = ['status', 'count']
+    status_rollup = rollup(rollups, 'status')
+    status_counts = pd.DataFrame({
+        'status': [CALCULATION_CODE_LABELS.get(int(code), 'Unknown') if code else 'Unknown'
+                   for code in status_rollup.index],
+        'count': status_rollup['items'].to_numpy(),
+    }).sort_values('count', ascending=False, kind='stable')
+    status_counts = status_counts[status_counts['count'] > 0]
     
     # Define colors: Success in green, errors in red
     colors = []
     for status in status_counts['status']:
-        if 'Success' in status:
+        if status == CALCULATION_CODE_LABELS[CALC_SUCCESS]:
             colors.append('#00b894')
         elif 'Error' in status:
             colors.append('#d63031')
@@ -264,6 +386,36 @@ def create_status_distribution_chart(df):
     return fig
 
 
+def audit_rows(df, statuses=None, suppliers=None):
+    """Positions of the rows passing the audit table filters (no copy of the frame)"""
+    mask = np.ones(len(df), dtype=bool)
+    if statuses:
+        mask &= df['status_label'].isin(statuses).to_numpy()
+    if suppliers:
+        mask &= df['Lieferant'].isin(suppliers).to_numpy()
+    return np.flatnonzero(mask)
+
+
+def audit_page(df, rows, page=1, page_rows=AUDIT_PAGE_SIZES[1]):
+    """
+    One page of the audit table: the AUDIT_COLUMNS of rows[(page - 1) * page_rows:][:page_rows]
+    with the rendered calculation_status (only these rows are rendered)
+    """
+    start = (page - 1) * page_rows
+    page_df = df.iloc[rows[start:start + page_rows]]
+    columns = [col for col in AUDIT_COLUMNS if col in df.columns]
+    return page_df[columns].assign(calculation_status=render_report_status(page_df))
+
+
+@st.cache_data(max_entries=REPORT_CACHE_ENTRIES, show_spinner="Preparing export...")
+def audit_export(key, statuses=(), suppliers=(), _df=None):
+    """Filtered audit rows as semicolon CSV, built on request, once per report version and filter"""
+    export_df = _df.iloc[audit_rows(_df, statuses, suppliers)]
+    columns = [col for col in AUDIT_COLUMNS if col in _df.columns]
+    return export_df[columns].assign(calculation_status=render_report_status(export_df)).to_csv(
+        sep=';', index=False, encoding='utf-8-sig')
+
+
 def main():
     """Main dashboard application"""
     
@@ -280,21 +432,24 @@ def main():
         </div>
         """, unsafe_allow_html=True)
     
-    # Load data
-    df = load_data()
+    # Load data (reloaded when the report file changes)
+    key = report_key()
+    df = _load_report(*key)
     
     if df is None or len(df) == 0:
         st.error("❌ Unable to load data. Please ensure carbomatch_report.csv exists in the working directory.")
         return
     
-    # Calculate KPIs
-    kpis = calculate_kpis(df)
+    # KPIs come from the report summary, charts from the rollups - not from the rows
+    rollups = load_rollups(key=key, _df=df)
+    kpis = load_summary(key=key, _rollups=rollups)
     
     # ============== KPI SECTION (TOP METRICS) ==============
     st.markdown("### 🎯 KEY METRICS - Overview")
     
-    # Calculate intensity
-    intensity = kpis['total_co2e'] / (df['Menge'].sum()) if df['Menge'].sum() > 0 else 0
+    # None for reports whose rollups predate the known-mass CO₂e
+    intensity = kpis['intensity']
+    intensity_text = f"{intensity:.2f} kg CO₂e/kg" if intensity is not None else "n/a"
     
     # Create 2x2 grid with styled metrics
     col1, col2 = st.columns(2)
@@ -325,8 +480,8 @@ def main():
         with col2b:
             st.metric(
                 "⚙️ Intensity",
-                f"{intensity:.2f} kg CO₂e/kg",
-                delta="per kg of material"
+                intensity_text,
+                delta=f"per kg of material ({kpis['known_mass_items']}/{kpis['total_items']} items with known mass)"
             )
     
     st.divider()
@@ -335,7 +490,7 @@ def main():
     st.markdown("### 📊 Top Material Emitters (A1-A3)")
     
     st.plotly_chart(
-        create_top_emitters_chart(df, top_n=15),
+        create_top_emitters_chart(rollups, top_n=15),
         use_container_width=True
     )
     
@@ -350,7 +505,8 @@ def main():
     with col_filter1:
         selected_status = st.multiselect(
             "Filter by Calculation Status:",
-            options=df['calculation_status'].unique(),
+            options=[label for label in df['status_label'].cat.categories
+                     if (df['status_label'] == label).any()],
             default=None
         )
     
@@ -361,52 +517,45 @@ def main():
             default=None
         )
     
-    # Apply filters
-    filtered_df = df.copy()
-    
-    if selected_status:
-        filtered_df = filtered_df[filtered_df['calculation_status'].isin(selected_status)]
+    # Apply filters (row positions only - the page is sliced from them)
+    rows = audit_rows(df, selected_status, selected_suppliers)
     
-    if selected_suppliers:
-        filtered_df = filtered_df[filtered_df['Lieferant'].isin(selected_suppliers)]
+    col_page1, col_page2 = st.columns(2)
+    with col_page2:
+        page_rows = st.selectbox("Rows per page:", options=AUDIT_PAGE_SIZES, index=1)
+    pages = max(1, -(-len(rows) // page_rows))
+    with col_page1:
+        page = st.number_input(f"Page (of {pages}):", min_value=1, max_value=pages, value=1, step=1)
+    page = min(int(page or 1), pages)
     
     # Display filtered data
-    st.write(f"**Showing {len(filtered_df)} of {len(df)} records**")
+    start = (page - 1) * page_rows
+    st.write(f"**Showing {min(start + 1, len(rows))}-{min(start + page_rows, len(rows))} "
+             f"of {len(rows)} filtered records ({len(df)} total)**")
     
-    # Select columns for display
-    display_columns = [
-        'Lieferant', 'Artikel-Nummer', 'Artikel', 'Menge', 'Einheit',
-        'matched_material', 'similarity_score', 'matched_oeko_unit',
-        'calculated_co2e_a1_a3', 'calculated_co2e_a4', 'total_co2e',
-        'calculation_status'
-    ]
-    
-    # Only include columns that exist
-    display_columns = [col for col in display_columns if col in filtered_df.columns]
-    
-    # Format numeric columns for display
-    display_df = filtered_df[display_columns].copy()
-    
-    numeric_display = ['similarity_score', 'calculated_co2e_a1_a3', 'calculated_co2e_a4', 'total_co2e']
-    for col in numeric_display:
-        if col in display_df.columns:
-            display_df[col] = display_df[col].apply(lambda x: f'{x:,.2f}' if pd.notna(x) else 'N/A')
-    
-    # Display as interactive table
+    # Only the page is rendered; numbers are formatted by the table, not converted to text
     st.dataframe(
-        display_df,
+        audit_page(df, rows, page, page_rows),
+        column_config={col: st.column_config.NumberColumn(format=number_format)
+                       for col, number_format in AUDIT_NUMBER_FORMATS.items()},
+        hide_index=True,
         width='stretch',
         height=400
     )
     
-    # Download button
-    csv = filtered_df[display_columns].to_csv(sep=';', index=False, encoding='utf-8-sig')
-    st.download_button(
-        label="📥 Download Filtered Data (CSV)",
-        data=csv,
-        file_name=f"csrd_audit_export_{datetime.now().strftime('%Y%m%d_%H%M%S')}.csv",
-        mime="text/csv"
-    )
+    # Download (all filtered rows): the CSV is built only on request, then offered while the filter stays
+    export_filter = (key, tuple(selected_status or ()), tuple(selected_suppliers or ()))
+    prepared = st.session_state.get('audit_export_filter') == export_filter
+    if not prepared and st.button("📦 Prepare Download (CSV)", help=f"Export all {len(rows)} filtered records"):
+        st.session_state['audit_export_filter'] = export_filter
+        prepared = True
+    if prepared:
+        st.download_button(
+            label="📥 Download Filtered Data (CSV)",
+            data=audit_export(*export_filter, _df=df),
+            file_name=f"csrd_audit_export_{datetime.now().strftime('%Y%m%d_%H%M%S')}.csv",
+            mime="text/csv"
+        )
     
     st.divider()
     
@@ -416,7 +565,7 @@ def main():
     col_left, col_right = st.columns(2)
     
     with col_left:
-        chart_fig, others_count, major_count = create_supplier_category_chart(df)
+        chart_fig, others_count, major_count = create_supplier_category_chart(rollups)
         st.plotly_chart(chart_fig, use_container_width=True)
         
         # Show analysis info
@@ -424,21 +573,46 @@ def main():
     
     with col_right:
         st.plotly_chart(
-            create_status_distribution_chart(df),
+            create_status_distribution_chart(rollups),
             use_container_width=True
         )
     
     st.divider()
     
+    # ============== PORTFOLIO QUERY SECTION (REPORT STORE) ==============
+    if os.path.exists(STORE_FILE):
+        st.markdown("### 🗄️ Portfolio Query - All Sites")
+        store = ReportStore(STORE_FILE)
+        
+        col_query1, col_query2 = st.columns(2)
+        with col_query1:
+            query_supplier = st.selectbox("Supplier:", options=['(all)'] + store.values('Lieferant'))
+        with col_query2:
+            query_material = st.text_input("Material category contains:", value="")
+        
+        # Indexed query on the store - no report file is read
+        query_filters = []
+        if query_supplier != '(all)':
+            query_filters.append(('Lieferant', '==', query_supplier))
+        if query_material:
+            query_filters.append(('matched_category', 'like', f"%{query_material}%"))
+        site_totals = store.aggregate(group_by=['site'], filters=query_filters)
+        st.write(f"**{int(site_totals['items'].sum()):,} matching rows across {len(site_totals)} site(s)**")
+        st.dataframe(site_totals, width='stretch', hide_index=True)
+        
+        st.divider()
+    
     # ============== SUMMARY SECTION ==============
     st.markdown("### 📌 Summary - Key Figures")
     
     st.markdown("""
     **📊 What is CO₂e Intensity?**
     
-    Intensity = Total CO₂e ÷ Total Material Weight
+    Intensity = CO₂e (A1-A3 + A4) of the items with known mass ÷ their weight
     
-    It shows how much carbon is emitted per kilogram of material received.
+    It shows how much carbon is emitted per kilogram of material received. Items
+    whose delivery unit gives no mass (pieces, bundles without a weight) are left
+    out of both sides.
     
     **Example:** If intensity = 929 kg CO₂e/kg, it means:
     - For every 1 kg of delivered material, we emit ~929 kg of CO₂e during production (A1-A3)
@@ -462,10 +636,10 @@ def main():
     
     with summary_col3:
         st.write("**📊 Material Weight & Intensity:**")
-        total_weight = df['Menge'].sum()
+        total_weight = kpis['total_mass_kg']
         st.write(f"- Total Weight: {total_weight:,.0f} kg")
-        st.write(f"- **Intensity: {intensity:.2f} kg CO₂e/kg**")
-        st.write(f"  (Carbon per kg material)")
+        st.write(f"- **Intensity: {intensity_text}**")
+        st.write(f"  (Carbon per kg material, {kpis['known_mass_pct']:.1f}% of items with known mass)")
     
     st.markdown("---")
     st.markdown("<p style='text-align: center; font-size: 0.8em; color: #999;'>CarbonMatch Dashboard | CSRD Compliance Reporting | Data Audit Trail</p>", unsafe_allow_html=True)
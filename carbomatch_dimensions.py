@@ -0,0 +1,201 @@
+#!/usr/bin/env python3
+"""
+CarbonMatch - Dimension Extraction
+==================================
+
+Compiled regex extractor that pulls structured dimensions out of free-text
+article descriptions (German number format, decimal commas accepted):
+
+- diameter_mm        explicit diameter markers: "Ø 12", "d=88mm", "D 15mm", "DN 150", "OD 110 mm"
+- nominal_mm         first plain millimetre value: "Betonstahl B 500 B 14,00 mm"
+- area_m2            "250 x 60 cm", "1,90 x 35m", "120 x 80 x 14,4 cm", "1 m x 50 cm"
+                     (first two dimensions)
+- depth_mm           third dimension of a three-dimension size
+- section_width_mm / section_height_mm
+                     unit-less cross sections: "Dreikantleiste 11 x 11"
+- pack_length_m      length per pack: "Bund á 200 m", "Rollen á ca. 30 m", "100m/Rolle", "RB=50 m"
+- mesh_type          reinforcement mesh designation: "Q 335 A" -> "Q335"
+
+A size either gives every number its unit or only the last one. The
+trailing unit is applied to all numbers only when no diameter marker comes
+before the size ("Rohr DN 100 x 2 m" is a diameter and a length, not 200 m²)
+and the numbers are within SIZE_MAX_RATIO of each other.
+
+Extraction runs once per distinct text; `extract_dimension_columns` gathers
+the results back onto all rows through factorize codes. DIMENSION_CHECKS
+lists reference texts with their expected values (`python
+carbomatch_dimensions.py` checks them).
+"""
+
+from __future__ import annotations
+
+import re
+import sys
+from typing import Dict, List, Tuple
+
+from carbomatch_lazy import lazy_import
+
+np = lazy_import("numpy")
+pd = lazy_import("pandas")
+
+NUM = r'(\d+(?:[.,]\d+)?)'
+
+DIAMETER_PATTERN = re.compile(
+    r'(?:[Øø]\s*|\b(?:OD|DN)\s*|\b(?:Di|d|D)\s*=\s*)' + NUM
+    + r'|\b[dD]\s*' + NUM + r'(?=\s*mm|[.,]\d)'
+)
+# Plain millimetre values, not the last dimension of a size ("1000x500 mm") or list ("1250/600/20 mm")
+NOMINAL_MM_PATTERN = re.compile(r'(?<![\d.,x×X*/])(?<![x×X*/]\s)' + NUM + r'\s*mm\b', re.IGNORECASE)
+SIZE_UNIT = r'\s*(mm|cm|m)(?![a-zäöüß])'
+# Groups: diameter marker, width, its unit, height, its unit, depth, last unit
+SIZE_PATTERN = re.compile(
+    r'(\b(?:DN|OD|Di\s*=|[dD]\s*=)\s*|[Øø]\s*)?' + NUM + r'(?:' + SIZE_UNIT + r')?\s*[x×X*]\s*' + NUM
+    + r'(?:(?:' + SIZE_UNIT + r')?\s*[x×X*]\s*' + NUM + r')?' + SIZE_UNIT
+)
+SECTION_PATTERN = re.compile(r'(?<![\w.,])(\d+)\s*[x×]\s*(\d+)(?![\w.,]|\s*[x×*]|\s*(?:mm|cm|m)\b)')
+PACK_LENGTH_PATTERN = re.compile(
+    r'(?:\b(?:[áàa]|je)\s+(?:ca\.\s*)?' + NUM + r'\s*m\b'
+    r'|' + NUM + r'\s*m\s*/\s*(?:Rolle|Bund|Ring)'
+    r'|\bRB\s*=\s*' + NUM + r'\s*m\b)'
+)
+MESH_PATTERN = re.compile(r'\b([QR])\s*(\d{3})\s*A?\b')
+
+SIZE_UNIT_TO_M = {'mm': 0.001, 'cm': 0.01, 'm': 1.0}
+# Largest / smallest number of a size written with one trailing unit
+SIZE_MAX_RATIO = 100.0
+
+DIMENSION_COLUMNS = [
+    'diameter_mm', 'nominal_mm', 'area_m2', 'depth_mm',
+    'section_width_mm', 'section_height_mm', 'pack_length_m', 'mesh_type',
+]
+
+# Reference texts and the values extracted from them (None: not present)
+DIMENSION_CHECKS = [
+    ("STRECKMETALL - Flachripp 250 x 60 cm verzinkt", {'area_m2': 1.5, 'depth_mm': None}),
+    ("Europalette EUR 1 120 x 80 x 14,4 cm", {'area_m2': 0.96, 'depth_mm': 144.0}),
+    ("Dränagematte Secudrain WAS7  1,90 x  35m", {'area_m2': 66.5}),
+    ("Geotextil GRK3 2 x 100 m", {'area_m2': 200.0}),
+    ("Platte 1 m x 50 cm", {'area_m2': 0.5}),
+    ("Pfosten 10 cm x 10 cm x 2 m", {'area_m2': 0.01, 'depth_mm': 2000.0}),
+    ("Rohr DN 100 x 2 m", {'diameter_mm': 100.0, 'area_m2': None}),
+    ("Kanalrohr Awadukt SN10 DN150x3000mm", {'diameter_mm': 150.0, 'area_m2': None}),
+    ("Rohr Ø 110 x 5 m", {'diameter_mm': 110.0, 'area_m2': None}),
+    ("Gewindestange 8 x 1000 mm", {'area_m2': None}),
+    ("Platte 20 x 30 mm x 2 m", {'area_m2': None}),
+    ("HOLZ-Dreikantleiste 11 x 11 (c = ca. 15 mm)",
+     {'section_width_mm': 11.0, 'section_height_mm': 11.0, 'area_m2': None}),
+    ("Betonstahl B 500 B 14,00 mm", {'nominal_mm': 14.0}),
+    ("Kunststoffrohr d=88mm, Bund á 200 m", {'diameter_mm': 88.0, 'pack_length_m': 200.0}),
+    ("Baustahlmatte Q 335 A", {'mesh_type': 'Q335'}),
+]
+
+
+def _to_float(values: pd.Series) -> np.ndarray:
+    """Parse extracted number strings (decimal comma or dot), NaN where absent"""
+    return pd.to_numeric(values.str.replace(',', '.', regex=False), errors='coerce').to_numpy(dtype=float)
+
+
+def _size_m(size: pd.DataFrame) -> List[np.ndarray]:
+    """
+    Width, height and depth in metres of SIZE_PATTERN matches (NaN for
+    sizes whose units are ambiguous, see module docstring)
+    """
+    marker, last_unit = size[0], size[6]
+    has_depth = size[5].notna()
+    # Units per number: their own, or the last one
+    units = [size[2], size[4].where(has_depth, last_unit), last_unit.where(has_depth)]
+    each_unit = size[2].notna() & (~has_depth | size[4].notna())
+    trailing_unit = size[2].isna() & (~has_depth | size[4].isna())
+    values = [_to_float(size[col]) for col in (1, 3, 5)]
+
+    numbers = pd.DataFrame(np.column_stack(values), index=size.index)
+    ratio = numbers.max(axis=1) / numbers.min(axis=1)
+    valid = (each_unit | (trailing_unit & marker.isna() & (ratio <= SIZE_MAX_RATIO))).to_numpy()
+
+    return [np.where(valid, value * unit.fillna(last_unit).map(SIZE_UNIT_TO_M).to_numpy(dtype=float), np.nan)
+            for value, unit in zip(values, units)]
+
+
+def extract_dimensions(texts: pd.Series) -> pd.DataFrame:
+    """
+    Extract dimensions from article texts
+
+    Call on distinct texts (see extract_dimension_columns) - every pattern
+    is applied once per element.
+
+    Args:
+        texts: Article descriptions
+
+    Returns:
+        Frame aligned with texts.index holding DIMENSION_COLUMNS (NaN / None
+        where a dimension is not present)
+    """
+    texts = texts.astype(object).where(texts.notna(), '').astype(str)
+
+    diameter = texts.str.extract(DIAMETER_PATTERN)
+    width, height, depth = _size_m(texts.str.extract(SIZE_PATTERN))
+    section = texts.str.extract(SECTION_PATTERN)
+    pack = texts.str.extract(PACK_LENGTH_PATTERN)
+    mesh = texts.str.extract(MESH_PATTERN)
+
+    return pd.DataFrame({
+        'diameter_mm': _to_float(diameter[0].fillna(diameter[1])),
+        'nominal_mm': _to_float(texts.str.extract(NOMINAL_MM_PATTERN)[0]),
+        'area_m2': width * height,
+        'depth_mm': depth * 1000,
+        'section_width_mm': _to_float(section[0]),
+        'section_height_mm': _to_float(section[1]),
+        'pack_length_m': _to_float(pack[0].fillna(pack[1]).fillna(pack[2])),
+        'mesh_type': (mesh[0] + mesh[1]).astype(object).where(mesh[0].notna(), None),
+    }, index=texts.index)
+
+
+def check_dimensions(checks: List[Tuple[str, Dict]] = DIMENSION_CHECKS) -> List[Tuple]:
+    """
+    Extract the reference texts and compare with their expected values
+
+    Returns:
+        (text, column, expected, extracted) for every mismatch
+    """
+    texts = pd.Series([text for text, _ in checks], dtype=object)
+    extracted = extract_dimensions(texts)
+    mismatches = []
+    for i, (text, expected) in enumerate(checks):
+        for col, value in expected.items():
+            actual = extracted.at[i, col]
+            missing = actual is None or (isinstance(actual, float) and np.isnan(actual))
+            if value is None:
+                ok = missing
+            elif isinstance(value, str):
+                ok = actual == value
+            else:
+                ok = not missing and np.isclose(actual, value)
+            if not ok:
+                mismatches.append((text, col, value, actual))
+    return mismatches
+
+
+def extract_dimension_columns(artikel: pd.Series) -> pd.DataFrame:
+    """
+    Dimension columns for every row, extracting once per distinct text
+
+    Args:
+        artikel: Article description column
+
+    Returns:
+        Frame aligned with artikel.index holding DIMENSION_COLUMNS
+    """
+    codes, uniques = pd.factorize(artikel, use_na_sentinel=False)
+    dimensions = extract_dimensions(pd.Series(uniques, dtype=object))
+    rows = dimensions.iloc[codes]
+    rows.index = artikel.index
+    return rows
+
+
+if __name__ == "__main__":
+    failed = check_dimensions()
+    for text, col, expected, actual in failed:
+        print(f"❌ {text!r}: {col} = {actual}, expected {expected}")
+    print(f"{'❌' if failed else '✅'} {len(DIMENSION_CHECKS) - len({text for text, *_ in failed})}"
+          f"/{len(DIMENSION_CHECKS)} dimension checks passed")
+    sys.exit(1 if failed else 0)
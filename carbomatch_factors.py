@@ -0,0 +1,308 @@
+#!/usr/bin/env python3
+"""
+CarbonMatch - Conversion Factor Tables
+======================================
+
+Versioned factor tables for the unit conversion rule engine, loaded from
+`carbomatch_factors.json` instead of being hard-coded:
+
+- area_thickness_m            layer thickness for m² quantities
+- piece_weight_kg             weight per piece
+- piece_material_factor       density multiplier on piece weights
+- rebar_weight_per_meter_kg   reinforcing steel weight per metre, by bar diameter
+- linear_weight_per_meter_kg  weight per metre of other linear goods
+- mesh_weight_kg_m2           reinforcement mesh weight per m², by mesh type
+
+Keyword tables are an ordered list of rules (first match wins) plus a
+default; at load time every rule's keywords are compiled into one regex.
+Value tables (`"key": "diameter_mm"` / `"mesh_type"`) look up an extracted
+dimension (see carbomatch_dimensions) instead, optionally falling back to a
+formula. Either way matching yields rule indices that index straight into
+the factor and rule-label arrays.
+
+Tables carry a version label (`version` field plus content hash) that is
+written to the report, and `changed_rule_labels` / `affected_rows` determine
+which rows a factor change touches so only those are recalculated.
+"""
+
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+import re
+from typing import Dict, List, Optional, Set, Tuple
+
+from carbomatch_lazy import lazy_import
+
+np = lazy_import("numpy")
+pd = lazy_import("pandas")
+
+FACTORS_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "carbomatch_factors.json")
+
+AREA_THICKNESS = 'area_thickness_m'
+PIECE_WEIGHT = 'piece_weight_kg'
+PIECE_MATERIAL_FACTOR = 'piece_material_factor'
+REBAR_WEIGHT = 'rebar_weight_per_meter_kg'
+LINEAR_WEIGHT = 'linear_weight_per_meter_kg'
+MESH_WEIGHT = 'mesh_weight_kg_m2'
+TABLE_NAMES = [AREA_THICKNESS, PIECE_WEIGHT, PIECE_MATERIAL_FACTOR, REBAR_WEIGHT, LINEAR_WEIGHT, MESH_WEIGHT]
+
+DEFAULT_RULE_ID = 'default'
+FORMULA_RULE_ID = 'formula'
+ANY_RULE_ID = '*'
+
+
+def compile_keywords(keywords: List[str]) -> re.Pattern:
+    """Compile a keyword list into one substring-alternation regex"""
+    return re.compile('|'.join(re.escape(k.lower()) for k in keywords))
+
+
+class FactorTable:
+    """One ordered keyword (or value) → factor table, compiled for columnar matching"""
+
+    def __init__(self, name: str, config: Dict):
+        """
+        Compile a table from its config section
+
+        Args:
+            name: Table name (one of TABLE_NAMES)
+            config: Dict with `default` (null = no factor) and `rules`:
+                    [{id, keywords, factor}, ...] for keyword tables, or
+                    [{id, value, factor}, ...] plus `key` for value tables.
+                    Optional: gate `keywords` (rebar table) and `formula_coefficient`
+                    (factor = coefficient × value² for unlisted values)
+
+        Raises:
+            ValueError: If the section is malformed
+        """
+        self.name = name
+        try:
+            self.default = float('nan') if config['default'] is None else float(config['default'])
+            rules = config['rules']
+            self.key = config.get('key')
+            self.rule_ids = [str(rule['id']) for rule in rules]
+            if self.key:
+                self.values = [rule['value'] for rule in rules]
+                self.keywords = [[] for _ in rules]
+            else:
+                self.values = [None for _ in rules]
+                self.keywords = [[str(k) for k in rule['keywords']] for rule in rules]
+            factors = [float(rule['factor']) for rule in rules]
+            coefficient = config.get('formula_coefficient')
+            self.formula_coefficient = None if coefficient is None else float(coefficient)
+        except (KeyError, TypeError, ValueError) as e:
+            raise ValueError(f"Factor table '{name}' is malformed: {e}") from e
+        if (len(set(self.rule_ids)) != len(self.rule_ids)
+                or {DEFAULT_RULE_ID, FORMULA_RULE_ID} & set(self.rule_ids)):
+            raise ValueError(f"Factor table '{name}' has duplicate or reserved rule ids: {self.rule_ids}")
+
+        self.gate_keywords = [str(k) for k in config.get('keywords', [])]
+        self.gate = compile_keywords(self.gate_keywords) if self.gate_keywords else None
+        self.patterns = [compile_keywords(keywords) for keywords in self.keywords]
+        self.value_index = {value: i for i, value in enumerate(self.values)} if self.key else {}
+
+        # Lookup arrays indexed by rule index: rules, then the default, then the
+        # formula (its factor depends on the value, so the array holds NaN)
+        rule_ids = self.rule_ids + [DEFAULT_RULE_ID]
+        factors.append(self.default)
+        if self.formula_coefficient is not None:
+            rule_ids.append(FORMULA_RULE_ID)
+            factors.append(float('nan'))
+        self.factors = np.array(factors, dtype=float)
+        self.labels = [f"{name}.{rule_id}" for rule_id in rule_ids]
+
+    def __len__(self) -> int:
+        return len(self.rule_ids)
+
+    @property
+    def default_index(self) -> int:
+        return len(self.rule_ids)
+
+    @property
+    def formula_index(self) -> Optional[int]:
+        return len(self.rule_ids) + 1 if self.formula_coefficient is not None else None
+
+    @property
+    def covered_values(self) -> Tuple:
+        """Which values get a factor at all: key, listed values with a factor, default and formula fallback"""
+        listed = frozenset(value for value, factor in zip(self.values, self.factors) if not np.isnan(factor))
+        return self.key, listed, not np.isnan(self.default), self.formula_coefficient is not None
+
+    def match_values(self, values: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Look up extracted values (value tables; call on distinct values)
+
+        Values without a rule use the formula when the table has one, the
+        default when they are missing.
+
+        Returns:
+            Tuple of (rule indices, factors)
+        """
+        missing = pd.isna(values)
+        fallback = self.default_index if self.formula_index is None else self.formula_index
+        index = np.array([self.default_index if miss else self.value_index.get(value, fallback)
+                          for value, miss in zip(values, missing)], dtype=np.int64)
+        factors = self.factors[index]
+        if self.formula_index is not None:
+            formula = index == self.formula_index
+            factors[formula] = self.formula_coefficient * np.asarray(values, dtype=float)[formula] ** 2
+        return index, factors
+
+    def match(self, texts: pd.Series) -> np.ndarray:
+        """Index of the first matching rule per lower-cased text (default_index if none)"""
+        if len(texts) == 0:
+            return np.empty(0, dtype=np.int64)
+        conditions = [texts.str.contains(pattern, regex=True).to_numpy(dtype=bool) for pattern in self.patterns]
+        return np.select(conditions, np.arange(len(self.patterns)), default=self.default_index)
+
+    def gate_mask(self, texts: pd.Series) -> np.ndarray:
+        """True where the table applies at all (always True without gate keywords)"""
+        if self.gate is None:
+            return np.ones(len(texts), dtype=bool)
+        return texts.str.contains(self.gate, regex=True).to_numpy(dtype=bool)
+
+
+class FactorTables:
+    """The full set of conversion factor tables of one configuration version"""
+
+    def __init__(self, config: Dict, source: str = ""):
+        """
+        Compile all tables of a factor configuration
+
+        Args:
+            config: Parsed factor configuration (see carbomatch_factors.json)
+            source: Where the configuration came from (for messages)
+
+        Raises:
+            ValueError: If a table is missing or malformed
+        """
+        missing = [name for name in TABLE_NAMES if name not in config]
+        if missing:
+            raise ValueError(f"Factor configuration {source} is missing tables: {missing}")
+
+        self.source = source
+        self.config = config
+        self.version = str(config.get('version', 'unversioned'))
+        self.digest = hashlib.sha256(json.dumps(config, sort_keys=True).encode('utf-8')).hexdigest()
+        self.tables = {name: FactorTable(name, config[name]) for name in TABLE_NAMES}
+
+        # One label space over all tables, so rule columns can be categorical
+        self.offsets = {}
+        self.rule_labels = []
+        for name in TABLE_NAMES:
+            self.offsets[name] = len(self.rule_labels)
+            self.rule_labels.extend(self.tables[name].labels)
+
+    def __getitem__(self, name: str) -> FactorTable:
+        return self.tables[name]
+
+    @property
+    def version_label(self) -> str:
+        """Version plus short content hash, e.g. '2025.1+3fa4c2d1'"""
+        return f"{self.version}+{self.digest[:8]}"
+
+    def with_overrides(self, overrides: Dict[str, Dict[str, float]], source: str = "") -> 'FactorTables':
+        """
+        Copy of these tables with individual factors replaced
+        
+        Args:
+            overrides: {table: {rule id: factor}}; the ids 'default' and
+                       'formula' set the table default and formula coefficient
+            source: Description of the derived tables (for messages)
+            
+        Returns:
+            New FactorTables (version label reflects the changed content)
+            
+        Raises:
+            ValueError: If a table or rule id does not exist
+        """
+        config = json.loads(json.dumps(self.config))
+        for name, factors in overrides.items():
+            if name not in TABLE_NAMES:
+                raise ValueError(f"Unknown factor table '{name}' (use one of {TABLE_NAMES})")
+            rules = {str(rule['id']): rule for rule in config[name]['rules']}
+            for rule_id, factor in factors.items():
+                if rule_id == DEFAULT_RULE_ID:
+                    config[name]['default'] = factor
+                elif rule_id == FORMULA_RULE_ID:
+                    config[name]['formula_coefficient'] = factor
+                elif rule_id in rules:
+                    rules[rule_id]['factor'] = factor
+                else:
+                    raise ValueError(f"Factor table '{name}' has no rule '{rule_id}'")
+        return FactorTables(config, source=source or f"{self.source} + overrides")
+    
+    def changed_rule_labels(self, other: 'FactorTables') -> Set[str]:
+        """
+        Rule labels whose outcome differs between this and another version
+
+        A changed factor marks only its own rule. Changed keywords, rule order or
+        gate keywords can move texts between rules, so they mark the whole table
+        ('<table>.*'). The rebar gate decides between the rebar and the linear
+        table, so changing it marks both. Mesh types without a factor fall back
+        to the area thickness rules, so changing which types have one marks the
+        mesh and the area thickness tables.
+        """
+        changed = set()
+        if self.tables[REBAR_WEIGHT].gate_keywords != other.tables[REBAR_WEIGHT].gate_keywords:
+            changed.update({f"{REBAR_WEIGHT}.{ANY_RULE_ID}", f"{LINEAR_WEIGHT}.{ANY_RULE_ID}"})
+        if self.tables[MESH_WEIGHT].covered_values != other.tables[MESH_WEIGHT].covered_values:
+            changed.update({f"{MESH_WEIGHT}.{ANY_RULE_ID}", f"{AREA_THICKNESS}.{ANY_RULE_ID}"})
+        for name in TABLE_NAMES:
+            old, new = self.tables[name], other.tables[name]
+            if (old.rule_ids != new.rule_ids or old.keywords != new.keywords
+                    or old.key != new.key or old.values != new.values
+                    or (old.formula_coefficient is None) != (new.formula_coefficient is None)):
+                changed.add(f"{name}.{ANY_RULE_ID}")
+                continue
+            for label, old_factor, new_factor in zip(old.labels, old.factors, new.factors):
+                if old_factor != new_factor and not (np.isnan(old_factor) and np.isnan(new_factor)):
+                    changed.add(label)
+            if old.formula_coefficient != new.formula_coefficient:
+                changed.add(f"{name}.{FORMULA_RULE_ID}")
+        return changed
+
+
+def affected_rows(rule_columns: List[pd.Series], changed: Set[str]) -> np.ndarray:
+    """
+    Mask of rows whose recorded conversion rules are among the changed labels
+
+    Args:
+        rule_columns: Per-row rule label columns (`conversion_rule`, `material_rule`)
+        changed: Output of FactorTables.changed_rule_labels()
+
+    Returns:
+        Boolean array aligned with the columns
+    """
+    changed_tables = {label[:-len(ANY_RULE_ID) - 1] for label in changed if label.endswith(f".{ANY_RULE_ID}")}
+    mask = np.zeros(len(rule_columns[0]) if rule_columns else 0, dtype=bool)
+    for column in rule_columns:
+        # Decide per distinct label, then gather through the codes
+        codes, labels = pd.factorize(column.astype(object), use_na_sentinel=True)
+        hit = np.array([label in changed or str(label).rsplit('.', 1)[0] in changed_tables for label in labels]
+                       + [False], dtype=bool)
+        mask |= hit[codes]
+    return mask
+
+
+_LOADED: Dict[tuple, FactorTables] = {}
+
+
+def load_factor_tables(path: Optional[str] = None) -> FactorTables:
+    """
+    Load and compile the factor tables (compiled once per file version)
+
+    Args:
+        path: JSON factor configuration (defaults to carbomatch_factors.json
+              next to this module)
+
+    Returns:
+        Compiled FactorTables
+    """
+    path = os.path.abspath(path or FACTORS_FILE)
+    key = (path, os.stat(path).st_mtime_ns)
+    if key not in _LOADED:
+        with open(path, encoding='utf-8') as f:
+            _LOADED[key] = FactorTables(json.load(f), source=path)
+    return _LOADED[key]
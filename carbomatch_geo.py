@@ -0,0 +1,258 @@
+#!/usr/bin/env python3
+"""
+CarbonMatch - Geodistances
+==========================
+
+Supplier → site distances from stored coordinates, for pairs the distance
+table does not list.
+
+- Geocode table (`carbomatch_geocodes.csv`, semicolon-separated):
+  `type;name;lat;lon` with type `supplier` (name = Lieferant) or `site`
+  (name = site id).
+- Geodesic distance: vectorized haversine × road detour factor
+  (`road_detour_factor` in carbomatch_transport.json).
+- Routing: optionally a RoutingService (e.g. OSRMRouter) is queried in
+  batches for pairs not yet known. Every routed pair is memoized in
+  `carbomatch_routes.json`, keyed by both coordinates, so repeat runs make no
+  routing calls and moved locations are routed again. GeodesicRouter is a
+  local stand-in with the same interface.
+"""
+
+from __future__ import annotations
+
+import json
+import logging
+import math
+import os
+import threading
+from typing import Dict, Optional, Tuple
+
+from carbomatch_lazy import lazy_import
+
+np = lazy_import("numpy")
+pd = lazy_import("pandas")
+
+logger = logging.getLogger(__name__)
+
+GEOCODES_FILE = "carbomatch_geocodes.csv"
+ROUTE_CACHE_FILE = "carbomatch_routes.json"
+
+EARTH_RADIUS_KM = 6371.0088
+DEFAULT_DETOUR_FACTOR = 1.3
+GEOCODE_TYPES = ['supplier', 'site']
+
+
+def haversine_km(lat1, lon1, lat2, lon2):
+    """Great-circle distance in km between coordinate arrays (degrees)"""
+    lat1, lon1, lat2, lon2 = (np.radians(np.asarray(v, dtype=float)) for v in (lat1, lon1, lat2, lon2))
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.clip(a, 0.0, 1.0)))
+
+
+def load_geocodes(path: str) -> pd.DataFrame:
+    """
+    Read and check a geocode table
+
+    Raises:
+        ValueError: If columns are missing, types are unknown, coordinates are
+                    out of range or a name occurs twice for one type
+    """
+    table = pd.read_csv(path, sep=';', dtype=str, encoding='utf-8-sig', keep_default_na=False)
+    missing = [col for col in ['type', 'name', 'lat', 'lon'] if col not in table.columns]
+    if missing:
+        raise ValueError(f"Geocode table {path} is missing columns: {missing}")
+    table = table[['type', 'name', 'lat', 'lon']].copy()
+    for col in ['lat', 'lon']:
+        table[col] = pd.to_numeric(table[col].str.replace(',', '.', regex=False), errors='coerce')
+    unknown = sorted(set(table['type']) - set(GEOCODE_TYPES))
+    if unknown:
+        raise ValueError(f"Geocode table {path} has unknown types: {unknown}")
+    invalid = ~(table['lat'].between(-90, 90) & table['lon'].between(-180, 180))
+    if invalid.any():
+        raise ValueError(f"Geocode table {path} has invalid coordinates for: {sorted(table.loc[invalid, 'name'])}")
+    duplicated = table.duplicated(['type', 'name'])
+    if duplicated.any():
+        raise ValueError(f"Geocode table {path} lists names twice: {sorted(table.loc[duplicated, 'name'])}")
+    return table
+
+
+class RoutingService:
+    """Road distance provider queried in batches (subclass and implement route_km)"""
+
+    name = 'routing'
+    batch_size = 100
+
+    def route_km(self, origins: np.ndarray, destinations: np.ndarray) -> np.ndarray:
+        """
+        Road distances for coordinate pairs
+
+        Args:
+            origins: (n, 2) array of lat, lon
+            destinations: (n, 2) array of lat, lon
+
+        Returns:
+            n distances in km (NaN where no route was found)
+        """
+        raise NotImplementedError
+
+
+class GeodesicRouter(RoutingService):
+    """Local stand-in: haversine × detour factor, no network access"""
+
+    def __init__(self, detour_factor: float = DEFAULT_DETOUR_FACTOR):
+        self.detour_factor = detour_factor
+        self.name = f"geodesic×{detour_factor}"
+
+    def route_km(self, origins: np.ndarray, destinations: np.ndarray) -> np.ndarray:
+        return haversine_km(origins[:, 0], origins[:, 1], destinations[:, 0], destinations[:, 1]) * self.detour_factor
+
+
+class OSRMRouter(RoutingService):
+    """OSRM `table` service (e.g. a self-hosted http://localhost:5000)"""
+
+    def __init__(self, url: str, profile: str = 'driving', timeout: float = 30.0):
+        self.url = url.rstrip('/')
+        self.profile = profile
+        self.timeout = timeout
+        self.name = f"osrm:{self.url}/{profile}"
+
+    def route_km(self, origins: np.ndarray, destinations: np.ndarray) -> np.ndarray:
+        import urllib.request
+
+        # One table request per batch over the distinct points only: a batch of
+        # many suppliers and a few sites is a suppliers × sites matrix, not pairs × pairs
+        sources, source_index = np.unique(origins, axis=0, return_inverse=True)
+        targets, target_index = np.unique(destinations, axis=0, return_inverse=True)
+        points = np.vstack([sources, targets])
+        coordinates = ';'.join(f"{lon:.6f},{lat:.6f}" for lat, lon in points)
+        n = len(sources)
+        query = (f"{self.url}/table/v1/{self.profile}/{coordinates}?annotations=distance"
+                 f"&sources={';'.join(map(str, range(n)))}"
+                 f"&destinations={';'.join(map(str, range(n, len(points))))}")
+        with urllib.request.urlopen(query, timeout=self.timeout) as response:
+            data = json.load(response)
+        if data.get('code') != 'Ok':
+            raise RuntimeError(f"OSRM request failed: {data.get('code')} {data.get('message', '')}")
+        matrix = np.array([[np.nan if d is None else d for d in row] for row in data['distances']], dtype=float)
+        return matrix[source_index.ravel(), target_index.ravel()] / 1000
+
+
+def _pair_key(origin, destination) -> str:
+    return f"{origin[0]:.5f},{origin[1]:.5f}>{destination[0]:.5f},{destination[1]:.5f}"
+
+
+class RouteCache:
+    """Persistent memo of routed distances per routing service and coordinate pair"""
+
+    def __init__(self):
+        self.routes: Dict[str, Dict[str, float]] = {}
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return sum(len(routes) for routes in self.routes.values())
+
+    def distances(self, router: RoutingService, origins: np.ndarray, destinations: np.ndarray) -> np.ndarray:
+        """Routed distances, querying the router only for pairs not cached yet"""
+        keys = [_pair_key(o, d) for o, d in zip(origins, destinations)]
+        with self._lock:
+            routes = self.routes.setdefault(router.name, {})
+            km = np.array([routes.get(key, np.nan) for key in keys], dtype=float)
+            missing = np.flatnonzero([key not in routes for key in keys])
+            self.hits += len(keys) - len(missing)
+            self.misses += len(missing)
+
+        for start in range(0, len(missing), router.batch_size):
+            batch = missing[start:start + router.batch_size]
+            try:
+                routed = router.route_km(origins[batch], destinations[batch])
+            except Exception as e:
+                logger.warning(f"Routing via {router.name} failed for {len(batch)} pairs: {e}")
+                continue
+            km[batch] = routed
+            with self._lock:
+                for i, value in zip(batch, routed):
+                    if not math.isnan(value):
+                        routes[keys[i]] = float(value)
+        if len(keys):
+            logger.info(f"Routes: {len(keys) - len(missing)} cached, {len(missing)} requested from {router.name}")
+        return km
+
+    def load(self, path: str = ROUTE_CACHE_FILE) -> None:
+        """Restore persisted routes (ignored when missing or unreadable)"""
+        if not os.path.exists(path):
+            return
+        try:
+            with open(path, encoding='utf-8') as f:
+                routes = json.load(f)['routes']
+        except (OSError, ValueError, KeyError, TypeError) as e:
+            logger.warning(f"Ignoring unreadable route cache {path}: {e}")
+            return
+        with self._lock:
+            self.routes = {name: dict(entries) for name, entries in routes.items()}
+        logger.info(f"Loaded {len(self)} cached routes from {path}")
+
+    def save(self, path: str = ROUTE_CACHE_FILE) -> None:
+        """Persist the routes (atomic replace)"""
+        if not len(self):
+            return
+        with self._lock:
+            data = {'routes': {name: dict(entries) for name, entries in self.routes.items()}}
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(data, f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+        logger.info(f"Saved {len(self)} cached routes to {path}")
+
+
+class GeoDistances:
+    """Pair distances from the geocode table, routed when a service is configured"""
+
+    def __init__(self, geocodes: pd.DataFrame, detour_factor: float = DEFAULT_DETOUR_FACTOR,
+                 router: Optional[RoutingService] = None, cache: Optional[RouteCache] = None):
+        """
+        Args:
+            geocodes: Geocode table (see load_geocodes)
+            detour_factor: Road distance per great-circle km
+            router: Routing service, None for geodesic distances only
+            cache: Route memo shared between runs (a fresh one when None)
+        """
+        self.geocodes = geocodes
+        self.detour_factor = detour_factor
+        self.router = router
+        self.cache = cache if cache is not None else RouteCache()
+        self.coordinates = {
+            kind: geocodes[geocodes['type'] == kind].set_index('name')[['lat', 'lon']]
+            for kind in GEOCODE_TYPES
+        }
+
+    def pair_distances(self, suppliers: np.ndarray, sites: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Distances for (supplier, site) pairs
+
+        Args:
+            suppliers: Supplier name per pair
+            sites: Site id per pair
+
+        Returns:
+            (distance_km, routed) - NaN where a coordinate is missing; routed
+            marks distances from the routing service (else geodesic × detour)
+        """
+        supplier_rows = self.coordinates['supplier'].index.get_indexer(suppliers)
+        site_rows = self.coordinates['site'].index.get_indexer(sites)
+        known = np.flatnonzero((supplier_rows >= 0) & (site_rows >= 0))
+        km = np.full(len(suppliers), np.nan)
+        routed = np.zeros(len(suppliers), dtype=bool)
+        if len(known) == 0:
+            return km, routed
+
+        origins = self.coordinates['supplier'].to_numpy()[supplier_rows[known]]
+        destinations = self.coordinates['site'].to_numpy()[site_rows[known]]
+        km[known] = haversine_km(origins[:, 0], origins[:, 1], destinations[:, 0], destinations[:, 1]) * self.detour_factor
+        if self.router is not None:
+            routes = self.cache.distances(self.router, origins, destinations)
+            found = ~np.isnan(routes)
+            km[known[found]] = routes[found]
+            routed[known[found]] = True
+        return km, routed
@@ -0,0 +1,414 @@
+#!/usr/bin/env python3
+"""
+CarbonMatch - Run History
+=========================
+
+Keeps every report run next to the previous ones, so a change of Ökobaudat
+release, factor tables or matcher settings can be audited row by row:
+
+    python carbomatch_history.py runs
+    python carbomatch_history.py diff                  # the two latest runs
+    python carbomatch_history.py diff 20261019-0930 20261020-1015 --output changes.csv
+
+Each run is a directory `carbomatch_history/<run_id>/` holding
+
+- `manifest.json`: run id, time, site, report path, row count, input file
+  digests, settings (embedding model, factor table and transport model
+  versions) and the report totals
+- `rows.parquet` (pickle without pyarrow): the HISTORY_COLUMNS of every
+  report row - delivery, match and CO₂e values plus two hashes:
+
+    row_hash     identity of the delivery row: supplier, article number,
+                 article text, quantity and unit, plus the occurrence number
+                 of identical rows (as the ledger fingerprint, but without the
+                 source file name, so renamed workbooks still line up)
+    result_hash  the outcome: matched material and category, status code and
+                 rounded CO₂e values
+
+Diffing two runs is a hash join on row_hash (one hash table over the older
+run's hashes, one probe per newer row); rows whose result_hash agrees are
+dropped before any other column is touched, so only changed rows are
+materialized.
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import logging
+import os
+import uuid
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional
+
+from carbomatch_lazy import lazy_import
+from carbomatch_checkpoint import frame_digest
+from carbomatch_ledger import FINGERPRINT_COLUMNS
+from carbomatch_report import round_report, type_report
+
+np = lazy_import("numpy")
+pd = lazy_import("pandas")
+
+logger = logging.getLogger(__name__)
+
+HISTORY_DIR = "carbomatch_history"
+HISTORY_FORMAT = 1
+MANIFEST_FILE = "manifest.json"
+ROWS_FILE = "rows"
+
+MATCH_COLUMNS = ['matched_material', 'matched_category']
+VALUE_COLUMNS = ['calculated_co2e_a1_a3', 'calculated_co2e_a4', 'total_co2e']
+RESULT_COLUMNS = [*MATCH_COLUMNS, 'calculation_code', *VALUE_COLUMNS]
+HISTORY_COLUMNS = ['row_hash', 'result_hash', *FINGERPRINT_COLUMNS, 'matched_uuid', *RESULT_COLUMNS]
+
+# Report summary entries kept in the manifest
+MANIFEST_TOTALS = ['total_items', 'successful_items', 'material_co2e', 'transport_co2e', 'total_co2e']
+
+# Change kinds of a diff row (the first that applies)
+CHANGE_ADDED = 'added'
+CHANGE_REMOVED = 'removed'
+CHANGE_MATCH = 'match'
+CHANGE_STATUS = 'status'
+CHANGE_CO2E = 'co2e'
+CHANGE_KINDS = [CHANGE_ADDED, CHANGE_REMOVED, CHANGE_MATCH, CHANGE_STATUS, CHANGE_CO2E]
+
+DIFF_COLUMNS = [
+    'change', 'Lieferant', 'Artikel', 'Menge', 'Einheit', 'old_material', 'new_material',
+    'old_calculation_code', 'new_calculation_code', 'old_total_co2e', 'new_total_co2e',
+    'delta_co2e_a1_a3', 'delta_co2e_a4', 'delta_total_co2e', 'row_hash',
+]
+SUPPLIER_DIFF_COLUMNS = [
+    'Lieferant', 'changed_rows', *[f"{kind}_rows" for kind in CHANGE_KINDS],
+    'delta_co2e_a1_a3', 'delta_co2e_a4', 'delta_total_co2e',
+]
+
+
+def _text(series: pd.Series) -> pd.Series:
+    """Labels as plain strings ('' for missing), whatever the column dtype"""
+    values = series.astype(object)
+    return values.where(values.notna(), '').astype(str)
+
+
+def _hash(frame: pd.DataFrame, text_columns: List[str], number_columns: List[str]) -> np.ndarray:
+    """uint64 hash per row of the given columns (texts compared as strings, numbers as floats)"""
+    key = {}
+    for col in text_columns:
+        # Each distinct label is converted and hashed once
+        codes, uniques = pd.factorize(frame[col].astype(object), use_na_sentinel=False)
+        key[col] = pd.util.hash_array(_text(pd.Series(uniques, dtype=object)).to_numpy(dtype=object))[codes]
+    for col in number_columns:
+        key[col] = pd.util.hash_array(pd.to_numeric(frame[col], errors='coerce').to_numpy(dtype=float))
+    return pd.util.hash_pandas_object(pd.DataFrame(key), index=False).to_numpy(dtype=np.uint64)
+
+
+def row_hashes(frame: pd.DataFrame) -> np.ndarray:
+    """Delivery identity hash per row (see module docstring)"""
+    base = _hash(frame, ['Lieferant', 'Artikel-Nummer', 'Artikel', 'Einheit'], ['Menge'])
+    occurrence = pd.Series(base).groupby(base, sort=False).cumcount().to_numpy()
+    return pd.util.hash_pandas_object(pd.DataFrame({'base': base, 'occurrence': occurrence}),
+                                      index=False).to_numpy(dtype=np.uint64)
+
+
+def result_hashes(frame: pd.DataFrame) -> np.ndarray:
+    """Outcome hash per row: match, status code and rounded CO₂e values"""
+    return _hash(round_report(frame[RESULT_COLUMNS].copy()), MATCH_COLUMNS, ['calculation_code', *VALUE_COLUMNS])
+
+
+def history_rows(frames: Iterable[pd.DataFrame]) -> pd.DataFrame:
+    """HISTORY_COLUMNS of report rows (e.g. the previous and the new rows of a run)"""
+    columns = HISTORY_COLUMNS[2:]
+    rows = pd.concat([frame.reindex(columns=columns) for frame in frames] or [pd.DataFrame(columns=columns)],
+                     ignore_index=True)
+    type_report(round_report(rows))
+    rows.insert(0, 'result_hash', result_hashes(rows))
+    rows.insert(0, 'row_hash', row_hashes(rows))
+    return rows
+
+
+class RunHistory:
+    """Directory of recorded report runs (`<run_id>/manifest.json` + rows)"""
+
+    def __init__(self, directory: str = HISTORY_DIR):
+        """Open the run history at `directory` (created on first record)"""
+        self.directory = directory
+
+    def record(self, frames: Iterable[pd.DataFrame], site: str = '', report: str = '',
+               summary: Optional[Dict] = None, inputs: Optional[Dict] = None,
+               settings: Optional[Dict] = None) -> Dict:
+        """
+        Store a run's report rows and its manifest
+
+        Args:
+            frames: Frames holding the report columns (e.g. previous and new rows)
+            site: Site id ('' for runs without one)
+            report: Report path of the run
+            summary: Report summary (carbomatch_summary); MANIFEST_TOTALS are kept
+            inputs: Input files of the run, e.g. {'oekobaudat': {'file': ..., 'digest': ...}}
+            settings: Settings the results depend on (embedding model, factor tables, ...)
+
+        Returns:
+            The run manifest
+        """
+        rows = history_rows(frames)
+        run_id = f"{datetime.now():%Y%m%d-%H%M%S}-{uuid.uuid4().hex[:6]}"
+        run_dir = os.path.join(self.directory, run_id)
+        os.makedirs(run_dir)
+        path = os.path.join(run_dir, f"{ROWS_FILE}.parquet")
+        try:
+            rows.to_parquet(path, index=False)
+        except (ImportError, ValueError, TypeError) as e:
+            # pyarrow missing or a column it cannot type
+            logger.info(f"Run rows stored as pickle ({type(e).__name__}: {e})")
+            if os.path.exists(path):
+                os.remove(path)
+            path = os.path.join(run_dir, f"{ROWS_FILE}.pkl")
+            rows.to_pickle(path)
+
+        manifest = {
+            'format': HISTORY_FORMAT,
+            'run_id': run_id,
+            'created_at': datetime.now().isoformat(timespec='seconds'),
+            'site': site or '',
+            'report': report,
+            'rows': len(rows),
+            'rows_file': os.path.basename(path),
+            'rows_digest': frame_digest(rows[['row_hash', 'result_hash']]),
+            'inputs': inputs or {},
+            'settings': settings or {},
+            'totals': {key: summary[key] for key in MANIFEST_TOTALS if key in summary} if summary else {},
+        }
+        # The manifest is written last: a run directory without one is incomplete
+        tmp_path = os.path.join(run_dir, f"{MANIFEST_FILE}.tmp")
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(manifest, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, os.path.join(run_dir, MANIFEST_FILE))
+        logger.info(f"Recorded run {run_id} ({len(rows):,} rows) in {run_dir}")
+        return manifest
+
+    def runs(self, site: Optional[str] = None) -> List[Dict]:
+        """Manifests of the complete runs, oldest first (optionally of one site)"""
+        if not os.path.isdir(self.directory):
+            return []
+        manifests = []
+        for name in sorted(os.listdir(self.directory)):
+            path = os.path.join(self.directory, name, MANIFEST_FILE)
+            if not os.path.exists(path):
+                continue
+            with open(path, encoding='utf-8') as f:
+                manifest = json.load(f)
+            if site is None or manifest.get('site', '') == site:
+                manifests.append(manifest)
+        return manifests
+
+    def manifest(self, run_id: str) -> Dict:
+        """Manifest of a run, given its id or a unique prefix of it"""
+        matches = [manifest for manifest in self.runs() if manifest['run_id'].startswith(run_id)]
+        if len(matches) != 1:
+            raise KeyError(f"{len(matches)} runs in {self.directory} match '{run_id}'")
+        return matches[0]
+
+    def rows(self, manifest: Dict) -> pd.DataFrame:
+        """HISTORY_COLUMNS of a recorded run"""
+        path = os.path.join(self.directory, manifest['run_id'], manifest['rows_file'])
+        return pd.read_parquet(path) if path.endswith('.parquet') else pd.read_pickle(path)
+
+
+def _changes(old: Optional[pd.DataFrame], new: Optional[pd.DataFrame]) -> pd.DataFrame:
+    """DIFF_COLUMNS of aligned row subsets of two runs (None: the rows exist in one run only)"""
+    delivery = new if new is not None else old
+    n = len(delivery)
+
+    def labels(rows: Optional[pd.DataFrame], col: str) -> np.ndarray:
+        return _text(rows[col]).to_numpy(dtype=object) if rows is not None else np.full(n, '', dtype=object)
+
+    def numbers(rows: Optional[pd.DataFrame], col: str) -> np.ndarray:
+        if rows is None:
+            return np.full(n, np.nan)
+        return pd.to_numeric(rows[col], errors='coerce').to_numpy(dtype=float)
+
+    match_changed = np.zeros(n, dtype=bool)
+    for col in MATCH_COLUMNS:
+        match_changed |= labels(old, col) != labels(new, col)
+    old_code, new_code = numbers(old, 'calculation_code'), numbers(new, 'calculation_code')
+    status_changed = (old_code != new_code) & ~(np.isnan(old_code) & np.isnan(new_code))
+    change = np.select([np.full(n, old is None), np.full(n, new is None), match_changed, status_changed],
+                       [CHANGE_ADDED, CHANGE_REMOVED, CHANGE_MATCH, CHANGE_STATUS], default=CHANGE_CO2E)
+    # Missing values count as no emission
+    deltas = {f"delta_{col.replace('calculated_', '')}": np.nan_to_num(numbers(new, col)) - np.nan_to_num(numbers(old, col))
+              for col in VALUE_COLUMNS}
+    return pd.DataFrame({
+        'change': change,
+        'Lieferant': labels(delivery, 'Lieferant'),
+        'Artikel': labels(delivery, 'Artikel'),
+        'Menge': numbers(delivery, 'Menge'),
+        'Einheit': labels(delivery, 'Einheit'),
+        'old_material': labels(old, 'matched_material'),
+        'new_material': labels(new, 'matched_material'),
+        'old_calculation_code': pd.Series(old_code).astype('Int8'),
+        'new_calculation_code': pd.Series(new_code).astype('Int8'),
+        'old_total_co2e': numbers(old, 'total_co2e'),
+        'new_total_co2e': numbers(new, 'total_co2e'),
+        **deltas,
+        'row_hash': delivery['row_hash'].to_numpy(dtype=np.uint64),
+    })[DIFF_COLUMNS]
+
+
+def diff_runs(old: pd.DataFrame, new: pd.DataFrame, min_delta: float = 0.0) -> pd.DataFrame:
+    """
+    Rows whose match, status or CO₂e differ between two runs
+
+    Hash join on row_hash: the older run's hashes are put into one hash
+    table and probed with the newer run's; pairs with equal result_hash are
+    dropped before any other column is read.
+
+    Args:
+        old: Rows of the earlier run (RunHistory.rows)
+        new: Rows of the later run
+        min_delta: Drop rows whose only change is a total CO₂e delta below this (kg)
+
+    Returns:
+        DIFF_COLUMNS, one row per added, removed or changed delivery, by
+        descending absolute total CO₂e delta
+    """
+    old_index = pd.Index(old['row_hash'].to_numpy(dtype=np.uint64))
+    if not old_index.is_unique:
+        raise ValueError("Duplicate row hashes in the older run - rows cannot be paired")
+    positions = old_index.get_indexer(new['row_hash'].to_numpy(dtype=np.uint64))
+    paired = positions >= 0
+    changed = np.zeros(len(new), dtype=bool)
+    changed[paired] = (old['result_hash'].to_numpy(dtype=np.uint64)[positions[paired]]
+                       != new['result_hash'].to_numpy(dtype=np.uint64)[paired])
+    removed = np.ones(len(old), dtype=bool)
+    removed[positions[paired]] = False
+
+    diff = pd.concat([
+        _changes(old.iloc[positions[changed]], new.iloc[np.flatnonzero(changed)]),
+        _changes(None, new.iloc[np.flatnonzero(~paired)]),
+        _changes(old.iloc[np.flatnonzero(removed)], None),
+    ], ignore_index=True)
+    if min_delta > 0:
+        diff = diff[(diff['change'] != CHANGE_CO2E) | (diff['delta_total_co2e'].abs() >= min_delta)]
+    order = np.argsort(-diff['delta_total_co2e'].abs().to_numpy(), kind='stable')
+    return diff.iloc[order].reset_index(drop=True)
+
+
+def supplier_changes(diff: pd.DataFrame) -> pd.DataFrame:
+    """Changed rows per kind and CO₂e deltas per supplier, by descending absolute total delta"""
+    counts = pd.crosstab(diff['Lieferant'], diff['change']).reindex(columns=CHANGE_KINDS, fill_value=0)
+    counts.columns = [f"{kind}_rows" for kind in CHANGE_KINDS]
+    deltas = diff.groupby('Lieferant', sort=False)[['delta_co2e_a1_a3', 'delta_co2e_a4', 'delta_total_co2e']].sum()
+    suppliers = counts.join(deltas).round(4)
+    suppliers.insert(0, 'changed_rows', counts.sum(axis=1))
+    suppliers = suppliers.reset_index().rename(columns={'index': 'Lieferant'})
+    order = np.argsort(-suppliers['delta_total_co2e'].abs().to_numpy(), kind='stable')
+    return suppliers.iloc[order].reset_index(drop=True)[SUPPLIER_DIFF_COLUMNS]
+
+
+def diff_totals(diff: pd.DataFrame, old: Dict, new: Dict) -> Dict:
+    """Row counts per change kind and total CO₂e deltas of a diff between two run manifests"""
+    counts = diff['change'].value_counts()
+    return {
+        'old_run': old['run_id'],
+        'new_run': new['run_id'],
+        'old_rows': old['rows'],
+        'new_rows': new['rows'],
+        'changed_rows': len(diff),
+        **{f"{kind}_rows": int(counts.get(kind, 0)) for kind in CHANGE_KINDS},
+        'suppliers': int(diff['Lieferant'].nunique()),
+        **{col: float(round(diff[col].sum(), 4)) for col in ['delta_co2e_a1_a3', 'delta_co2e_a4', 'delta_total_co2e']},
+    }
+
+
+def _changed_settings(old: Dict, new: Dict) -> List[str]:
+    """'key: old -> new' lines for differing manifest inputs and settings"""
+    lines = []
+    for section in ['inputs', 'settings']:
+        for key in sorted(set(old.get(section, {})) | set(new.get(section, {}))):
+            before, after = old.get(section, {}).get(key), new.get(section, {}).get(key)
+            if before != after:
+                lines.append(f"{key}: {before} -> {after}")
+    return lines
+
+
+def main(argv: Optional[List[str]] = None):
+    """Run history entry point"""
+    parser = argparse.ArgumentParser(description="List recorded CarbonMatch runs and diff two of them")
+    parser.add_argument('--dir', default=HISTORY_DIR, help=f"run history directory (default: {HISTORY_DIR})")
+    parser.add_argument('--site', default=None, help="only runs of this site")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    subparsers.add_parser('runs', help="recorded runs with their settings and totals")
+
+    diff_parser = subparsers.add_parser('diff', help="rows whose match or CO₂e changed between two runs")
+    diff_parser.add_argument('old', nargs='?', default=None,
+                             help="earlier run id or prefix (default: the run of the same site before the new one)")
+    diff_parser.add_argument('new', nargs='?', default=None,
+                             help="later run id or prefix (default: the latest run of the old run's site)")
+    diff_parser.add_argument('--min-delta', type=float, default=0.0,
+                             help="ignore rows whose only change is a CO₂e delta below this (kg)")
+    diff_parser.add_argument('--top', type=int, default=10, help="changed rows and suppliers listed (default: 10)")
+    diff_parser.add_argument('--output', default=None, help="export all changed rows as CSV")
+    diff_parser.add_argument('--suppliers-output', default=None, help="export the per-supplier changes as CSV")
+    args = parser.parse_args(argv)
+
+    history = RunHistory(args.dir)
+    runs = history.runs(args.site)
+    if args.command == 'runs':
+        print(f"🗂️  Run history {args.dir}: {len(runs)} run(s)")
+        for manifest in runs:
+            settings = manifest.get('settings', {})
+            totals = manifest.get('totals', {})
+            print(f"   • {manifest['run_id']}  {manifest['site'] or '-':<12} {manifest['rows']:>10,} rows  "
+                  f"{totals.get('total_co2e', float('nan')):>16,.2f} kg CO₂e  "
+                  f"factors {settings.get('factor_table_version', '?')}, model {settings.get('embedding_model', '?')}")
+        return
+
+    # Defaults pair runs of one site - rows of different sites never match
+    sites = sorted({manifest.get('site', '') for manifest in runs})
+    if not (args.old or args.new) and args.site is None and len(sites) > 1:
+        parser.error(f"{args.dir} holds runs of several sites ({', '.join(s or '-' for s in sites)}); "
+                     f"pass --site or a run id")
+    try:
+        old_manifest = history.manifest(args.old) if args.old else None
+        new_manifest = history.manifest(args.new) if args.new else None
+    except KeyError as e:
+        parser.error(str(e.args[0]))
+    if new_manifest is None:
+        later = [m for m in runs if old_manifest is None or (
+            m['run_id'] > old_manifest['run_id'] and m.get('site', '') == old_manifest.get('site', ''))]
+        new_manifest = later[-1] if later else None
+    if old_manifest is None and new_manifest is not None:
+        earlier = [m for m in runs if m['run_id'] < new_manifest['run_id']
+                   and m.get('site', '') == new_manifest.get('site', '')]
+        old_manifest = earlier[-1] if earlier else None
+    if old_manifest is None or new_manifest is None:
+        parser.error(f"diff needs two recorded runs of a site, {args.dir} has {len(runs)} run(s)"
+                     + (f" of site {args.site}" if args.site is not None else ""))
+
+    diff = diff_runs(history.rows(old_manifest), history.rows(new_manifest), min_delta=args.min_delta)
+    suppliers = supplier_changes(diff)
+    totals = diff_totals(diff, old_manifest, new_manifest)
+
+    print(f"🔀 Run {totals['old_run']} ({totals['old_rows']:,} rows) → {totals['new_run']} ({totals['new_rows']:,} rows)")
+    for line in _changed_settings(old_manifest, new_manifest):
+        print(f"   ⚙️  {line}")
+    kinds = ', '.join(f"{kind}: {totals[f'{kind}_rows']:,}" for kind in CHANGE_KINDS)
+    print(f"   • Changed rows: {totals['changed_rows']:,} ({kinds})")
+    print(f"   • Affected suppliers: {totals['suppliers']:,}")
+    print(f"   • CO₂e delta: A1-A3 {totals['delta_co2e_a1_a3']:+,.2f}, A4 {totals['delta_co2e_a4']:+,.2f}, "
+          f"total {totals['delta_total_co2e']:+,.2f} kg CO₂e")
+    if len(diff):
+        print(f"\n🏭 SUPPLIERS BY CO₂e DELTA:")
+        print(suppliers.head(args.top).to_string(index=False))
+        print(f"\n📋 LARGEST CHANGES:")
+        print(diff.drop(columns='row_hash').head(args.top).to_string(index=False))
+    if args.output:
+        diff.to_csv(args.output, sep=';', index=False, encoding='utf-8-sig')
+        print(f"\n📄 Changed rows exported to: {args.output}")
+    if args.suppliers_output:
+        suppliers.to_csv(args.suppliers_output, sep=';', index=False, encoding='utf-8-sig')
+        print(f"📄 Supplier changes exported to: {args.suppliers_output}")
+
+
+if __name__ == "__main__":
+    main()
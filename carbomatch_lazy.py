@@ -0,0 +1,47 @@
+#!/usr/bin/env python3
+"""
+CarbonMatch - Lazy Imports
+==========================
+
+Deferred loading of heavy dependencies (pandas, numpy, openai, pyarrow).
+
+`lazy_import` returns a module object immediately and only executes the
+module on first attribute access, so `import carbomatch_pipeline` and short
+CLI commands such as `status` or `cache` do not pay the pandas/numpy import
+cost. Modules keep their usual `pd.` / `np.` spelling:
+
+    pd = lazy_import("pandas")
+"""
+
+import importlib.util
+import sys
+from types import ModuleType
+
+
+def lazy_import(name: str) -> ModuleType:
+    """
+    Return module `name`, deferring its execution until first attribute access
+
+    Already imported modules are returned as-is.
+
+    Raises:
+        ImportError: If the module is not installed
+    """
+    if name in sys.modules:
+        return sys.modules[name]
+
+    spec = importlib.util.find_spec(name)
+    if spec is None:
+        raise ImportError(f"No module named '{name}'")
+
+    loader = importlib.util.LazyLoader(spec.loader)
+    spec.loader = loader
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    loader.exec_module(module)
+    return module
+
+
+def module_available(name: str) -> bool:
+    """Check whether an optional dependency is installed without importing it"""
+    return name in sys.modules or importlib.util.find_spec(name) is not None
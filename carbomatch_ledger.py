@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+"""
+CarbonMatch - Processed-Delivery Ledger
+=======================================
+
+Fingerprints delivery rows and records which of them a previous run has
+already processed, so incremental runs only match and calculate new
+delivery notes.
+
+A fingerprint hashes supplier, article number, article text, quantity, unit
+and source file, plus the occurrence number of identical rows within the
+file so that genuinely repeated deliveries stay distinct.
+"""
+
+from __future__ import annotations
+
+import os
+from datetime import datetime
+from typing import Optional
+
+from carbomatch_lazy import lazy_import
+
+np = lazy_import("numpy")
+pd = lazy_import("pandas")
+
+FINGERPRINT_COLUMNS = ['Lieferant', 'Artikel-Nummer', 'Artikel', 'Menge', 'Einheit']
+FINGERPRINT_COLUMN = 'delivery_fingerprint'
+
+LEDGER_COLUMNS = [FINGERPRINT_COLUMN, 'source_file', 'processed_at']
+
+
+def fingerprint_deliveries(df: pd.DataFrame, source_file: str) -> pd.Series:
+    """
+    Compute a stable hex fingerprint per delivery row
+
+    Args:
+        df: Validated delivery frame (typed `Menge`)
+        source_file: Name of the workbook the rows came from
+
+    Returns:
+        Series of 16-character hex strings aligned with df.index
+    """
+    key = df[FINGERPRINT_COLUMNS].copy()
+    key['source_file'] = os.path.basename(source_file)
+    key['occurrence'] = key.groupby(list(key.columns), sort=False, dropna=False).cumcount()
+
+    hashes = pd.util.hash_pandas_object(key, index=False).to_numpy(dtype=np.uint64)
+    return pd.Series([f"{h:016x}" for h in hashes], index=df.index, dtype=object)
+
+
+class DeliveryLedger:
+    """Local record of delivery fingerprints that have been processed"""
+
+    def __init__(self, path: str):
+        """Open the ledger at `path` (created on first save)"""
+        self.path = path
+        if os.path.exists(path):
+            self.entries = pd.read_csv(path, sep=';', dtype=str, encoding='utf-8-sig')
+        else:
+            self.entries = pd.DataFrame(columns=LEDGER_COLUMNS, dtype=object)
+        self._seen = set(self.entries[FINGERPRINT_COLUMN])
+
+    def __len__(self) -> int:
+        return len(self._seen)
+
+    def unseen_mask(self, fingerprints: pd.Series) -> np.ndarray:
+        """Boolean mask of fingerprints not yet recorded in the ledger"""
+        return ~fingerprints.isin(self._seen).to_numpy()
+
+    def record(self, fingerprints: pd.Series, source_file: str, processed_at: Optional[str] = None) -> None:
+        """Add processed fingerprints (call save() to persist)"""
+        new = fingerprints[~fingerprints.isin(self._seen)].drop_duplicates()
+        if len(new) == 0:
+            return
+        stamp = processed_at or datetime.now().isoformat(timespec='seconds')
+        added = pd.DataFrame({
+            FINGERPRINT_COLUMN: new.to_numpy(),
+            'source_file': os.path.basename(source_file),
+            'processed_at': stamp,
+        })
+        self.entries = pd.concat([self.entries, added], ignore_index=True)
+        self._seen.update(added[FINGERPRINT_COLUMN])
+
+    def save(self) -> None:
+        """Write the ledger back to disk"""
+        self.entries.to_csv(self.path, sep=';', index=False, encoding='utf-8-sig')
@@ -0,0 +1,171 @@
+#!/usr/bin/env python3
+"""
+CarbonMatch - Mass Normalization
+================================
+
+Derives one `mass_kg` per delivery row, shared by everything that needs a
+physical mass: transport (A4 = mass × distance × factor), the CO₂e intensity
+KPIs and the dashboard. Delivery quantities are in whatever unit the
+supplier used (Bündel, Eimer, Stück, m³), so `Menge` itself is never summed
+as kilograms.
+
+The first applicable source wins; `mass_source` records it as a code:
+
+    MASS_DELIVERY        delivered in a mass unit (kg, t)
+    MASS_CONVERTED       conversion path to a mass unit (area × thickness ×
+                         density, pieces, metres, mesh)
+    MASS_VOLUME_DENSITY  delivered m³ × bulk density (Rohdichte) of the matched entry
+    MASS_UNKNOWN         no mass derivable - `mass_kg` is NaN
+
+`Menge` counts as a mass only when the delivery unit is one: a matched entry
+with a kg / t (or m³) reference unit does not turn Stück, Bündel or metres
+into kilograms. Areas converted to m³ (PATH_AREA_TO_VOLUME) stay without a
+mass: that path is only taken when the matched entry has no density.
+MASS_REFERENCE (quantity taken as-is in a mass reference unit) is no longer
+assigned; the code stays reserved for older reports.
+
+The same mass is the quantity that kg-referenced GWP multiplies for A1-A3
+(reference_quantity()); m³-referenced GWP takes the delivered or converted
+volume, or the mass over the bulk density. Rows where neither can be derived
+get no A1-A3 instead of counting delivered pieces as kilograms.
+
+Units are resolved once per distinct value; the rest is array selection over
+the conversion columns (see carbomatch_conversion.CONVERSION_COLUMNS).
+"""
+
+from __future__ import annotations
+
+from typing import Tuple
+
+from carbomatch_lazy import lazy_import
+from carbomatch_conversion import (
+    PATH_AREA_TO_MASS, PATH_AREA_TO_VOLUME, PATH_LINEAR_TO_MASS, PATH_MESH_TO_MASS, PATH_PIECE_TO_MASS,
+    normalize_unit,
+)
+
+np = lazy_import("numpy")
+pd = lazy_import("pandas")
+
+# Mass source codes
+MASS_DELIVERY = 0
+MASS_CONVERTED = 1
+MASS_REFERENCE = 2
+MASS_VOLUME_DENSITY = 3
+MASS_UNKNOWN = 4
+
+MASS_SOURCE_LABELS = {
+    MASS_DELIVERY: 'delivery unit',
+    MASS_CONVERTED: 'converted',
+    MASS_REFERENCE: 'reference unit',
+    MASS_VOLUME_DENSITY: 'volume × density',
+    MASS_UNKNOWN: 'unknown',
+}
+
+MASS_COLUMNS = ['mass_kg', 'mass_source']
+
+# kg per unit of the mass units found in deliveries and reference units
+MASS_UNITS = {'kg': 1.0, 'g': 0.001, 't': 1000.0, 'to': 1000.0, 'tonne': 1000.0, 'tonnen': 1000.0}
+
+# Volume units (normalized)
+VOLUME_UNITS = ['m3', 'cbm']
+
+MASS_PATHS = [PATH_AREA_TO_MASS, PATH_PIECE_TO_MASS, PATH_LINEAR_TO_MASS, PATH_MESH_TO_MASS]
+
+
+def unit_classes(units: pd.Series) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Classify each row's unit label (once per distinct label)
+
+    Returns:
+        (kg per unit - NaN for non-mass units, is volume unit)
+    """
+    codes, uniques = pd.factorize(units.astype(object), use_na_sentinel=False)
+    normalized = [normalize_unit(u).rstrip('.').replace('\u00b2', '2') for u in uniques]
+    factors = np.array([MASS_UNITS.get(u, np.nan) for u in normalized], dtype=float)
+    volume = np.isin(np.array(normalized, dtype=object), VOLUME_UNITS)
+    return factors[codes], volume[codes]
+
+
+def derive_mass(frame: pd.DataFrame, conversions: pd.DataFrame) -> pd.DataFrame:
+    """
+    Mass in kg and its source for all rows at once
+
+    Args:
+        frame: Matched frame with `Menge` and `matched_rohdichte`; optionally
+               `Einheit` (the delivery unit)
+        conversions: Conversion columns aligned with frame (see
+                     carbomatch_conversion.convert_units)
+
+    Returns:
+        Frame aligned with frame.index holding MASS_COLUMNS (`mass_source`
+        as int8 code, see MASS_SOURCE_LABELS)
+    """
+    menge = pd.to_numeric(frame['Menge'], errors='coerce').to_numpy(dtype=float)
+    if 'Einheit' in frame.columns:
+        delivery_factor, delivery_volume = unit_classes(frame['Einheit'])
+    else:
+        delivery_factor = np.full(len(frame), np.nan)
+        delivery_volume = np.zeros(len(frame), dtype=bool)
+    converted = conversions['converted_quantity'].to_numpy(dtype=float)
+    path = conversions['conversion_path'].to_numpy()
+    converted_factor, _ = unit_classes(conversions['converted_unit'])
+    density = pd.to_numeric(frame['matched_rohdichte'], errors='coerce').to_numpy(dtype=float)
+    # Only conversion paths change the measure of the delivered quantity; an
+    # unconverted quantity keeps the delivery unit, whatever the reference unit
+    converted_valid = ~np.isnan(converted)
+
+    conditions = [
+        ~np.isnan(delivery_factor) & ~np.isnan(menge),
+        np.isin(path, MASS_PATHS) & ~np.isnan(converted_factor) & converted_valid,
+        delivery_volume & (density > 0) & ~np.isnan(menge),  # False for NaN density
+    ]
+    source = np.select(conditions, [MASS_DELIVERY, MASS_CONVERTED, MASS_VOLUME_DENSITY],
+                       default=MASS_UNKNOWN).astype(np.int8)
+    mass = np.select(conditions, [menge * delivery_factor, converted * converted_factor, menge * density],
+                     default=np.nan)
+    return pd.DataFrame({'mass_kg': mass, 'mass_source': source}, index=frame.index)
+
+
+def reference_quantity(frame: pd.DataFrame, conversions: pd.DataFrame, mass_kg: pd.Series) -> np.ndarray:
+    """
+    Quantity in the converted reference unit that the GWP multiplies
+
+    kg rows take the row mass; m³ rows take the volume converted from an area
+    or delivered in m³, else the mass over the bulk density. Rows of other
+    units keep `converted_quantity` (the CO₂e engine rejects their unit).
+
+    Args:
+        frame: Matched frame as for derive_mass()
+        conversions: Conversion columns aligned with frame
+        mass_kg: Row masses from derive_mass()
+
+    Returns:
+        Float array aligned with frame; NaN where the delivery unit gives no
+        mass (kg) or volume (m³)
+    """
+    menge = pd.to_numeric(frame['Menge'], errors='coerce').to_numpy(dtype=float)
+    if 'Einheit' in frame.columns:
+        _, delivery_volume = unit_classes(frame['Einheit'])
+    else:
+        delivery_volume = np.zeros(len(frame), dtype=bool)
+    converted = conversions['converted_quantity'].to_numpy(dtype=float)
+    path = conversions['conversion_path'].to_numpy()
+    density = pd.to_numeric(frame['matched_rohdichte'], errors='coerce').to_numpy(dtype=float)
+    mass = mass_kg.to_numpy(dtype=float)
+    unit = conversions['converted_unit'].astype(object).to_numpy()
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        volume = np.select(
+            [(path == PATH_AREA_TO_VOLUME) & ~np.isnan(converted), delivery_volume & ~np.isnan(menge),
+             (density > 0) & ~np.isnan(mass)],
+            [converted, menge, mass / density],
+            default=np.nan,
+        )
+    return np.select([unit == 'kg', unit == 'm3'], [mass, volume], default=converted)
+
+
+def mass_source_counts(mass_source: pd.Series) -> str:
+    """Row counts per mass source for log lines ('converted: 12, unknown: 3')"""
+    counts = pd.Series(mass_source).value_counts()
+    return ', '.join(f"{MASS_SOURCE_LABELS.get(int(code), code)}: {count}"
+                     for code, count in sorted(counts.items()) if count)
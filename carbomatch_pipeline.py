@@ -14,23 +14,59 @@ Author: CarbonMatch Team
 Date: October 23, 2025
 """
 
-import pandas as pd
-import numpy as np
+from __future__ import annotations
+
 import os
+import ast
+import argparse
+import zipfile
 from typing import Tuple, Dict, List, Optional
 import logging
 from datetime import datetime
-import warnings
-warnings.filterwarnings('ignore')
-
-# AI/ML Libraries
-try:
-    from openai import AzureOpenAI
-    from sklearn.metrics.pairwise import cosine_similarity
-    OPENAI_AVAILABLE = True
-except ImportError:
-    OPENAI_AVAILABLE = False
-    print("Warning: OpenAI or sklearn not available. Install with: pip install openai scikit-learn")
+
+# Heavy dependencies are loaded on first use, so importing this module and
+# short CLI commands (status, cache) stay fast
+from carbomatch_lazy import lazy_import, module_available
+
+pd = lazy_import("pandas")
+np = lazy_import("numpy")
+
+# AI/ML Libraries (openai is imported when the client is created)
+OPENAI_AVAILABLE = module_available("openai")
+
+from carbomatch_validation import (
+    REQUIRED_OEKOBAUDAT_COLUMNS,
+    check_required_columns,
+    summarize_rejects,
+    validate_deliveries,
+)
+from carbomatch_ledger import FINGERPRINT_COLUMN, DeliveryLedger, fingerprint_deliveries
+from carbomatch_dimensions import DIMENSION_COLUMNS, extract_dimension_columns
+from carbomatch_factors import FactorTables, affected_rows, load_factor_tables
+from carbomatch_conversion import CONVERSION_COLUMNS, CONVERSION_VERSION, convert_units, render_conversion_status
+from carbomatch_mass import MASS_COLUMNS, MASS_UNKNOWN, mass_source_counts
+from carbomatch_conversion_cache import CONVERSION_CACHE_FILE, ConversionCache, inspect_conversion_cache
+from carbomatch_transport import TRANSPORT_COLUMNS, TransportModel, load_transport_model
+from carbomatch_geo import OSRMRouter, RoutingService
+from carbomatch_report import (
+    PARTITION_COLUMNS, REPORT_COLUMNS, REPORT_PARQUET_FILE, SITE_COLUMN, ReportWriter, csv_compression,
+    read_report, strip_compression,
+)
+from carbomatch_rollup import RollupBuilder, rollups_path, write_rollups
+from carbomatch_summary import summarize, summary_path, write_summary
+from carbomatch_store import STORE_FILE, ReportStore
+from carbomatch_history import HISTORY_DIR, RunHistory
+from carbomatch_xlsx import ROLLUPS_SHEET
+from carbomatch_checkpoint import (
+    CHECKPOINT_DIR, STAGE_CALCULATED, STAGE_CATALOG, STAGE_DELIVERIES, STAGE_MATCHED, STAGE_REJECTS,
+    CheckpointStore, checkpoint_scope, file_digest, frame_digest, stage_key,
+)
+from carbomatch_uncertainty import (
+    UNCERTAINTY_FILE, UNCERTAINTY_SUMMARY_FILE, estimate_uncertainty, load_uncertainty_config,
+)
+from carbomatch_co2e import (
+    CALCULATION_COLUMNS, CALCULATION_VERSION, calculate_frame_co2e, render_calculation_status,
+)
 
 # Configuration - Azure OpenAI
 AZURE_ENDPOINT = "https://aoai-hackathon.openai.azure.com/"
@@ -40,27 +76,183 @@ AZURE_CHAT_MODEL = "o4-mini"
 SUBSCRIPTION_KEY = os.environ.get("OPENAI_API_KEY", "")  # Get from environment variable
 
 OUTPUT_FILE = "carbomatch_report.csv"
+REJECTS_FILE = "carbomatch_rejects.csv"
+LEDGER_FILE = "carbomatch_ledger.csv"
+EMBEDDING_CACHE_FILE = "carbomatch_embeddings.npz"
+MATCHED_STAGE_FILE = "carbomatch_matched.pkl"
+# DataFrame.attrs key of the transport settings saved with the matched stage
+MATCHED_STAGE_SETTINGS = "carbomatch_transport_settings"
 
-# Logging setup
-logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
 
+def configure_logging(level: int = logging.INFO) -> None:
+    """Logging setup for command line entry points (not done on import)"""
+    logging.basicConfig(level=level, format='%(asctime)s - %(levelname)s - %(message)s')
+
+
+# Ökobaudat fields carried into the matched data
+MATCH_FIELDS = {
+    'matched_uuid': 'UUID',
+    'matched_gwp': 'GWPtotal (A2)',
+    'matched_oeko_unit': 'Bezugseinheit',
+    'matched_rohdichte': 'Rohdichte (kg/m3)',
+    'matched_category': 'Kategorie (original)',
+}
+
+# Values used for deliveries without a match
+NO_MATCH_VALUES = {
+    'matched_material': 'NO_MATCH',
+    'similarity_score': 0.0,
+    'matched_uuid': 'NO_MATCH',
+    'matched_gwp': float('nan'),
+    'matched_oeko_unit': 'Unknown',
+    'matched_rohdichte': float('nan'),
+    'matched_category': 'Unknown',
+}
+
+
+class CatalogIndex:
+    """Embedding index over the unique Ökobaudat material names"""
+    
+    def __init__(self, texts: List[str], embeddings: np.ndarray, rows: pd.DataFrame):
+        """
+        Args:
+            texts: Unique material names, one per embedding row
+            embeddings: Embedding matrix (len(texts) × dimensions)
+            rows: First Ökobaudat row per material name, aligned with texts
+        """
+        self.texts = np.asarray(texts, dtype=object)
+        self.matrix = _normalize_rows(np.asarray(embeddings, dtype=np.float64))
+        self.rows = rows.reset_index(drop=True)
+    
+    def __len__(self) -> int:
+        return len(self.texts)
+    
+    def best_matches(self, embeddings: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Find the most similar catalog entry for each query embedding
+        
+        Args:
+            embeddings: Query matrix (n × dimensions)
+            
+        Returns:
+            Tuple of (best catalog position, cosine similarity) arrays of length n
+        """
+        similarities = _normalize_rows(np.asarray(embeddings, dtype=np.float64)) @ self.matrix.T
+        best = similarities.argmax(axis=1)
+        return best, similarities[np.arange(len(best)), best]
+    
+    def top_matches(self, embeddings: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Find the k most similar catalog entries for each query embedding
+        
+        Args:
+            embeddings: Query matrix (n × dimensions)
+            k: Number of candidates (capped at the catalog size)
+            
+        Returns:
+            Tuple of (catalog positions, cosine similarities), both n × k and
+            ordered by descending similarity
+        """
+        similarities = _normalize_rows(np.asarray(embeddings, dtype=np.float64)) @ self.matrix.T
+        k = min(k, similarities.shape[1])
+        top = np.argpartition(-similarities, k - 1, axis=1)[:, :k]
+        top_similarity = np.take_along_axis(similarities, top, axis=1)
+        order = np.argsort(-top_similarity, axis=1, kind='stable')
+        return np.take_along_axis(top, order, axis=1), np.take_along_axis(top_similarity, order, axis=1)
+
+
+def _normalize_rows(matrix: np.ndarray) -> np.ndarray:
+    """Scale rows to unit length (zero rows stay zero)"""
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    return matrix / np.where(norms == 0, 1.0, norms)
+
+
+def read_matched_stage(path: str = MATCHED_STAGE_FILE) -> pd.DataFrame:
+    """Matched frame saved by CarbonMatchPipeline.save_matched_stage()"""
+    frame = pd.read_pickle(path)
+    logger.info(f"Matched stage ({len(frame)} rows) loaded from {path}")
+    return frame
+
+
+def matched_stage_settings(frame: pd.DataFrame) -> Dict:
+    """
+    Site id and transport inputs a matched stage was calculated with
+    
+    Returns:
+        Dict with site, transport, distances, geocodes and routing_url (None
+        when not given; stages saved before these were recorded give {})
+    """
+    return dict(frame.attrs.get(MATCHED_STAGE_SETTINGS, {}))
+
+
 class CarbonMatchPipeline:
     """Main pipeline class for CarbonMatch CO₂ reporting"""
     
-    def __init__(self, api_key: str = ""):
-        """Initialize the pipeline with Azure OpenAI API key"""
+    def __init__(self, api_key: str = "", site_id: Optional[str] = None,
+                 shared: Optional['CarbonMatchPipeline'] = None, factors_path: Optional[str] = None,
+                 transport_path: Optional[str] = None, distances_path: Optional[str] = None,
+                 geocodes_path: Optional[str] = None, router: Optional[RoutingService] = None):
+        """
+        Initialize the pipeline with Azure OpenAI API key
+        
+        Args:
+            api_key: Azure OpenAI API key (defaults to OPENAI_API_KEY)
+            site_id: Construction site identifier for multi-site runs
+            shared: Pipeline whose Azure client, Ökobaudat catalog, catalog index,
+                    embedding cache, factor tables and transport model are reused instead of being loaded again
+            factors_path: Conversion factor tables (defaults to carbomatch_factors.json)
+            transport_path: Transport vehicles and defaults (defaults to carbomatch_transport.json)
+            distances_path: Supplier → site distance table (defaults to carbomatch_distances.csv, if present)
+            geocodes_path: Supplier / site coordinates (defaults to carbomatch_geocodes.csv, if present)
+            router: Routing service for geocoded pairs (geodesic distances when None)
+        """
         self.api_key = api_key or SUBSCRIPTION_KEY
+        self.site_id = site_id
         self.client = None
         self.deliveries_df = None
         self.oeko_df = None
+        self.catalog_index = None
         self.matched_df = None
+        self.rejects_df = None
+        self.rollups = None  # rollup tables of the last report (carbomatch_rollup)
+        self.summary = None  # project summary of the last report (carbomatch_summary)
+        self.source_file = None
+        self.catalog_file = None
         self.embedding_cache = {}
+        self.checkpoints = None
+        self.resume = False
+        self.stage_keys = {}
+        # Transport inputs as given (None: default file lookup), saved with the matched stage
+        self.transport_settings = {
+            'transport': os.path.abspath(transport_path) if transport_path else None,
+            'distances': os.path.abspath(distances_path) if distances_path else None,
+            'geocodes': os.path.abspath(geocodes_path) if geocodes_path else None,
+            'routing_url': getattr(router, 'url', None),
+        }
+        
+        if shared is not None:
+            self.api_key = shared.api_key
+            self.client = shared.client
+            self.oeko_df = shared.oeko_df
+            self.catalog_file = shared.catalog_file
+            self.catalog_index = shared.catalog_index
+            self.embedding_cache = shared.embedding_cache
+            self.factor_tables = shared.factor_tables
+            self.transport_model = shared.transport_model
+            self.transport_settings = shared.transport_settings
+            self.conversion_cache = shared.conversion_cache
+            return
+        
+        self.factor_tables = load_factor_tables(factors_path)
+        self.transport_model = load_transport_model(transport_path, distances_path, geocodes_path, router)
+        self.conversion_cache = ConversionCache()
         
         # Initialize Azure OpenAI client robustly
         if OPENAI_AVAILABLE and self.api_key:
             try:
+                from openai import AzureOpenAI
                 self.client = AzureOpenAI(
                     api_version=AZURE_API_VERSION,
                     azure_endpoint=AZURE_ENDPOINT,
@@ -79,32 +271,123 @@ class CarbonMatchPipeline:
     def load_and_clean_data(self, 
                            weight_path: str = "aggregated_construction_site_combined.xlsx",
                            quantity_path: Optional[str] = None, 
-                           oekobaudat_path: str = "oekobaudat.csv") -> None:
+                           oekobaudat_path: str = "oekobaudat.csv",
+                           rejects_path: Optional[str] = REJECTS_FILE) -> None:
         """
-        Step 1: Load and clean all input data files
+        Step 1: Load, validate and clean all input data files
+        
+        Delivery rows failing schema validation are written to a rejects
+        file with reason codes and excluded from all later steps.
         
         Args:
             weight_path: Path to combined delivery data (XLSX)
             quantity_path: Deprecated - kept for backward compatibility
             oekobaudat_path: Path to Ökobaudat database (CSV)
+            rejects_path: Path for the rejected delivery rows (CSV), None to skip writing
         """
         logger.info("=== STEP 1: DATA INGESTION AND CLEANING ===")
         
+        self.load_deliveries(weight_path, rejects_path)
+        self.load_catalog(oekobaudat_path)
+    
+    def enable_checkpoints(self, store: CheckpointStore, resume: bool = False) -> None:
+        """
+        Persist each stage's output frame, and optionally resume from it
+        
+        Args:
+            store: Checkpoint directory
+            resume: Load a stage from its checkpoint when one exists for the
+                    current inputs and configuration
+        """
+        self.checkpoints = store
+        self.resume = resume
+    
+    def save_route_cache(self) -> None:
+        """Persist routed supplier → site distances (when a routing service is used)"""
+        geo = self.transport_model.geo
+        if geo is not None and geo.router is not None:
+            geo.cache.save()
+    
+    def _resume_stage(self, stage: str) -> Optional[pd.DataFrame]:
+        """Checkpointed output of a stage for its current key (None when not resuming)"""
+        if self.checkpoints is None or not self.resume:
+            return None
+        return self.checkpoints.load(stage, self.stage_keys[stage], self._checkpoint_scope())
+    
+    def _checkpoint_stage(self, stage: str, frame: pd.DataFrame) -> None:
+        """Persist a stage's output frame when checkpoints are enabled"""
+        if self.checkpoints is not None:
+            self.checkpoints.save(stage, self.stage_keys[stage], frame, self._checkpoint_scope())
+    
+    def _checkpoint_scope(self) -> str:
+        """Checkpoints of a site and delivery file are pruned apart from other runs'"""
+        return checkpoint_scope(self.site_id, os.path.abspath(self.source_file) if self.source_file else None)
+    
+    def load_deliveries(self, weight_path: str, rejects_path: Optional[str] = REJECTS_FILE) -> None:
+        """
+        Step 1a: Load and validate delivery data
+        
+        Args:
+            weight_path: Path to combined delivery data (XLSX)
+            rejects_path: Path for the rejected delivery rows (CSV), None to skip writing
+        """
+        self.source_file = weight_path
+        if self.checkpoints is not None:
+            key = stage_key(STAGE_DELIVERIES, os.path.basename(weight_path), file_digest(weight_path))
+            self.stage_keys[STAGE_DELIVERIES] = self.stage_keys[STAGE_REJECTS] = key
+            deliveries, rejects = self._resume_stage(STAGE_DELIVERIES), self._resume_stage(STAGE_REJECTS)
+            if deliveries is not None and rejects is not None:
+                self.deliveries_df, self.rejects_df = deliveries, rejects
+                if rejects_path:
+                    self.rejects_df.to_csv(rejects_path, sep=';', index=False, encoding='utf-8-sig')
+                return
+        
         # Load delivery files
         try:
             # Load combined delivery file
-            self.deliveries_df = pd.read_excel(weight_path)
+            raw_deliveries = pd.read_excel(weight_path)
             
-            logger.info(f"Loaded delivery data: {len(self.deliveries_df)} total records")
+            logger.info(f"Loaded delivery data: {len(raw_deliveries)} total records")
             
         except Exception as e:
             logger.error(f"Error loading delivery files: {e}")
             raise
         
+        # Validate deliveries - types, ranges, required fields, unit vocabulary
+        self.deliveries_df, self.rejects_df = validate_deliveries(raw_deliveries)
+        if len(self.rejects_df) > 0:
+            logger.warning(f"Rejected {len(self.rejects_df)} delivery rows: {summarize_rejects(self.rejects_df)}")
+        if rejects_path:
+            self.rejects_df.to_csv(rejects_path, sep=';', index=False, encoding='utf-8-sig')
+            logger.info(f"Rejected rows written to {rejects_path}")
+        logger.info(f"Validated delivery data: {len(self.deliveries_df)} clean records")
+        
+        # Fingerprint rows so incremental runs can skip already processed deliveries
+        self.deliveries_df[FINGERPRINT_COLUMN] = fingerprint_deliveries(self.deliveries_df, weight_path)
+        self._checkpoint_stage(STAGE_DELIVERIES, self.deliveries_df)
+        self._checkpoint_stage(STAGE_REJECTS, self.rejects_df)
+    
+    def load_catalog(self, oekobaudat_path: str) -> None:
+        """
+        Step 1b: Load and clean the Ökobaudat database (A1-A3 modules)
+        
+        Args:
+            oekobaudat_path: Path to Ökobaudat database (CSV)
+        """
+        self.catalog_index = None
+        self.catalog_file = oekobaudat_path
+        if self.checkpoints is not None:
+            self.stage_keys[STAGE_CATALOG] = stage_key(STAGE_CATALOG, file_digest(oekobaudat_path))
+            resumed = self._resume_stage(STAGE_CATALOG)
+            if resumed is not None:
+                self.oeko_df = resumed
+                return
+        
         # Load and clean Ökobaudat database
         try:
             # Use latin-1 encoding based on our testing
             oeko_raw = pd.read_csv(oekobaudat_path, delimiter=';', encoding='latin-1', low_memory=False)
+            check_required_columns(oeko_raw, REQUIRED_OEKOBAUDAT_COLUMNS, "Ökobaudat data")
             
             # Filter for A1-A3 modules only
             self.oeko_df = oeko_raw[oeko_raw['Modul'] == 'A1-A3'].copy()
@@ -121,16 +404,87 @@ class CarbonMatchPipeline:
                                        .replace(['nan', 'None', ''], np.nan))
                     self.oeko_df[col] = pd.to_numeric(self.oeko_df[col], errors='coerce')
             
-            # Handle missing values for critical columns
+            # Handle missing values for critical columns (missing GWP stays NaN so the column remains typed)
             self.oeko_df['Name (de)'] = self.oeko_df['Name (de)'].fillna('MISSING')
-            self.oeko_df['GWPtotal (A2)'] = self.oeko_df['GWPtotal (A2)'].fillna('MISSING')
             
             logger.info("Data cleaning completed successfully")
+            self._checkpoint_stage(STAGE_CATALOG, self.oeko_df)
             
         except Exception as e:
             logger.error(f"Error loading Ökobaudat file: {e}")
             raise
     
+    def save_matched_stage(self, path: str = MATCHED_STAGE_FILE) -> None:
+        """
+        Persist the calculated matched frame (input of carbomatch_scenarios)
+        
+        The site id and transport inputs are stored with the frame
+        (matched_stage_settings()), so scenarios resolve the same distances;
+        saved after simulate_transport_co2e(), the frame also holds the
+        report's A4 and total CO₂e for checking the scenario baseline.
+        
+        Args:
+            path: Pickle path of the matched stage
+        """
+        if self.matched_df is None or 'calculation_code' not in self.matched_df.columns:
+            raise ValueError("No calculated data available. Run calculate_all_co2e() first.")
+        stage = self.matched_df.copy(deep=False)
+        stage.attrs = {MATCHED_STAGE_SETTINGS: {'site': self.site_id, **self.transport_settings}}
+        stage.to_pickle(path)
+        logger.info(f"Matched stage ({len(self.matched_df)} rows) saved to {path}")
+    
+    def load_matched_stage(self, path: str = MATCHED_STAGE_FILE) -> None:
+        """Restore a matched frame saved by save_matched_stage()"""
+        self.matched_df = read_matched_stage(path)
+    
+    def select_unprocessed_deliveries(self, ledger: DeliveryLedger) -> int:
+        """
+        Restrict deliveries to rows the ledger has not seen yet (incremental mode)
+        
+        Args:
+            ledger: Ledger of previously processed delivery fingerprints
+            
+        Returns:
+            Number of unseen delivery rows kept for processing
+        """
+        if self.deliveries_df is None:
+            raise ValueError("No delivery data available. Run load_and_clean_data() first.")
+        
+        unseen = ledger.unseen_mask(self.deliveries_df[FINGERPRINT_COLUMN])
+        logger.info(f"Incremental mode: {unseen.sum()} new of {len(self.deliveries_df)} delivery rows "
+                    f"({len(ledger)} already in ledger)")
+        self.deliveries_df = self.deliveries_df[unseen].reset_index(drop=True)
+        return int(unseen.sum())
+    
+    def load_embedding_cache(self, path: str = EMBEDDING_CACHE_FILE) -> None:
+        """
+        Load persisted Azure OpenAI embeddings into the in-memory cache
+        
+        Mock embeddings are never persisted, so this is a no-op without a client.
+        """
+        if not self.client or not os.path.exists(path):
+            return
+        
+        with np.load(path, allow_pickle=False) as data:
+            if str(data['model']) != AZURE_EMBEDDING_MODEL:
+                logger.warning(f"Ignoring embedding cache {path}: built with model {data['model']}")
+                return
+            for text, vector in zip(data['texts'], data['vectors']):
+                self.embedding_cache.setdefault(str(text), vector.tolist())
+        logger.info(f"Loaded {len(self.embedding_cache)} cached embeddings from {path}")
+    
+    def save_embedding_cache(self, path: str = EMBEDDING_CACHE_FILE) -> None:
+        """Persist the in-memory Azure OpenAI embeddings for later runs"""
+        if not self.client or not self.embedding_cache:
+            return
+        
+        texts = list(self.embedding_cache.keys())
+        np.savez(path,
+                 model=np.array(AZURE_EMBEDDING_MODEL),
+                 texts=np.array(texts, dtype=str),
+                 vectors=np.array([self.embedding_cache[t] for t in texts], dtype=np.float32))
+        logger.info(f"Saved {len(texts)} embeddings to {path}")
+    
     def get_embedding(self, text: str) -> Optional[List[float]]:
         """
         Step 2a: Generate vector embedding for given text using Azure OpenAI
@@ -160,8 +514,9 @@ class CarbonMatchPipeline:
                 return embedding
 
             # Mock embedding for demo/testing when API not available or fails
-            np.random.seed(abs(hash(str(text))) % (2**32))
-            mock_embedding = np.random.normal(0, 1, 1536).tolist()  # ada-002 has 1536 dimensions
+            # (private RandomState so concurrent site runs do not race on the global seed)
+            rng = np.random.RandomState(abs(hash(str(text))) % (2**32))
+            mock_embedding = rng.normal(0, 1, 1536).tolist()  # ada-002 has 1536 dimensions
             self.embedding_cache[text] = mock_embedding
             return mock_embedding
 
@@ -169,13 +524,17 @@ class CarbonMatchPipeline:
             logger.error(f"Error generating embedding for '{text}': {e}")
             return None
     
-    def generate_embeddings_and_match(self) -> None:
+    def build_catalog_index(self) -> CatalogIndex:
         """
-        Step 2: Generate embeddings and perform semantic matching
+        Step 2a: Embed the unique Ökobaudat materials into a reusable index
+        
+        Returns:
+            The catalog index (also stored on the pipeline and shared with
+            pipelines created with `shared=self`)
         """
-        logger.info("=== STEP 2: EMBEDDING GENERATION AND MATCHING ===")
+        if self.oeko_df is None:
+            raise ValueError("No Ökobaudat data available. Run load_catalog() first.")
         
-        # Generate embeddings for unique Ökobaudat entries
         logger.info("Generating embeddings for Ökobaudat database...")
         unique_oeko_materials = self.oeko_df['Name (de)'].unique()
         
@@ -191,308 +550,382 @@ class CarbonMatchPipeline:
                 oeko_embeddings.append(embedding)
                 oeko_texts.append(material)
         
-        oeko_embeddings = np.array(oeko_embeddings)
-        logger.info(f"Generated {len(oeko_embeddings)} Ökobaudat embeddings")
+        # First catalog row per material name, in index order
+        first_rows = self.oeko_df.drop_duplicates('Name (de)').set_index('Name (de)')
+        self.catalog_index = CatalogIndex(oeko_texts, np.array(oeko_embeddings).reshape(len(oeko_texts), -1),
+                                          first_rows.loc[oeko_texts].reset_index())
+        logger.info(f"Generated {len(self.catalog_index)} Ökobaudat embeddings")
+        return self.catalog_index
+    
+    def generate_embeddings_and_match(self) -> None:
+        """
+        Step 2: Generate embeddings and perform semantic matching
+        
+        Each distinct Artikel text is embedded and matched once; the
+        catalog index is built on first use and reused afterwards.
+        """
+        logger.info("=== STEP 2: EMBEDDING GENERATION AND MATCHING ===")
+        
+        if self.checkpoints is not None:
+            # Mock embeddings do not match like the model's, so they get their own key
+            embedding_source = AZURE_EMBEDDING_MODEL if self.client else 'mock'
+            self.stage_keys[STAGE_MATCHED] = stage_key(
+                STAGE_MATCHED, frame_digest(self.deliveries_df),
+                self.stage_keys.get(STAGE_CATALOG) or frame_digest(self.oeko_df), embedding_source)
+            resumed = self._resume_stage(STAGE_MATCHED)
+            if resumed is not None:
+                self.matched_df = resumed
+                return
         
-        # Generate embeddings for delivery items and find matches
+        if self.catalog_index is None:
+            self.build_catalog_index()
+        index = self.catalog_index
+        
+        # Generate embeddings for distinct delivery items and find matches
         logger.info("Matching delivery items to Ökobaudat database...")
-        matches = []
+        codes, unique_artikel = pd.factorize(self.deliveries_df['Artikel'])
         
-        # Ensure Artikel and Menge columns exist and are strings/numbers
-        self.deliveries_df['Artikel'] = self.deliveries_df['Artikel'].astype(str)
-        # Normalize Menge to numeric
-        def parse_menge(x):
-            try:
-                if pd.isna(x):
-                    return 0.0
-                s = str(x).replace(',', '.').strip()
-                return float(s)
-            except Exception:
-                return 0.0
-        self.deliveries_df['Menge'] = self.deliveries_df['Menge'].apply(parse_menge)
-
-        for i, artikel in enumerate(self.deliveries_df['Artikel']):
+        embeddings = []
+        embedded = np.zeros(len(unique_artikel), dtype=bool)
+        for i, artikel in enumerate(unique_artikel):
             if i % 50 == 0:
-                logger.info(f"Processing delivery item {i+1}/{len(self.deliveries_df)}")
+                logger.info(f"Processing delivery item {i+1}/{len(unique_artikel)}")
             
             delivery_embedding = self.get_embedding(artikel)
-            
-            if delivery_embedding is not None and len(oeko_embeddings) > 0:
-                # Calculate cosine similarity
-                similarities = cosine_similarity([delivery_embedding], oeko_embeddings)[0]
-                best_match_idx = np.argmax(similarities)
-                best_match_similarity = similarities[best_match_idx]
-                best_match_material = oeko_texts[best_match_idx]
-                
-                # Get the corresponding Ökobaudat row
-                matched_oeko_row = self.oeko_df[self.oeko_df['Name (de)'] == best_match_material].iloc[0]
-                
-                matches.append({
-                    'delivery_index': i,
-                    'matched_material': best_match_material,
-                    'similarity_score': best_match_similarity,
-                    'matched_uuid': matched_oeko_row['UUID'],
-                    'matched_gwp': matched_oeko_row['GWPtotal (A2)'],
-                    'matched_oeko_unit': matched_oeko_row['Bezugseinheit'],
-                    'matched_rohdichte': matched_oeko_row['Rohdichte (kg/m3)'],
-                    'matched_category': matched_oeko_row.get('Kategorie (original)', 'Unknown')
-                })
-            else:
-                # No match found
-                matches.append({
-                    'delivery_index': i,
-                    'matched_material': 'NO_MATCH',
-                    'similarity_score': 0.0,
-                    'matched_uuid': 'NO_MATCH',
-                    'matched_gwp': 'MISSING',
-                    'matched_oeko_unit': 'Unknown',
-                    'matched_rohdichte': np.nan,
-                    'matched_category': 'Unknown'
-                })
+            if delivery_embedding is not None:
+                embeddings.append(delivery_embedding)
+                embedded[i] = True
+        
+        # Match values per distinct Artikel, NO_MATCH where embedding or catalog is missing
+        unique_matches = pd.DataFrame({col: [value] * len(unique_artikel) for col, value in NO_MATCH_VALUES.items()})
+        if embeddings and len(index) > 0:
+            best, similarity = index.best_matches(np.array(embeddings))
+            matched = index.rows.iloc[best]
+            positions = np.flatnonzero(embedded)
+            unique_matches.loc[positions, 'matched_material'] = index.texts[best]
+            unique_matches.loc[positions, 'similarity_score'] = similarity
+            for col, source_col in MATCH_FIELDS.items():
+                if source_col in matched.columns:
+                    unique_matches.loc[positions, col] = matched[source_col].to_numpy()
         
         # Create matched dataframe
-        matches_df = pd.DataFrame(matches)
+        matches_df = unique_matches.iloc[codes].reset_index(drop=True)
         self.matched_df = pd.concat([
             self.deliveries_df.reset_index(drop=True),
-            matches_df.drop('delivery_index', axis=1)
+            matches_df
         ], axis=1)
         
         logger.info(f"Matching completed. Average similarity score: {matches_df['similarity_score'].mean():.3f}")
+        self._checkpoint_stage(STAGE_MATCHED, self.matched_df)
+    
+    def match_candidates(self, top_k: int) -> pd.DataFrame:
+        """
+        Alternative Ökobaudat matches per distinct Artikel
+        
+        Args:
+            top_k: Candidates per Artikel including the reported match
+            
+        Returns:
+            Long frame (Artikel, candidate_rank 1..top_k-1, matched_material,
+            similarity_score, matched_* fields); rank 0 is the reported match
+        """
+        if self.matched_df is None:
+            raise ValueError("No matched data available. Run generate_embeddings_and_match() first.")
+        columns = ['Artikel', 'candidate_rank', 'matched_material', 'similarity_score', *MATCH_FIELDS]
+        if self.catalog_index is None and self.oeko_df is not None:
+            self.build_catalog_index()  # matching was resumed from a checkpoint
+        index = self.catalog_index
+        unique_artikel = pd.unique(self.matched_df['Artikel'])
+        embedded, embeddings = [], []
+        for artikel in unique_artikel:
+            embedding = self.get_embedding(artikel)
+            if embedding is not None:
+                embedded.append(artikel)
+                embeddings.append(embedding)
+        if top_k < 2 or not embeddings or index is None or len(index) < 2:
+            return pd.DataFrame(columns=columns)
+        
+        top, similarity = index.top_matches(np.array(embeddings), top_k)
+        ranks = np.arange(1, top.shape[1])
+        positions = top[:, 1:].ravel()
+        candidates = pd.DataFrame({
+            'Artikel': np.repeat(np.array(embedded, dtype=object), len(ranks)),
+            'candidate_rank': np.tile(ranks, len(embedded)),
+            'matched_material': index.texts[positions],
+            'similarity_score': similarity[:, 1:].ravel(),
+        })
+        matched = index.rows.iloc[positions]
+        for col, source_col in MATCH_FIELDS.items():
+            candidates[col] = matched[source_col].to_numpy() if source_col in matched.columns else NO_MATCH_VALUES[col]
+        return candidates[columns]
+    
+    def estimate_uncertainty(self, samples: int, config_path: Optional[str] = None, seed: int = 0,
+                             output_path: str = UNCERTAINTY_FILE,
+                             summary_path: str = UNCERTAINTY_SUMMARY_FILE) -> pd.DataFrame:
+        """
+        Monte Carlo ranges (P5/P50/P95) of material CO₂e per row, supplier and project
+        
+        Samples conversion factors, GWP values and alternative top-k matches
+        (see carbomatch_uncertainty) and exports the row percentiles and the
+        supplier / project summary.
+        
+        Args:
+            samples: Number of Monte Carlo draws
+            config_path: Optional JSON overriding DEFAULT_UNCERTAINTY
+            seed: Random seed
+            output_path: Row percentiles CSV
+            summary_path: Supplier / project summary CSV
+            
+        Returns:
+            Summary frame
+        """
+        logger.info(f"=== UNCERTAINTY: {samples:,} MONTE CARLO DRAWS ===")
+        if self.matched_df is None or 'calculation_code' not in self.matched_df.columns:
+            raise ValueError("No calculated data available. Run calculate_all_co2e() first.")
+        
+        config = load_uncertainty_config(config_path)
+        candidates = self.match_candidates(int(config['matching']['top_k']))
+        rows, summary = estimate_uncertainty(self.matched_df, candidates, self.factor_tables, samples, config,
+                                             seed=seed, cache=self.conversion_cache)
+        
+        row_df = pd.concat([self.matched_df[['Lieferant', 'Artikel', 'calculated_co2e_a1_a3', FINGERPRINT_COLUMN]],
+                            rows], axis=1)
+        row_df.round(4).to_csv(output_path, sep=';', index=False, encoding='utf-8-sig')
+        summary.round(4).to_csv(summary_path, sep=';', index=False, encoding='utf-8-sig')
+        
+        project = summary.iloc[0]
+        logger.info(f"  Material CO₂e (A1-A3): {project['calculated_co2e_a1_a3']:,.2f} kg CO₂e "
+                    f"(P5 {project['co2e_a1_a3_p5']:,.2f} | P50 {project['co2e_a1_a3_p50']:,.2f} "
+                    f"| P95 {project['co2e_a1_a3_p95']:,.2f})")
+        logger.info(f"Uncertainty exported to {output_path} and {summary_path}")
+        return summary
     
     def convert_unsupported_units(self, row: pd.Series) -> Tuple[float, str, str]:
         """
         Convert unsupported units to supported kg or m3 using material-specific factors
         
+        Single-row convenience wrapper around the vectorized rule engine in
+        carbomatch_conversion; use convert_units() for whole frames.
+        
         Args:
             row: DataFrame row with delivery and matched data
             
         Returns:
             Tuple of (converted_quantity, converted_unit, conversion_status)
         """
-        try:
-            menge = float(row.get('Menge', 0) if not pd.isna(row.get('Menge', None)) else 0.0)
-            unit = str(row.get('matched_oeko_unit', '')).strip()
-            artikel = str(row.get('Artikel', '')).lower()
-            matched_material = str(row.get('matched_material', '')).lower()
-            rohdichte = row.get('matched_rohdichte', np.nan)
-            
-            # Normalize unit
-            unit_norm = unit.lower().replace('^', '').replace('\u00b3', '3').replace('³', '3').strip()
-            
-            # Already supported units - no conversion needed
-            if unit_norm in ['kg', 'm3']:
-                return menge, unit_norm, "No conversion needed"
-            
-            # Unit conversion logic based on material type and unit
-            if unit_norm in ['qm', 'm2']:
-                # Area-based conversion to volume (m3) then to mass (kg)
-                # Use material-specific thickness assumptions
-                thickness_m = 0.01  # Default 1cm thickness
-                
-                # Material-specific thickness assumptions
-                if any(x in artikel for x in ['beton', 'concrete', 'estrich']):
-                    thickness_m = 0.15  # 15cm for concrete slabs
-                elif any(x in artikel for x in ['dach', 'roof', 'membrane', 'folie']):
-                    thickness_m = 0.005  # 5mm for membranes/roofing
-                elif any(x in artikel for x in ['wand', 'wall', 'mauer']):
-                    thickness_m = 0.20  # 20cm for walls
-                elif any(x in artikel for x in ['dämmung', 'insulation', 'isolierung']):
-                    thickness_m = 0.10  # 10cm for insulation
-                elif any(x in artikel for x in ['blech', 'sheet', 'platte']):
-                    thickness_m = 0.002  # 2mm for metal sheets
-                
-                volume_m3 = menge * thickness_m
-                
-                # Convert to kg if density available
-                if not pd.isna(rohdichte) and rohdichte > 0:
-                    mass_kg = volume_m3 * float(rohdichte)
-                    return mass_kg, 'kg', f"Converted: {menge} m² × {thickness_m}m × {rohdichte} kg/m³ = {mass_kg:.2f} kg"
-                else:
-                    return volume_m3, 'm3', f"Converted: {menge} m² × {thickness_m}m = {volume_m3:.3f} m³"
-            
-            elif unit_norm in ['pcs.', 'pcs', 'stk', 'st', 'stück']:
-                # Piece-based conversion to mass (kg)
-                # Use material-specific weight per piece
-                weight_per_piece_kg = 1.0  # Default 1kg per piece
-                
-                # Material-specific weight assumptions
-                if any(x in artikel for x in ['schraube', 'screw', 'bolt', 'mutter']):
-                    weight_per_piece_kg = 0.01  # 10g for small fasteners
-                elif any(x in artikel for x in ['nagel', 'nail']):
-                    weight_per_piece_kg = 0.005  # 5g for nails
-                elif any(x in artikel for x in ['ziegel', 'brick', 'stein']):
-                    weight_per_piece_kg = 2.5  # 2.5kg for bricks
-                elif any(x in artikel for x in ['balken', 'beam', 'träger']):
-                    weight_per_piece_kg = 50.0  # 50kg for beams
-                elif any(x in artikel for x in ['platte', 'panel', 'board']):
-                    weight_per_piece_kg = 25.0  # 25kg for panels
-                elif any(x in artikel for x in ['rohr', 'pipe', 'tube']):
-                    weight_per_piece_kg = 10.0  # 10kg for pipes
-                elif any(x in artikel for x in ['fenster', 'window', 'tür', 'door']):
-                    weight_per_piece_kg = 30.0  # 30kg for windows/doors
-                elif any(x in artikel for x in ['dachziegel', 'tile']):
-                    weight_per_piece_kg = 3.0  # 3kg for roof tiles
-                
-                # Check if matched material gives us better weight estimate
-                if any(x in matched_material for x in ['stahl', 'steel', 'eisen']):
-                    weight_per_piece_kg *= 7.85  # Steel density factor
-                elif any(x in matched_material for x in ['holz', 'wood', 'timber']):
-                    weight_per_piece_kg *= 0.6   # Wood density factor
-                elif any(x in matched_material for x in ['aluminium', 'aluminum']):
-                    weight_per_piece_kg *= 2.7   # Aluminum density factor
-                
-                mass_kg = menge * weight_per_piece_kg
-                return mass_kg, 'kg', f"Converted: {menge} pcs × {weight_per_piece_kg:.3f} kg/pc = {mass_kg:.2f} kg"
-            
-            elif unit_norm == 'm':
-                # Linear meter conversion to mass (kg)
-                # Use material-specific weight per meter
-                weight_per_meter_kg = 1.0  # Default 1kg per meter
-                
-                # Material-specific linear weight assumptions
-                if any(x in artikel for x in ['stahl', 'steel', 'eisen', 'bewehrung', 'betonstahl']):
-                    # Steel reinforcement - estimate from diameter
-                    if '8' in artikel:
-                        weight_per_meter_kg = 0.395  # 8mm rebar
-                    elif '10' in artikel:
-                        weight_per_meter_kg = 0.617  # 10mm rebar
-                    elif '12' in artikel:
-                        weight_per_meter_kg = 0.888  # 12mm rebar
-                    elif '14' in artikel:
-                        weight_per_meter_kg = 1.208  # 14mm rebar
-                    elif '16' in artikel:
-                        weight_per_meter_kg = 1.578  # 16mm rebar
-                    elif '20' in artikel:
-                        weight_per_meter_kg = 2.466  # 20mm rebar
-                    elif '25' in artikel:
-                        weight_per_meter_kg = 3.853  # 25mm rebar
-                    else:
-                        weight_per_meter_kg = 1.5  # Default for steel
-                
-                elif any(x in artikel for x in ['rohr', 'pipe', 'tube']):
-                    weight_per_meter_kg = 5.0  # 5kg/m for pipes
-                elif any(x in artikel for x in ['kabel', 'cable', 'leitung']):
-                    weight_per_meter_kg = 0.5  # 0.5kg/m for cables
-                elif any(x in artikel for x in ['holz', 'wood', 'balken']):
-                    weight_per_meter_kg = 15.0  # 15kg/m for wooden beams
-                elif any(x in artikel for x in ['profil', 'profile']):
-                    weight_per_meter_kg = 8.0  # 8kg/m for profiles
-                
-                mass_kg = menge * weight_per_meter_kg
-                return mass_kg, 'kg', f"Converted: {menge} m × {weight_per_meter_kg:.3f} kg/m = {mass_kg:.2f} kg"
-            
-            else:
-                # Unknown unit - return original
-                return menge, unit_norm, f"Unknown unit '{unit}' - no conversion available"
-                
-        except Exception as e:
-            return 0.0, unit, f"Conversion error: {str(e)}"
-
+        frame = row.to_frame().T
+        conversion = convert_units(frame, self.factor_tables)
+        status = render_conversion_status(frame['Menge'], frame['matched_oeko_unit'], conversion)
+        return (float(conversion['converted_quantity'].iloc[0]),
+                conversion['converted_unit'].iloc[0],
+                status.iloc[0])
+    
     def calculate_material_co2e(self, row: pd.Series) -> Tuple[float, str]:
         """
         Step 3: Calculate material CO₂e for a single row with unit conversion
         
+        Single-row convenience wrapper around the columnar engine in
+        carbomatch_co2e; calculate_all_co2e() handles whole frames.
+        
         Args:
             row: DataFrame row with matched data
             
         Returns:
             Tuple of (co2e_value, calculation_status)
         """
-        try:
-            # Handle missing GWP first
-            gwp = row['matched_gwp']
-            if gwp == 'MISSING' or pd.isna(gwp):
-                return 0.0, "Error: GWP missing"
-
-            try:
-                gwp = float(str(gwp).replace(',', '.'))
-            except Exception:
-                return 0.0, "Error: Invalid GWP value"
-
-            # Try unit conversion for unsupported units
-            converted_menge, converted_unit, conversion_status = self.convert_unsupported_units(row)
-            
-            if converted_menge <= 0:
-                return 0.0, f"Error: Invalid quantity after conversion"
-            
-            rohdichte = row.get('matched_rohdichte', np.nan)
-
-            # Calculate CO2e based on converted unit
-            if converted_unit == 'kg':
-                # Direct calculation: Converted Menge (kg) * GWP
-                co2e = converted_menge * gwp
-                if "Converted:" in conversion_status:
-                    status = f"Success: {conversion_status}"
-                else:
-                    status = "Success: kg unit"
-
-            elif converted_unit == 'm3':
-                # For m3 units, we can calculate directly
-                co2e = converted_menge * gwp
-                if "Converted:" in conversion_status:
-                    status = f"Success: {conversion_status}"
-                else:
-                    status = "Success: m³ unit"
-
-            else:
-                # Still unsupported after conversion attempt
-                return 0.0, f"Error: Unit '{converted_unit}' not supported - {conversion_status}"
-            
-            return max(0.0, co2e), status
-            
-        except Exception as e:
-            return 0.0, f"Error: Calculation failed - {str(e)}"
+        frame = row.to_frame().T.infer_objects()
+        conversion = convert_units(frame, self.factor_tables)
+        result = calculate_frame_co2e(frame, conversion)
+        status = render_calculation_status(frame['Menge'], frame['matched_oeko_unit'],
+                                           pd.concat([conversion, result], axis=1), result['calculation_code'])
+        return float(result['calculated_co2e_a1_a3'].iloc[0]), status.iloc[0]
     
     def calculate_all_co2e(self) -> None:
         """
         Step 3: Calculate CO₂e for all materials
+        
+        Stores the extracted article dimensions, the conversion columns
+        (including the rule that supplied each factor; memoized per distinct
+        conversion key in self.conversion_cache), the typed `gwp_factor`, an integer `calculation_code`,
+        `calculated_co2e_a1_a3`, the row mass `mass_kg` with its `mass_source`
+        (carbomatch_mass) and the factor table version; the status text
+        is rendered on demand by calculation_status(). With checkpoints the
+        result is resumed when matches and factor tables are unchanged.
         """
         logger.info("=== STEP 3: CO₂E CALCULATION (MATERIAL A1-A3) ===")
         
         if self.matched_df is None:
             raise ValueError("No matched data available. Run generate_embeddings_and_match() first.")
         
-        # Apply CO₂e calculation to all rows
-        co2e_results = self.matched_df.apply(self.calculate_material_co2e, axis=1, result_type='expand')
+        resumed = None
+        if self.checkpoints is not None:
+            self.stage_keys[STAGE_CALCULATED] = stage_key(
+                STAGE_CALCULATED, self.stage_keys.get(STAGE_MATCHED) or frame_digest(self.matched_df),
+                self.factor_tables.version_label, CONVERSION_VERSION, CALCULATION_VERSION)
+            resumed = self._resume_stage(STAGE_CALCULATED)
         
-        self.matched_df['calculated_co2e_a1_a3'] = co2e_results[0]
-        self.matched_df['calculation_status'] = co2e_results[1]
+        if resumed is not None:
+            self.matched_df = resumed
+        else:
+            # Typed dimensions from the article texts (one regex pass per distinct text)
+            dimensions = extract_dimension_columns(self.matched_df['Artikel'])
+            for col in DIMENSION_COLUMNS:
+                self.matched_df[col] = dimensions[col]
+            
+            # Convert all rows to kg / m³, derive the row mass, then multiply by GWP - all columnar
+            conversions = convert_units(self.matched_df, self.factor_tables, cache=self.conversion_cache)
+            results = calculate_frame_co2e(self.matched_df, conversions)
+            for col in CONVERSION_COLUMNS:
+                self.matched_df[col] = conversions[col]
+            for col in CALCULATION_COLUMNS + MASS_COLUMNS:
+                self.matched_df[col] = results[col]
+            self.matched_df['factor_table_version'] = self.factor_tables.version_label
+            self._checkpoint_stage(STAGE_CALCULATED, self.matched_df)
+        logger.info(f"Conversion factor tables: {self.factor_tables.version_label} ({self.factor_tables.source})")
         
-        # Calculate summary statistics
-        total_co2e = self.matched_df['calculated_co2e_a1_a3'].sum()
-        total_weight = self.matched_df['Menge'].sum()
-        successful_calcs = len(self.matched_df[self.matched_df['calculation_status'].str.contains('Success', na=False)])
+        # Summary statistics - the project rollup the report summary uses
+        totals = RollupBuilder(dimensions={'project': None}, top_rows=0)
+        totals.add(self.matched_df)
+        summary = summarize(totals.result())
         
         logger.info(f"CO₂e calculation completed:")
-        logger.info(f"  Total CO₂e (A1-A3): {total_co2e:,.2f} kg CO₂e")
-        logger.info(f"  Total material weight: {total_weight:,.2f} kg")
-        logger.info(f"  CO₂e intensity: {total_co2e/total_weight:.4f} kg CO₂e/kg material")
-        logger.info(f"  Successful calculations: {successful_calcs}/{len(self.matched_df)} ({successful_calcs/len(self.matched_df)*100:.1f}%)")
+        logger.info(f"  Total CO₂e (A1-A3): {summary['material_co2e']:,.2f} kg CO₂e")
+        logger.info(f"  Total material weight: {summary['total_mass_kg']:,.2f} kg ({mass_source_counts(self.matched_df['mass_source'])})")
+        logger.info(f"  Successful calculations: {summary['successful_items']}/{summary['total_items']} ({summary['success_rate']:.1f}%)")
     
-    def simulate_transport_co2e(self) -> None:
+    def apply_factor_tables(self, tables: FactorTables) -> int:
         """
-        Step 4: Simulate transport CO₂e (A4 module)
+        Switch to another factor table version, recalculating only affected rows
+        
+        Rows are affected when the rule recorded in `conversion_rule` or
+        `material_rule` changed its factor (or its table changed keywords).
+        When step 4 has run, their A4 is recalculated from the new masses with
+        the transport model, and `total_co2e` follows when present.
+        
+        Args:
+            tables: New compiled factor tables (see carbomatch_factors.load_factor_tables)
+            
+        Returns:
+            Number of recalculated rows
         """
-        logger.info("=== STEP 4: TRANSPORT CO₂E SIMULATION ===")
+        if self.matched_df is None or 'conversion_rule' not in self.matched_df.columns:
+            raise ValueError("No calculated data available. Run calculate_all_co2e() first.")
         
-        # Simple transport simulation
-        # Assumption: Average transport distance 100km, truck emission factor 0.8 kg CO₂e/tkm
-        avg_distance_km = 100
-        truck_emission_factor = 0.0008  # kg CO₂e per kg per km
+        changed = self.factor_tables.changed_rule_labels(tables)
+        affected = affected_rows([self.matched_df['conversion_rule'], self.matched_df['material_rule']], changed)
         
-        self.matched_df['transport_distance_km'] = avg_distance_km
-        self.matched_df['calculated_co2e_a4'] = (
-            self.matched_df['Menge'] * avg_distance_km * truck_emission_factor
-        )
+        if affected.any():
+            subset = self.matched_df.loc[affected]
+            conversions = convert_units(subset, tables)
+            results = calculate_frame_co2e(subset, conversions)
+            updates = pd.concat([conversions, results], axis=1)
+            columns = CONVERSION_COLUMNS + CALCULATION_COLUMNS + MASS_COLUMNS
+            if 'calculated_co2e_a4' in self.matched_df.columns:
+                # Step 4 already ran - the new masses change these rows' A4
+                transport = self.transport_model.apply(subset['Lieferant'], results['mass_kg'].fillna(0),
+                                                       site=self.site_id)
+                updates = pd.concat([updates, transport], axis=1)
+                columns = columns + TRANSPORT_COLUMNS
+            for col in columns:
+                if isinstance(self.matched_df[col].dtype, pd.CategoricalDtype):
+                    # Category sets differ between versions - merge as labels
+                    merged = self.matched_df[col].astype(object)
+                    merged[affected] = updates[col].astype(object).to_numpy()
+                    self.matched_df[col] = merged.astype('category')
+                else:
+                    self.matched_df.loc[affected, col] = updates[col].to_numpy()
+            if 'total_co2e' in self.matched_df.columns:
+                rows = self.matched_df.loc[affected]
+                self.matched_df.loc[affected, 'total_co2e'] = rows['calculated_co2e_a1_a3'] + rows['calculated_co2e_a4']
+        
+        self.factor_tables = tables
+        self.matched_df['factor_table_version'] = tables.version_label
+        logger.info(f"Applied factor tables {tables.version_label}: {int(affected.sum())}/{len(self.matched_df)} rows recalculated "
+                    f"({len(changed)} changed rules)")
+        return int(affected.sum())
+    
+    def calculation_status(self) -> pd.Series:
+        """Render the audit text of each calculated row (Success: .../Error: ...)"""
+        return render_calculation_status(self.matched_df['Menge'], self.matched_df['matched_oeko_unit'],
+                                         self.matched_df, self.matched_df['calculation_code'])
+    
+    def simulate_transport_co2e(self, model: Optional[TransportModel] = None) -> None:
+        """
+        Step 4: Calculate transport CO₂e (A4 module)
+        
+        Distances come from the supplier → site distance table (falling back to
+        the configured default distance), emission factors from the vehicle of
+        each entry; `distance_source` records which level supplied the distance.
+        The transported mass is `mass_kg` from calculate_all_co2e(); rows
+        without a derivable mass get no A4 emissions.
+        
+        Args:
+            model: Transport model to use (defaults to self.transport_model)
+        """
+        logger.info("=== STEP 4: TRANSPORT CO₂E CALCULATION ===")
+        
+        if 'mass_kg' not in self.matched_df.columns:
+            raise ValueError("No row masses available. Run calculate_all_co2e() first.")
+        
+        model = model or self.transport_model
+        transport = model.apply(self.matched_df['Lieferant'], self.matched_df['mass_kg'].fillna(0), site=self.site_id)
+        for col in TRANSPORT_COLUMNS:
+            self.matched_df[col] = transport[col]
         
         total_transport_co2e = self.matched_df['calculated_co2e_a4'].sum()
-        logger.info(f"Transport CO₂e simulation completed:")
+        sources = self.matched_df['distance_source'].value_counts()
+        logger.info(f"Transport CO₂e calculation completed ({model.version_label}):")
         logger.info(f"  Total transport CO₂e (A4): {total_transport_co2e:,.2f} kg CO₂e")
-        logger.info(f"  Average distance assumed: {avg_distance_km} km")
+        logger.info(f"  Average distance: {self.matched_df['transport_distance_km'].mean():,.1f} km "
+                    f"({', '.join(f'{source}: {count}' for source, count in sources.items() if count)})")
+        totals = RollupBuilder(dimensions={'project': None}, top_rows=0)
+        totals.add(self.matched_df)
+        summary = summarize(totals.result())
+        if summary['total_mass_kg'] > 0:
+            logger.info(f"  CO₂e intensity: {summary['intensity']:.4f} kg CO₂e/kg material "
+                        f"({summary['known_mass_items']}/{summary['total_items']} rows with known mass)")
+        unknown = int((self.matched_df['mass_source'] == MASS_UNKNOWN).sum())
+        if unknown:
+            logger.warning(f"  {unknown} rows have no derivable mass and are excluded from A4 and the intensity")
     
-    def generate_final_report(self) -> None:
+    def generate_final_report(self, output_path: str = OUTPUT_FILE, merge_existing: bool = False,
+                              print_summary: bool = True, status_text: bool = False,
+                              parquet_path: Optional[str] = None, partition_by: Optional[List[str]] = None,
+                              store_path: Optional[str] = None, history_dir: Optional[str] = None,
+                              xlsx_path: Optional[str] = None, xlsx_sheet_by: Optional[str] = None) -> Dict:
         """
         Step 5: Generate final CSRD-compliant report
+        
+        The calculation outcome is stored as numeric STATUS_COLUMNS (reason
+        code, conversion path, factors); carbomatch_co2e.render_report_status()
+        turns them back into the `calculation_status` text. Rows are streamed
+        in chunks through carbomatch_report.ReportWriter, which rounds and
+        encodes each chunk, so no full copy of the report is built. The same
+        chunks feed the rollup tables (carbomatch_rollup) written next to the
+        report (`self.rollups`); the project summary derived from them
+        (carbomatch_summary) is written as JSON next to the report and returned.
+        
+        Args:
+            output_path: Path of the CSV report (`.csv.gz` / `.csv.zst` for a
+                         compressed one)
+            merge_existing: Merge rows into the existing report instead of overwriting
+                            it (incremental mode); rows are deduplicated by fingerprint
+            print_summary: Print the executive summary to stdout
+            status_text: Also export the rendered `calculation_status` text
+            parquet_path: Also write the typed report (carbomatch_report) to this
+                          Parquet file, or dataset directory with partition_by
+            partition_by: Partition columns of the Parquet output (e.g. ['site', 'Lieferant'])
+            store_path: Also replace this site's rows in the SQLite report store
+                        (carbomatch_store) with the report rows
+            history_dir: Also record the run (rows with content hashes and a
+                         manifest) in this run history (carbomatch_history)
+            xlsx_path: Also write the report with its status text and a rollups
+                       sheet to this Excel workbook (carbomatch_xlsx)
+            xlsx_sheet_by: Also give each value of this column (e.g. 'Lieferant')
+                           a sheet of its own in the workbook
+        
+        Returns:
+            Report summary (see carbomatch_summary.summarize), also in `self.summary`
         """
         logger.info("=== STEP 5: FINAL REPORT GENERATION ===")
         
@@ -502,84 +935,338 @@ class CarbonMatchPipeline:
             self.matched_df['calculated_co2e_a4']
         )
         
-        # Select columns for final report
-        report_columns = [
-            'Lieferant',
-            'Artikel-Nummer', 
-            'Artikel',
-            'Menge',
-            'Einheit',
-            'matched_material',
-            'matched_category',
-            'similarity_score',
-            'matched_oeko_unit',
-            'calculated_co2e_a1_a3',
-            'calculated_co2e_a4',
-            'total_co2e',
-            'calculation_status'
-        ]
-        
-        final_df = self.matched_df[report_columns].copy()
-        
-        # Round numeric columns
-        numeric_cols = ['similarity_score', 'calculated_co2e_a1_a3', 'calculated_co2e_a4', 'total_co2e']
-        for col in numeric_cols:
-            final_df[col] = final_df[col].round(4)
-        
-        # Generate summary statistics
+        rollups = RollupBuilder()
+        writers = [ReportWriter(output_path, columns=REPORT_COLUMNS, status_text=status_text, rollups=rollups)]
+        existing_df = None
+        new_rows = self.matched_df
+        
+        # Incremental mode - append new rows to the previous report
+        if merge_existing and os.path.exists(output_path):
+            existing_df = read_report(output_path)
+            if FINGERPRINT_COLUMN in existing_df.columns:
+                # Later rows win, as in a concat + drop_duplicates(keep='last')
+                fingerprints = pd.concat([existing_df[FINGERPRINT_COLUMN].astype(object),
+                                          new_rows[FINGERPRINT_COLUMN].astype(object)], ignore_index=True)
+                keep = ~fingerprints.duplicated(keep='last').to_numpy()
+                existing_df = existing_df[keep[:len(existing_df)]]
+                new_rows = new_rows[keep[len(keep) - len(new_rows):]]
+            else:
+                logger.warning(f"{output_path} has no {FINGERPRINT_COLUMN} column - rows cannot be deduplicated")
+            if 'matched_uuid' not in existing_df.columns and self.oeko_df is not None:
+                # Reports written before the UUID was a report column: recover it from the catalog
+                uuids = self.oeko_df.drop_duplicates('Name (de)').set_index('Name (de)')[MATCH_FIELDS['matched_uuid']]
+                existing_df = existing_df.assign(matched_uuid=existing_df['matched_material'].astype(object).map(
+                    uuids).astype(object).fillna(NO_MATCH_VALUES['matched_uuid']))
+            # Keep columns of the previous report (e.g. stored status text) in front, as a concat would
+            writers[0] = ReportWriter(output_path, status_text=status_text, rollups=rollups,
+                                      columns=list(existing_df.columns) + [
+                                          col for col in REPORT_COLUMNS if col not in existing_df.columns])
+            logger.info(f"Merged {len(self.matched_df)} new rows into {len(existing_df)} existing report rows")
+        
+        if parquet_path:
+            writers.append(ReportWriter(parquet_path, columns=writers[0].columns, status_text=status_text,
+                                        partition_by=partition_by, constants={SITE_COLUMN: self.site_id or ''}))
+        if xlsx_path:
+            writers.append(ReportWriter(xlsx_path, columns=writers[0].columns, status_text=True,
+                                        sheet_by=xlsx_sheet_by))
+        
+        # Stream the rows chunk by chunk - the report is never copied as a whole
+        try:
+            for writer in writers:
+                if existing_df is not None:
+                    writer.write(existing_df)
+                writer.write(new_rows)
+                if writer.format == 'xlsx':
+                    # The first writer has fed every row to the rollups by now
+                    writer.add_sheet(ROLLUPS_SHEET, rollups.result())
+                writer.close()
+        except BaseException:
+            for writer in writers:
+                writer.abort()
+            raise
+        if store_path:
+            ReportStore(store_path).replace_site(
+                self.site_id or '', [existing_df, new_rows] if existing_df is not None else [new_rows],
+                report=output_path, factor_table_version=self.factor_tables.version_label)
+        self.rollups = rollups.result()
+        write_rollups(self.rollups, rollups_path(output_path))
+        self.summary = summarize(self.rollups, site=self.site_id, report=output_path,
+                                 factor_table_version=self.factor_tables.version_label)
+        write_summary(self.summary, summary_path(output_path))
+        if history_dir:
+            manifest = RunHistory(history_dir).record(
+                [existing_df, new_rows] if existing_df is not None else [new_rows], site=self.site_id or '',
+                report=output_path, summary=self.summary, inputs=self.run_inputs(),
+                settings={**self.run_settings(), 'incremental': existing_df is not None})
+            logger.info(f"🗂️  Run recorded as {manifest['run_id']} in {history_dir}")
+        
+        if print_summary:
+            self._print_executive_summary(self.summary)
+            print(f"\n📄 Report exported to: {output_path}")
+            print("="*80)
+        return self.summary
+    
+    def run_inputs(self) -> Dict:
+        """Input files of the run with content digests (for the run manifest)"""
+        inputs = {}
+        for name, path in [('deliveries', self.source_file), ('oekobaudat', self.catalog_file)]:
+            if path and os.path.exists(path):
+                inputs[name] = {'file': os.path.basename(path), 'digest': file_digest(path)}
+        return inputs
+    
+    def run_settings(self) -> Dict:
+        """Settings the matches and CO₂e values depend on (for the run manifest)"""
+        return {
+            # Mock embeddings do not match like the model's
+            'embedding_model': AZURE_EMBEDDING_MODEL if self.client else 'mock',
+            'factor_table_version': self.factor_tables.version_label,
+            'transport_model': self.transport_model.version_label,
+        }
+    
+    def _print_executive_summary(self, summary: Dict) -> None:
+        """Print project totals, KPIs and top contributors of a report summary"""
         print("\n" + "="*80)
         print("CSRD CO₂ REPORTING - EXECUTIVE SUMMARY")
         print("="*80)
         
-        total_materials = len(final_df)
-        total_weight = final_df['Menge'].sum()
-        total_material_co2e = final_df['calculated_co2e_a1_a3'].sum()
-        total_transport_co2e = final_df['calculated_co2e_a4'].sum()
-        grand_total_co2e = final_df['total_co2e'].sum()
+        total_materials = summary['total_items']
+        total_weight = summary['total_mass_kg']
         
         print(f"📊 PROJECT TOTALS:")
         print(f"   • Total materials processed: {total_materials:,} items")
-        print(f"   • Total material weight: {total_weight:,.2f} kg")
-        print(f"   • Material CO₂e (A1-A3): {total_material_co2e:,.2f} kg CO₂e")
-        print(f"   • Transport CO₂e (A4): {total_transport_co2e:,.2f} kg CO₂e")
-        print(f"   • GRAND TOTAL CO₂e: {grand_total_co2e:,.2f} kg CO₂e")
+        print(f"   • Total material weight: {total_weight:,.2f} kg "
+              f"({summary['known_mass_items']:,}/{total_materials:,} items with known mass)")
+        print(f"   • Material CO₂e (A1-A3): {summary['material_co2e']:,.2f} kg CO₂e")
+        print(f"   • Transport CO₂e (A4): {summary['transport_co2e']:,.2f} kg CO₂e")
+        print(f"   • GRAND TOTAL CO₂e: {summary['total_co2e']:,.2f} kg CO₂e")
         
         print(f"\n🎯 KEY PERFORMANCE INDICATORS:")
-        print(f"   • CO₂e intensity: {grand_total_co2e/total_weight:.4f} kg CO₂e/kg material")
-        print(f"   • Material vs Transport ratio: {total_material_co2e/total_transport_co2e:.1f}:1")
+        if total_weight > 0:
+            print(f"   • CO₂e intensity: {summary['intensity']:.4f} kg CO₂e/kg material "
+                  f"({summary['intensity_basis']}, {summary['known_mass_pct']:.1f}% of items)")
+        ratio = summary['material_transport_ratio']
+        print(f"   • Material vs Transport ratio: {f'{ratio:.1f}:1' if ratio is not None else 'n/a (no transport CO₂e)'}")
         
         # Top CO₂e contributors
         print(f"\n🔝 TOP 5 CO₂e CONTRIBUTORS:")
-        top_contributors = final_df.nlargest(5, 'total_co2e')
-        for i, (_, row) in enumerate(top_contributors.iterrows(), 1):
-            print(f"   {i}. {row['Artikel'][:50]}... - {row['total_co2e']:,.2f} kg CO₂e")
-        
-        # Export to CSV
-        final_df.to_csv(OUTPUT_FILE, sep=';', index=False, encoding='utf-8-sig')
-        logger.info(f"Final report exported to {OUTPUT_FILE}")
-        
-        print(f"\n📄 Report exported to: {OUTPUT_FILE}")
-        print("="*80)
+        for i, contributor in enumerate(summary['top_contributors'], 1):
+            print(f"   {i}. {contributor['Artikel'][:50]}... - {contributor['total_co2e']:,.2f} kg CO₂e")
+
+
+def count_data_rows(path: str) -> int:
+    """Count CSV data rows (lines minus header) without parsing the file (.gz / .zst are decompressed)"""
+    compression = csv_compression(path)
+    if compression == 'gzip':
+        import gzip
+        opener = gzip.open
+    elif compression == 'zstd':
+        import zstandard
+        opener = zstandard.open
+    else:
+        opener = open
+    lines = 0
+    with opener(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            lines += block.count(b'\n')
+    return max(lines - 1, 0)
+
+
+def _read_npy_member(archive: zipfile.ZipFile, name: str) -> Tuple[Dict, bytes]:
+    """Parse the header of a .npy member of an .npz archive (stdlib only)"""
+    with archive.open(name) as f:
+        magic = f.read(8)
+        if magic[:6] != b'\x93NUMPY':
+            raise ValueError(f"{name} is not a .npy file")
+        header_len_size = 2 if magic[6] == 1 else 4
+        header_len = int.from_bytes(f.read(header_len_size), 'little')
+        header = ast.literal_eval(f.read(header_len).decode('latin-1'))
+        # Only small members (the model name) are read completely
+        payload = f.read() if not header['shape'] else b''
+    return header, payload
+
+
+def inspect_embedding_cache(path: str = EMBEDDING_CACHE_FILE) -> Dict:
+    """
+    Describe a persisted embedding cache without loading numpy
+    
+    Returns:
+        Dict with model, entries, dimensions and size_bytes
+    """
+    with zipfile.ZipFile(path) as archive:
+        vectors_header, _ = _read_npy_member(archive, 'vectors.npy')
+        model_header, model_bytes = _read_npy_member(archive, 'model.npy')
+    
+    shape = vectors_header['shape']
+    model = model_bytes.decode('utf-32-le').rstrip('\x00') if model_header['descr'].startswith('<U') else '?'
+    return {
+        'model': model,
+        'entries': shape[0],
+        'dimensions': shape[1] if len(shape) > 1 else 0,
+        'size_bytes': os.path.getsize(path),
+    }
+
+
+def print_status(args: argparse.Namespace) -> None:
+    """`status` command: summarize report, rejects and ledger files"""
+    print("🌱 CarbonMatch status")
+    for label, path in [("Report", args.output), ("Rejects", REJECTS_FILE), ("Ledger", args.ledger)]:
+        if not os.path.exists(path):
+            print(f"   • {label:<8} {path}: missing")
+            continue
+        modified = datetime.fromtimestamp(os.path.getmtime(path)).strftime('%Y-%m-%d %H:%M:%S')
+        print(f"   • {label:<8} {path}: {count_data_rows(path):,} rows, "
+              f"{os.path.getsize(path) / 1024:,.1f} KiB, updated {modified}")
+
+
+def print_cache_info(args: argparse.Namespace) -> None:
+    """`cache` command: inspect the persisted embedding and conversion caches and stage checkpoints"""
+    if not os.path.exists(EMBEDDING_CACHE_FILE):
+        print(f"🗄️  No embedding cache at {EMBEDDING_CACHE_FILE}")
+    else:
+        info = inspect_embedding_cache(EMBEDDING_CACHE_FILE)
+        print(f"🗄️  Embedding cache {EMBEDDING_CACHE_FILE}")
+        print(f"   • Model: {info['model']}")
+        print(f"   • Entries: {info['entries']:,} × {info['dimensions']} dimensions")
+        print(f"   • Size: {info['size_bytes'] / 1024 / 1024:,.2f} MiB")
+    
+    info = inspect_conversion_cache(CONVERSION_CACHE_FILE)
+    if not info['exists']:
+        print(f"🗄️  No conversion cache at {CONVERSION_CACHE_FILE}")
+    else:
+        print(f"🗄️  Conversion cache {CONVERSION_CACHE_FILE}")
+        print(f"   • Factor tables: {info['factor_table_version']}, conversion rules v{info['conversion_version']}"
+              + ("" if info['current'] else f" (stale, current v{CONVERSION_VERSION} - not loaded)"))
+        print(f"   • Entries: {info['entries']:,} conversion keys")
+        print(f"   • Size: {info['size_bytes'] / 1024:,.1f} KiB")
+    
+    entries = CheckpointStore(CHECKPOINT_DIR).entries()
+    if not entries:
+        print(f"🗄️  No stage checkpoints in {CHECKPOINT_DIR}/")
+        return
+    print(f"🗄️  Stage checkpoints {CHECKPOINT_DIR}/")
+    for entry in entries:
+        modified = datetime.fromtimestamp(entry['modified']).strftime('%Y-%m-%d %H:%M:%S')
+        print(f"   • {entry['stage']:<11} {entry['scope'] or '-':<8} {entry['key']}  "
+              f"{entry['size_bytes'] / 1024:,.1f} KiB, {modified}")
 
 
-def main():
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    """Parse command line arguments"""
+    parser = argparse.ArgumentParser(description="CarbonMatch CSRD CO₂ reporting pipeline")
+    parser.add_argument('command', nargs='?', default='run', choices=['run', 'status', 'cache'],
+                        help="run the pipeline (default), show output file status, or inspect the caches and stage checkpoints")
+    parser.add_argument('--incremental', action='store_true',
+                        help="only process delivery rows not yet recorded in the ledger and merge them into the report")
+    parser.add_argument('--ledger', default=LEDGER_FILE,
+                        help=f"processed-delivery ledger for incremental runs (default: {LEDGER_FILE})")
+    parser.add_argument('--output', default=OUTPUT_FILE,
+                        help=f"report CSV path, .csv.gz / .csv.zst to compress (default: {OUTPUT_FILE})")
+    parser.add_argument('--parquet', nargs='?', const='', default=None, metavar='PATH',
+                        help=f"also write the typed Parquet report (default: next to --output, e.g. {REPORT_PARQUET_FILE})")
+    parser.add_argument('--partition-by', type=lambda value: [col.strip() for col in value.split(',') if col.strip()],
+                        default=None, metavar='COLUMNS',
+                        help=f"partition the Parquet report into a dataset directory, e.g. {','.join(PARTITION_COLUMNS)}")
+    parser.add_argument('--xlsx', nargs='?', const='', default=None, metavar='PATH',
+                        help="also write the report as an Excel workbook with a rollups sheet (default: next to --output)")
+    parser.add_argument('--xlsx-sheet-by', default=None, metavar='COLUMN',
+                        help="also give each value of this column its own workbook sheet, e.g. Lieferant")
+    parser.add_argument('--store', nargs='?', const=STORE_FILE, default=None, metavar='PATH',
+                        help=f"also load the report rows into the SQLite report store (default: {STORE_FILE})")
+    parser.add_argument('--history', nargs='?', const=HISTORY_DIR, default=None, metavar='DIR',
+                        help=f"also record the run for carbomatch_history.py diffs (default: {HISTORY_DIR}/)")
+    parser.add_argument('--status-text', action='store_true',
+                        help="also write the rendered calculation_status text to the report")
+    parser.add_argument('--uncertainty', type=int, default=0, metavar='SAMPLES',
+                        help="also estimate P5/P50/P95 ranges with this many Monte Carlo draws")
+    parser.add_argument('--uncertainty-config', default=None,
+                        help="JSON overriding the uncertainty distributions (see carbomatch_uncertainty.py)")
+    parser.add_argument('--seed', type=int, default=0, help="random seed for --uncertainty (default: 0)")
+    parser.add_argument('--factors', default=None,
+                        help="conversion factor tables JSON (default: carbomatch_factors.json)")
+    parser.add_argument('--transport', default=None,
+                        help="transport vehicles and defaults JSON (default: carbomatch_transport.json)")
+    parser.add_argument('--distances', default=None,
+                        help="supplier → site distance table CSV (default: carbomatch_distances.csv, if present)")
+    parser.add_argument('--geocodes', default=None,
+                        help="supplier / site coordinates CSV (default: carbomatch_geocodes.csv, if present)")
+    parser.add_argument('--routing-url', default=None,
+                        help="OSRM server for road distances of geocoded pairs (default: geodesic × detour factor)")
+    parser.add_argument('--site', default=None, help="site id for distance table and geocode lookups")
+    parser.add_argument('--checkpoint', action='store_true',
+                        help=f"save each stage's output to {CHECKPOINT_DIR}/")
+    parser.add_argument('--resume', action='store_true',
+                        help="resume stages from checkpoints of unchanged inputs and settings (implies --checkpoint)")
+    parser.add_argument('--save-matched', action='store_true',
+                        help=f"also save the calculated matched stage for carbomatch_scenarios.py ({MATCHED_STAGE_FILE})")
+    return parser.parse_args(argv)
+
+
+def main(argv: Optional[List[str]] = None):
     """Main execution function"""
+    args = parse_args(argv)
+    
+    # Short commands never touch pandas/numpy
+    if args.command == 'status':
+        return print_status(args)
+    if args.command == 'cache':
+        return print_cache_info(args)
+    
+    configure_logging()
     print("🌱 VESTIGAS CSRD CO₂ REPORTING PIPELINE")
     print("=" * 50)
     print(f"📅 Execution Date: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
     print(f"🔧 OpenAI Available: {OPENAI_AVAILABLE}")
     print(f"☁️  Azure Endpoint: {AZURE_ENDPOINT}")
+    print(f"🔁 Mode: {'incremental' if args.incremental else 'full'}")
     
     try:
         # Initialize pipeline with Azure OpenAI
-        pipeline = CarbonMatchPipeline(api_key=SUBSCRIPTION_KEY)
+        router = OSRMRouter(args.routing_url) if args.routing_url else None
+        pipeline = CarbonMatchPipeline(api_key=SUBSCRIPTION_KEY, site_id=args.site, factors_path=args.factors,
+                                       transport_path=args.transport, distances_path=args.distances,
+                                       geocodes_path=args.geocodes, router=router)
+        pipeline.load_embedding_cache()
+        pipeline.conversion_cache.load()
+        if args.checkpoint or args.resume:
+            pipeline.enable_checkpoints(CheckpointStore(CHECKPOINT_DIR), resume=args.resume)
         
         # Execute the full pipeline
         pipeline.load_and_clean_data()
+        
+        ledger = DeliveryLedger(args.ledger)
+        if args.incremental:
+            if pipeline.select_unprocessed_deliveries(ledger) == 0:
+                print(f"\n✅ No new deliveries since last run - {args.output} is up to date")
+                return
+        
         pipeline.generate_embeddings_and_match()  
         pipeline.calculate_all_co2e()
         pipeline.simulate_transport_co2e()
-        pipeline.generate_final_report()
+        if args.save_matched:
+            pipeline.save_matched_stage(os.path.join(os.path.dirname(args.output), MATCHED_STAGE_FILE))
+        parquet_path = None
+        if args.parquet is not None or args.partition_by:
+            parquet_path = args.parquet or os.path.splitext(strip_compression(args.output))[0] + '.parquet'
+        xlsx_path = None
+        if args.xlsx is not None or args.xlsx_sheet_by:
+            xlsx_path = args.xlsx or os.path.splitext(strip_compression(args.output))[0] + '.xlsx'
+        pipeline.generate_final_report(output_path=args.output, merge_existing=args.incremental,
+                                       status_text=args.status_text, parquet_path=parquet_path,
+                                       partition_by=args.partition_by, store_path=args.store,
+                                       history_dir=args.history, xlsx_path=xlsx_path,
+                                       xlsx_sheet_by=args.xlsx_sheet_by)
+        if args.uncertainty > 0:
+            report_dir = os.path.dirname(args.output)
+            pipeline.estimate_uncertainty(args.uncertainty, args.uncertainty_config, seed=args.seed,
+                                          output_path=os.path.join(report_dir, UNCERTAINTY_FILE),
+                                          summary_path=os.path.join(report_dir, UNCERTAINTY_SUMMARY_FILE))
+        pipeline.save_embedding_cache()
+        pipeline.conversion_cache.save()
+        pipeline.save_route_cache()
+        
+        # Record processed rows only once the report containing them is written
+        ledger.record(pipeline.deliveries_df[FINGERPRINT_COLUMN], pipeline.source_file)
+        ledger.save()
         
         print("\n✅ PIPELINE EXECUTION COMPLETED SUCCESSFULLY!")
         
@@ -0,0 +1,420 @@
+#!/usr/bin/env python3
+"""
+CarbonMatch - Report Storage
+============================
+
+Typed report output next to the CSV export, written by a streaming
+ReportWriter: rows are selected, rounded and encoded chunk by chunk
+(REPORT_CHUNK_ROWS), so the full report never exists as a second frame.
+
+- Parquet (`carbomatch_report.parquet`): the report with its column types
+  preserved - categoricals for repeated labels, int8 codes, float64 values -
+  so readers neither re-parse text nor re-coerce numbers.
+- Partitioned dataset: with `partition_by` (e.g. ['site', 'Lieferant']) the
+  report becomes a hive-style directory (`site=.../Lieferant=.../*.parquet`);
+  readers filtering on those columns only open the matching files.
+- Parquet chunks become row groups of one file, or files per partition.
+- CSV (`carbomatch_report.csv`): semicolon-separated, utf-8-sig, kept as the
+  compatibility export; `.csv.gz` / `.csv.zst` paths are compressed while
+  streaming (zstd needs the optional `zstandard` package).
+- XLSX (`carbomatch_report.xlsx`): the audit workbook for clients, streamed
+  through carbomatch_xlsx (shared strings, optional sheet per supplier with
+  `sheet_by`, extra sheets such as the rollups via add_sheet()).
+
+read_report() loads any of the three with column projection, so a dashboard
+or analysis script reads only the columns it shows.
+"""
+
+from __future__ import annotations
+
+import logging
+import os
+import shutil
+import uuid
+from typing import Dict, List, Optional, Sequence
+
+from carbomatch_lazy import lazy_import
+from carbomatch_ledger import FINGERPRINT_COLUMN
+from carbomatch_mass import MASS_COLUMNS
+from carbomatch_co2e import STATUS_COLUMNS, render_report_status
+from carbomatch_xlsx import REPORT_SHEET, XlsxWriter, is_xlsx
+
+np = lazy_import("numpy")
+pd = lazy_import("pandas")
+
+logger = logging.getLogger(__name__)
+
+REPORT_PARQUET_FILE = "carbomatch_report.parquet"
+SITE_COLUMN = 'site'
+PARTITION_COLUMNS = [SITE_COLUMN, 'Lieferant']
+
+REPORT_COLUMNS = [
+    'Lieferant', 'Artikel-Nummer', 'Artikel', 'Menge', 'Einheit', *MASS_COLUMNS,
+    'matched_material', 'matched_category', 'matched_uuid', 'similarity_score', 'matched_oeko_unit',
+    'calculated_co2e_a1_a3', 'calculated_co2e_a4', 'total_co2e',
+    'transport_distance_km', 'distance_source', 'transport_vehicle',
+    *STATUS_COLUMNS, 'factor_table_version', FINGERPRINT_COLUMN,
+]
+
+# Report column types (columns not listed keep their dtype)
+CATEGORY_COLUMNS = [
+    SITE_COLUMN, 'Lieferant', 'Einheit', 'matched_category', 'matched_oeko_unit', 'distance_source',
+    'transport_vehicle', 'converted_unit', 'factor_table_version',
+]
+CODE_COLUMNS = ['mass_source', 'calculation_code', 'conversion_path']
+FLOAT_COLUMNS = [
+    'Menge', 'mass_kg', 'similarity_score', 'calculated_co2e_a1_a3', 'calculated_co2e_a4', 'total_co2e',
+    'transport_distance_km', 'unit_quantity', 'pack_factor', 'converted_quantity', 'thickness_m',
+    'density_kg_m3', 'weight_per_piece_kg', 'weight_per_meter_kg', 'mesh_weight_kg_m2',
+]
+TEXT_COLUMNS = ['Artikel-Nummer', 'matched_uuid']
+
+# Decimal places of rounded report values
+REPORT_ROUNDING = {
+    'mass_kg': 4, 'similarity_score': 4, 'calculated_co2e_a1_a3': 4, 'calculated_co2e_a4': 4, 'total_co2e': 4,
+}
+
+REPORT_CHUNK_ROWS = 100_000
+COMPRESSION_SUFFIXES = {'gzip': '.gz', 'zstd': '.zst'}
+
+
+def is_parquet(path: str) -> bool:
+    """True for a Parquet file or a partitioned Parquet dataset directory"""
+    return path.endswith('.parquet') or os.path.isdir(path)
+
+
+def csv_compression(path: str) -> Optional[str]:
+    """Compression implied by a CSV path suffix ('gzip', 'zstd' or None)"""
+    for compression, suffix in COMPRESSION_SUFFIXES.items():
+        if path.endswith(suffix):
+            return compression
+    return None
+
+
+def strip_compression(path: str) -> str:
+    """CSV path without its compression suffix"""
+    compression = csv_compression(path)
+    return path[:-len(COMPRESSION_SUFFIXES[compression])] if compression else path
+
+
+def round_report(frame: pd.DataFrame) -> pd.DataFrame:
+    """Round the REPORT_ROUNDING columns of a report frame or chunk (in place, returns frame)"""
+    for col, decimals in REPORT_ROUNDING.items():
+        if col in frame.columns:
+            frame[col] = frame[col].round(decimals)
+    return frame
+
+
+def type_report(df: pd.DataFrame) -> pd.DataFrame:
+    """Cast report columns to their storage types (in place, returns df)"""
+    for col in df.columns:
+        if col in FLOAT_COLUMNS:
+            df[col] = pd.to_numeric(df[col], errors='coerce').astype(float)
+        elif col in CODE_COLUMNS:
+            # Merged incremental reports may hold rows without a code
+            values = pd.to_numeric(df[col], errors='coerce')
+            df[col] = values.astype(np.int8) if values.notna().all() else values.astype('Int8')
+        elif col in CATEGORY_COLUMNS and not isinstance(df[col].dtype, pd.CategoricalDtype):
+            df[col] = df[col].astype('category')
+        elif col in TEXT_COLUMNS:
+            # Article numbers mix digits and codes - store all as text
+            df[col] = df[col].astype(object).where(df[col].isna(), df[col].astype(str))
+    return df
+
+
+def write_report_parquet(df: pd.DataFrame, path: str = REPORT_PARQUET_FILE,
+                         partition_by: Optional[Sequence[str]] = None) -> str:
+    """
+    Write a complete report frame as typed Parquet (see ReportWriter)
+
+    Args:
+        df: Report frame (REPORT_COLUMNS, optionally SITE_COLUMN)
+        path: Parquet file, or dataset directory when partitioned
+        partition_by: Columns to partition by (hive-style directories); the
+                      partitions present in df are replaced, others are kept
+
+    Returns:
+        Path written
+    """
+    with ReportWriter(path, columns=list(df.columns), partition_by=partition_by) as writer:
+        writer.write(df)
+    return path
+
+
+class ReportWriter:
+    """
+    Streams report rows to a CSV (optionally compressed), Parquet or XLSX file
+
+    Usage:
+        with ReportWriter("carbomatch_report.csv.gz") as writer:
+            for chunk in chunks:
+                writer.write(chunk)
+
+    Each written frame is cut into chunks of chunk_rows; a chunk is projected
+    to the report columns, rounded (REPORT_ROUNDING), typed and appended. Files
+    are written under a temporary name and replace the target on close, so a
+    failed run leaves the previous report in place. Partitioned datasets
+    replace the partitions they wrote to and keep the others.
+    """
+
+    def __init__(self, path: str, columns: Sequence[str] = REPORT_COLUMNS,
+                 partition_by: Optional[Sequence[str]] = None, constants: Optional[Dict[str, object]] = None,
+                 status_text: bool = False, chunk_rows: int = REPORT_CHUNK_ROWS, rollups=None,
+                 sheet_by: Optional[str] = None):
+        """
+        Args:
+            path: `.csv`, `.csv.gz`, `.csv.zst`, `.parquet` or `.xlsx` file, or
+                  dataset directory when partition_by is set
+            columns: Report columns in output order (missing ones are written empty)
+            partition_by: Partition columns of a Parquet dataset
+            constants: Columns with one value for all rows (e.g. {'site': 'A'})
+            status_text: Also write the rendered `calculation_status` text
+            chunk_rows: Rows encoded per chunk (one Parquet row group each)
+            rollups: Accumulator fed every prepared chunk (e.g.
+                     carbomatch_rollup.RollupBuilder)
+            sheet_by: XLSX only - also write each value's rows of this column
+                      to a sheet of their own (e.g. 'Lieferant')
+        """
+        self.path = path
+        self.partition_by = list(partition_by or [])
+        self.constants = dict(constants or {})
+        self.columns = list(columns) + [col for col in self.constants if col not in columns]
+        if status_text and 'calculation_status' not in self.columns:
+            self.columns.append('calculation_status')
+        self.status_text = status_text
+        self.chunk_rows = chunk_rows
+        self.rollups = rollups
+        if self.partition_by or is_parquet(path):
+            self.format = 'parquet'
+        else:
+            self.format = 'xlsx' if is_xlsx(path) else 'csv'
+        missing = [col for col in self.partition_by if col not in self.columns]
+        if missing:
+            raise ValueError(f"Cannot partition the report by missing columns: {missing}")
+        if sheet_by and (self.format != 'xlsx' or sheet_by not in self.columns):
+            raise ValueError(f"sheet_by needs an .xlsx report holding the column {sheet_by!r}")
+        self.sheet_by = sheet_by
+        self.rows = 0
+        self._tmp_path = f"{path}.tmp"
+        self._handle = None
+        self._parquet = None
+        self._xlsx = None
+        self._schema = None
+        self._token = uuid.uuid4().hex
+        self._partitions: Dict[str, object] = {}  # dataset directory -> open ParquetWriter
+
+    def __enter__(self) -> ReportWriter:
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+    def write(self, frame: pd.DataFrame) -> None:
+        """Append rows (any frame holding the report columns)"""
+        for start in range(0, len(frame), self.chunk_rows):
+            chunk = self._prepare(frame.iloc[start:start + self.chunk_rows])
+            if self.format == 'csv':
+                self._write_csv(chunk)
+            elif self.format == 'xlsx':
+                self._write_xlsx(chunk)
+            elif self.partition_by:
+                self._write_dataset(chunk)
+            else:
+                self._write_parquet(chunk)
+            if self.rollups is not None:
+                self.rollups.add(chunk)
+            self.rows += len(chunk)
+
+    def _prepare(self, rows: pd.DataFrame) -> pd.DataFrame:
+        """Project, round and type one chunk"""
+        chunk = rows.reindex(columns=self.columns)
+        for col, value in self.constants.items():
+            chunk[col] = value
+        round_report(chunk)
+        if self.status_text:
+            # Rows merged from reports without status columns keep their stored text
+            chunk['calculation_status'] = render_report_status(chunk)
+        if self.format == 'parquet':
+            type_report(chunk)
+            for col in self.partition_by:
+                # Partition values become directory names - use the labels, not categories
+                chunk[col] = chunk[col].astype(object).fillna('').astype(str).replace('', 'Unknown')
+        return chunk
+
+    def _write_csv(self, chunk: pd.DataFrame) -> None:
+        if self._handle is None:
+            compression = csv_compression(self.path)
+            if compression == 'gzip':
+                import gzip
+                self._handle = gzip.open(self._tmp_path, 'wt', compresslevel=6, encoding='utf-8-sig', newline='')
+            elif compression == 'zstd':
+                try:
+                    import zstandard
+                except ImportError as e:
+                    raise ImportError("zstd-compressed reports need the 'zstandard' package") from e
+                self._handle = zstandard.open(self._tmp_path, 'wt', encoding='utf-8-sig', newline='')
+            else:
+                self._handle = open(self._tmp_path, 'w', encoding='utf-8-sig', newline='')
+        chunk.to_csv(self._handle, sep=';', index=False, header=self.rows == 0)
+
+    def _write_xlsx(self, chunk: pd.DataFrame) -> None:
+        if self._xlsx is None:
+            self._xlsx = XlsxWriter(self.path)
+        self._xlsx.append(REPORT_SHEET, chunk, split_by=self.sheet_by)
+
+    def add_sheet(self, name: str, frame: pd.DataFrame) -> None:
+        """XLSX only: write a further sheet next to the report rows (e.g. the rollups)"""
+        if self.format != 'xlsx':
+            raise ValueError(f"Extra sheets need an .xlsx report, not {self.path}")
+        if self._xlsx is None:
+            self._xlsx = XlsxWriter(self.path)
+            self._xlsx.append(REPORT_SHEET, pd.DataFrame(columns=self.columns))
+        self._xlsx.append(name, frame)
+
+    def _table(self, chunk: pd.DataFrame):
+        """Arrow table of a chunk with the schema of the first chunk"""
+        import pyarrow as pa
+
+        table = pa.Table.from_pandas(chunk, preserve_index=False)
+        if self._schema is None:
+            # Fixed column types for all chunks: dictionaries with int32 indices
+            # (chunks differ in category counts), int8 codes, float64 values
+            fields = []
+            for field in table.schema:
+                if field.name in CATEGORY_COLUMNS and field.name not in self.partition_by:
+                    field = field.with_type(pa.dictionary(pa.int32(), pa.string()))
+                elif field.name in CODE_COLUMNS:
+                    field = field.with_type(pa.int8())
+                elif field.name in FLOAT_COLUMNS:
+                    field = field.with_type(pa.float64())
+                elif field.name in TEXT_COLUMNS or (field.name in self.partition_by) or pa.types.is_null(field.type):
+                    field = field.with_type(pa.string())
+                fields.append(field)
+            self._schema = pa.schema(fields, metadata=table.schema.metadata)
+        return table.cast(self._schema)
+
+    def _write_parquet(self, chunk: pd.DataFrame) -> None:
+        import pyarrow.parquet as pq
+
+        table = self._table(chunk)
+        if self._parquet is None:
+            self._parquet = pq.ParquetWriter(self._tmp_path, self._schema)
+        self._parquet.write_table(table, row_group_size=len(chunk))
+
+    def _write_dataset(self, chunk: pd.DataFrame) -> None:
+        """Append each partition's rows to that partition's open file"""
+        import pyarrow.parquet as pq
+        from urllib.parse import quote
+
+        if not self._partitions and os.path.isfile(self.path):
+            os.remove(self.path)
+        table = self._table(chunk).drop_columns(self.partition_by)
+        codes = chunk.groupby(self.partition_by, sort=False).ngroup().to_numpy()
+        order = np.argsort(codes, kind='stable')
+        bounds = np.concatenate([[0], np.cumsum(np.bincount(codes))])
+        for code in range(len(bounds) - 1):
+            rows = order[bounds[code]:bounds[code + 1]]
+            values = [chunk[col].iloc[rows[0]] for col in self.partition_by]
+            # Hive-style directories, values URI-encoded like pyarrow's writer
+            directory = os.path.join(self.path, *(f"{col}={quote(value, safe='')}"
+                                                  for col, value in zip(self.partition_by, values)))
+            writer = self._partitions.get(directory)
+            if writer is None:
+                os.makedirs(directory, exist_ok=True)
+                # Dot-prefixed until closed, so readers skip the incomplete file
+                writer = pq.ParquetWriter(os.path.join(directory, f".{self._token}.parquet"), table.schema)
+                self._partitions[directory] = writer
+            writer.write_table(table.take(rows))
+
+    def close(self) -> None:
+        """Finish the output and move it into place"""
+        if self.format == 'csv':
+            if self._handle is None:
+                # No rows - still write the header
+                self._write_csv(pd.DataFrame(columns=self.columns))
+            self._handle.close()
+            os.replace(self._tmp_path, self.path)
+        elif self.format == 'xlsx':
+            if self._xlsx is None:
+                self._write_xlsx(pd.DataFrame(columns=self.columns))
+            self._xlsx.close()
+        elif self.partition_by:
+            # Replace the written partitions: drop files of earlier runs
+            for directory, writer in self._partitions.items():
+                writer.close()
+                for name in os.listdir(directory):
+                    if name.endswith('.parquet') and not name.startswith('.'):
+                        os.remove(os.path.join(directory, name))
+                os.replace(os.path.join(directory, f".{self._token}.parquet"),
+                           os.path.join(directory, f"{self._token}.parquet"))
+        else:
+            if self._parquet is None:
+                self._write_parquet(type_report(pd.DataFrame(columns=self.columns)))
+            self._parquet.close()
+            if os.path.isdir(self.path):
+                shutil.rmtree(self.path)
+            os.replace(self._tmp_path, self.path)
+        size = (sum(os.path.getsize(os.path.join(root, name)) for root, _, names in os.walk(self.path) for name in names)
+                if os.path.isdir(self.path) else os.path.getsize(self.path))
+        logger.info(f"Report exported to {self.path} ({self.rows:,} rows, {size / 1e6:,.1f} MB"
+                    + (f", partitioned by {', '.join(self.partition_by)})" if self.partition_by else ")"))
+
+    def abort(self) -> None:
+        """Discard the partial output (the previous report stays in place)"""
+        if self._handle is not None:
+            self._handle.close()
+        if self._parquet is not None:
+            self._parquet.close()
+        if self._xlsx is not None:
+            self._xlsx.abort()
+        if os.path.exists(self._tmp_path):
+            os.remove(self._tmp_path)
+        for directory, writer in self._partitions.items():
+            writer.close()
+            os.remove(os.path.join(directory, f".{self._token}.parquet"))
+
+
+def report_columns(path: str) -> List[str]:
+    """Column names of a report file or dataset without reading its rows"""
+    if is_parquet(path):
+        import pyarrow.dataset as ds
+
+        return ds.dataset(path, format='parquet', partitioning='hive').schema.names
+    return list(pd.read_csv(path, sep=';', encoding='utf-8-sig', nrows=0).columns)
+
+
+def read_report(path: str, columns: Optional[Sequence[str]] = None, filters=None) -> pd.DataFrame:
+    """
+    Load a report (Parquet file, partitioned dataset or CSV) with typed columns
+
+    Args:
+        path: Report path; `.parquet` files and directories are read as Parquet
+        columns: Columns to load (projection); columns the report lacks are
+                 skipped, so older reports still load
+        filters: Parquet row filters, e.g. [('site', '==', 'München Nord')];
+                 on partitioned datasets only matching partitions are read
+
+    Returns:
+        Report frame with the types of type_report()
+    """
+    available = report_columns(path)
+    selected = None if columns is None else [col for col in columns if col in available]
+    if is_parquet(path):
+        df = pd.read_parquet(path, columns=selected, filters=filters)
+        for col in CATEGORY_COLUMNS:
+            # Partition keys come back as dictionary columns - align their dtype
+            if col in df.columns and not isinstance(df[col].dtype, pd.CategoricalDtype):
+                df[col] = df[col].astype('category')
+        return df
+
+    df = pd.read_csv(path, sep=';', encoding='utf-8-sig', usecols=selected, float_precision='round_trip')
+    if filters:
+        for col, op, value in filters:
+            if op not in ('==', 'in'):
+                raise ValueError(f"Unsupported CSV report filter: {op}")
+            df = df[df[col].isin(value if op == 'in' else [value])]
+        df = df.reset_index(drop=True)
+    return type_report(df)
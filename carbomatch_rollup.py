@@ -0,0 +1,209 @@
+#!/usr/bin/env python3
+"""
+CarbonMatch - Report Rollups
+============================
+
+Pre-aggregated totals written with every report, so summaries and charts read
+a few hundred rows instead of scanning every delivery.
+
+One long table (`carbomatch_report.rollups.csv` next to the report) with a
+row per (dimension, key):
+
+    supplier   Lieferant
+    category   matched_category
+    material   matched_material
+    unit       Einheit (delivery unit)
+    status     calculation_code (see carbomatch_co2e.CALCULATION_CODE_LABELS)
+    project    one row, key ''
+    top        the ROLLUP_TOP_ROWS rows with the highest A1-A3 and those with
+               the highest total CO₂e, key = Artikel
+
+and the ROLLUP_MEASURES as sums (means are sum / count, e.g. similarity_sum /
+items). `mass_co2e` is the A1-A3 + A4 CO₂e of the rows with a known mass
+(`mass_items`), so mass_co2e / mass_kg is an intensity over the same rows;
+rollups written before it existed read it as NaN. A RollupBuilder is fed the chunks the ReportWriter encodes, so the
+rollups are computed in the same pass as the report and from the same
+rounded values - their totals equal the report's column sums.
+"""
+
+from __future__ import annotations
+
+import logging
+import os
+from typing import Dict, Iterable, List, Optional
+
+from carbomatch_lazy import lazy_import
+from carbomatch_co2e import CALC_SUCCESS
+from carbomatch_report import strip_compression
+
+np = lazy_import("numpy")
+pd = lazy_import("pandas")
+
+logger = logging.getLogger(__name__)
+
+ROLLUPS_SUFFIX = ".rollups.csv"
+
+# Rollup dimension -> report column (None: one project total row)
+ROLLUP_DIMENSIONS = {
+    'supplier': 'Lieferant',
+    'category': 'matched_category',
+    'material': 'matched_material',
+    'unit': 'Einheit',
+    'status': 'calculation_code',
+    'project': None,
+}
+TOP_DIMENSION = 'top'
+ROLLUP_TOP_ROWS = 25
+TOP_MEASURES = ['calculated_co2e_a1_a3', 'total_co2e']
+
+# Summed per key: row counts, known masses and CO₂e
+ROLLUP_MEASURES = [
+    'items', 'successful_items', 'mass_items', 'mass_kg', 'mass_co2e', 'similarity_sum',
+    'calculated_co2e_a1_a3', 'calculated_co2e_a4', 'total_co2e',
+]
+ROLLUP_COLUMNS = ['dimension', 'key', *ROLLUP_MEASURES]
+
+
+def rollups_path(report_path: str) -> str:
+    """Rollup file written next to a report (`carbomatch_report.csv.gz` -> `carbomatch_report.rollups.csv`)"""
+    return os.path.splitext(strip_compression(report_path.rstrip(os.sep)))[0] + ROLLUPS_SUFFIX
+
+
+def _key_label(value) -> str:
+    """Rollup key text of a dimension value ('' for missing, codes without '.0')"""
+    if value is None or (not isinstance(value, str) and pd.isna(value)):
+        return ''
+    if isinstance(value, (float, np.floating)) and float(value).is_integer():
+        return str(int(value))
+    return str(value)
+
+
+def _top_rows(rows: pd.DataFrame, n: int) -> pd.DataFrame:
+    """Rows among the n largest of any TOP_MEASURES (in row order)"""
+    index = rows.index[:0]
+    for col in TOP_MEASURES:
+        index = index.union(rows.nlargest(n, col).index)
+    return rows.loc[index]
+
+
+def _column(chunk: pd.DataFrame, col: str) -> np.ndarray:
+    """Numeric report column as float array (NaN when missing)"""
+    if col not in chunk.columns:
+        return np.full(len(chunk), np.nan)
+    return pd.to_numeric(chunk[col], errors='coerce').to_numpy(dtype=float)
+
+
+class RollupBuilder:
+    """
+    Accumulates rollups chunk by chunk (pass it to ReportWriter(rollups=...))
+
+    Each chunk is reduced to one row per key and dimension with bincount;
+    the partial rows are summed once in result().
+    """
+
+    def __init__(self, dimensions: Optional[Dict[str, Optional[str]]] = None, top_rows: int = ROLLUP_TOP_ROWS):
+        """
+        Args:
+            dimensions: Dimension -> report column (default ROLLUP_DIMENSIONS)
+            top_rows: Rows kept per TOP_MEASURES (0: no top rows)
+        """
+        self.dimensions = ROLLUP_DIMENSIONS if dimensions is None else dimensions
+        self.top_rows = top_rows
+        self._parts: List[pd.DataFrame] = []
+        self._top: Optional[pd.DataFrame] = None
+        self._seen = 0
+
+    def add(self, chunk: pd.DataFrame) -> None:
+        """Add report rows (a prepared ReportWriter chunk or any report frame)"""
+        if len(chunk) == 0:
+            return
+        mass = _column(chunk, 'mass_kg')
+        known = ~np.isnan(mass)
+        co2e = {col: np.nan_to_num(_column(chunk, col))
+                for col in ['calculated_co2e_a1_a3', 'calculated_co2e_a4', 'total_co2e']}
+        measures = {
+            'items': np.ones(len(chunk)),
+            'successful_items': (_column(chunk, 'calculation_code') == CALC_SUCCESS).astype(float),
+            'mass_items': known.astype(float),
+            'mass_kg': np.nan_to_num(mass),
+            'mass_co2e': np.where(known, co2e['calculated_co2e_a1_a3'] + co2e['calculated_co2e_a4'], 0.0),
+            'similarity_sum': np.nan_to_num(_column(chunk, 'similarity_score')),
+            **co2e,
+        }
+        for dimension, col in self.dimensions.items():
+            if col is None:
+                codes, keys = np.zeros(len(chunk), dtype=np.intp), ['']
+            elif col in chunk.columns:
+                codes, uniques = pd.factorize(chunk[col].astype(object), use_na_sentinel=False)
+                keys = [_key_label(u) for u in uniques]
+            else:
+                continue
+            part = pd.DataFrame({name: np.bincount(codes, weights=values, minlength=len(keys))
+                                 for name, values in measures.items()})
+            part.insert(0, 'key', keys)
+            part.insert(0, 'dimension', dimension)
+            self._parts.append(part)
+
+        if self.top_rows and 'Artikel' in chunk.columns:
+            rows = _top_rows(pd.DataFrame(measures, index=np.arange(self._seen, self._seen + len(chunk))),
+                             self.top_rows)
+            # Only the kept rows get their Artikel label
+            rows.insert(0, 'key', [_key_label(v) for v in chunk['Artikel'].iloc[rows.index - self._seen]])
+            rows.insert(0, 'dimension', TOP_DIMENSION)
+            self._top = rows if self._top is None else _top_rows(pd.concat([self._top, rows]), self.top_rows)
+        self._seen += len(chunk)
+
+    def result(self) -> pd.DataFrame:
+        """Rollup table (ROLLUP_COLUMNS), keys of each dimension by descending total CO₂e"""
+        return combine_rollups(self._parts + ([self._top] if self._top is not None else []),
+                               top_rows=self.top_rows)
+
+
+def combine_rollups(frames: Iterable[pd.DataFrame], top_rows: int = ROLLUP_TOP_ROWS) -> pd.DataFrame:
+    """
+    Sum rollup tables (e.g. chunk partials or the rollups of several sites)
+
+    Top rows are not summed: the rows among the top_rows highest of any
+    TOP_MEASURES are kept.
+    """
+    frames = [frame for frame in frames if len(frame)]
+    if not frames:
+        return pd.DataFrame(columns=ROLLUP_COLUMNS)
+    rollups = pd.concat(frames, ignore_index=True)
+    is_top = (rollups['dimension'] == TOP_DIMENSION).to_numpy()
+    rows = rollups[~is_top]
+    totals = rows.groupby(['dimension', 'key'], sort=False, as_index=False)[ROLLUP_MEASURES].sum()
+    # A key summed over any rollup without mass_co2e (older files) has no known-mass CO₂e
+    incomplete = rows['mass_co2e'].isna().groupby([rows['dimension'], rows['key']], sort=False).any()
+    totals['mass_co2e'] = totals['mass_co2e'].where(~incomplete.to_numpy())
+    order = list(ROLLUP_DIMENSIONS) + [TOP_DIMENSION]
+    totals['rank'] = totals['dimension'].map(order.index)
+    totals = totals.sort_values(['rank', 'total_co2e'], ascending=[True, False], kind='stable').drop(columns='rank')
+    top = _top_rows(rollups[is_top], top_rows).sort_values('calculated_co2e_a1_a3', ascending=False, kind='stable')
+    rollups = pd.concat([totals, top], ignore_index=True)[ROLLUP_COLUMNS]
+    # Report values carry 4 decimals - drop the float noise of the sums
+    int_columns = ['items', 'successful_items', 'mass_items']
+    rollups[ROLLUP_MEASURES] = rollups[ROLLUP_MEASURES].round(4)
+    rollups[int_columns] = rollups[int_columns].astype(np.int64)
+    return rollups
+
+
+def write_rollups(rollups: pd.DataFrame, path: str) -> str:
+    """Write a rollup table (semicolon CSV like the report, atomic replace)"""
+    tmp_path = f"{path}.tmp"
+    rollups.to_csv(tmp_path, sep=';', index=False, encoding='utf-8-sig')
+    os.replace(tmp_path, path)
+    logger.info(f"Rollups exported to {path} ({len(rollups)} rows)")
+    return path
+
+
+def read_rollups(path: str) -> pd.DataFrame:
+    """Load a rollup table (keys as text, measures numeric; measures missing from older files are NaN)"""
+    rollups = pd.read_csv(path, sep=';', encoding='utf-8-sig', dtype={'dimension': str, 'key': str},
+                          keep_default_na=False, float_precision='round_trip')
+    return rollups.reindex(columns=ROLLUP_COLUMNS)
+
+
+def rollup(rollups: pd.DataFrame, dimension: str) -> pd.DataFrame:
+    """Rows of one dimension indexed by key"""
+    return rollups[rollups['dimension'] == dimension].drop(columns='dimension').set_index('key')
@@ -0,0 +1,381 @@
+#!/usr/bin/env python3
+"""
+CarbonMatch - What-If Scenarios
+===============================
+
+Recomputes steps 3-5 (conversion, CO₂e, transport, totals) for many
+parameter scenarios on a persisted matched stage, without re-embedding or
+rematching anything.
+
+Usage:
+    python carbomatch_pipeline.py --save-matched       # writes carbomatch_matched.pkl
+    python carbomatch_scenarios.py scenarios.json [--by Lieferant]
+
+The matched stage records the site id and transport inputs of the run that
+saved it; the baseline uses them (override with --site, --distances,
+--geocodes, --routing-url) and is checked against the report's totals.
+
+A scenario file holds a list of scenarios (or {"scenarios": [...]}):
+
+    [
+      {"name": "baseline"},
+      {"name": "euro6 trucks", "transport": {"emission_factor": 0.0006}},
+      {"name": "thick slabs", "factors": {"area_thickness_m": {"concrete": 0.20}}},
+      {"name": "low-carbon concrete", "gwp": {"Beton C30/37": 180.0}},
+      {"name": "timber swap", "swap": {"Stahlträger": "Brettschichtholz"}}
+    ]
+
+- transport: `distances` (distance table CSV), `vehicle` (one vehicle for all
+  rows), or flat `distance_km` / `emission_factor` (kg CO₂e per kg per km)
+- factors: {table: {rule id | "default" | "formula": factor}}
+- gwp: GWP per reference unit by matched material name or UUID (swapped EPD)
+- swap: matched material -> other Ökobaudat material (needs --oekobaudat)
+
+Only rows whose recorded conversion rule changed (or whose match was
+swapped) are converted again, and conversions are shared by scenarios with
+the same factor/swap settings. CO₂e then is array arithmetic over a
+rows × scenarios matrix; the result is one comparison row per scenario
+(and group with --by).
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import logging
+from typing import Dict, List, Optional
+
+from carbomatch_lazy import lazy_import
+from carbomatch_factors import FactorTables, affected_rows
+from carbomatch_conversion import CONVERSION_COLUMNS, convert_units
+from carbomatch_co2e import calculate_frame_co2e, is_success
+from carbomatch_transport import TransportModel, load_distance_table, load_transport_model
+from carbomatch_geo import OSRMRouter
+from carbomatch_pipeline import (
+    MATCH_FIELDS, MATCHED_STAGE_FILE, CarbonMatchPipeline, configure_logging, matched_stage_settings,
+    read_matched_stage,
+)
+
+np = lazy_import("numpy")
+pd = lazy_import("pandas")
+
+logger = logging.getLogger(__name__)
+
+SCENARIO_FILE = "carbomatch_scenarios.csv"
+BASELINE_SCENARIO = "baseline"
+
+SCENARIO_KEYS = {'name', 'transport', 'factors', 'gwp', 'swap'}
+
+# Report totals the baseline scenario must reproduce (relative tolerance)
+BASELINE_COLUMNS = ['calculated_co2e_a1_a3', 'calculated_co2e_a4', 'total_co2e']
+BASELINE_TOLERANCE = 1e-6
+
+AGGREGATE_COLUMNS = [
+    'calculated_co2e_a1_a3', 'calculated_co2e_a4', 'total_co2e',
+    'delta_total_co2e', 'delta_pct', 'successful_calcs', 'co2e_intensity',
+]
+
+
+def load_scenarios(path: str) -> List[Dict]:
+    """
+    Read and check a scenario file
+
+    Raises:
+        ValueError: If a scenario has unknown keys or duplicate names
+    """
+    with open(path, encoding='utf-8') as f:
+        data = json.load(f)
+    scenarios = data['scenarios'] if isinstance(data, dict) else data
+    for i, scenario in enumerate(scenarios):
+        unknown = set(scenario) - SCENARIO_KEYS
+        if unknown:
+            raise ValueError(f"Scenario {scenario.get('name', i)} has unknown keys: {sorted(unknown)}")
+    names = [scenario.get('name', f"scenario_{i}") for i, scenario in enumerate(scenarios)]
+    if len(set(names)) != len(names):
+        raise ValueError(f"Scenario names must be unique: {names}")
+    return scenarios
+
+
+class ScenarioEngine:
+    """Evaluates parameter scenarios on a calculated matched frame"""
+
+    def __init__(self, matched_df: pd.DataFrame, tables: FactorTables, catalog: Optional[pd.DataFrame] = None,
+                 transport: Optional[TransportModel] = None, site: Optional[str] = None):
+        """
+        Args:
+            matched_df: Matched frame after calculate_all_co2e() (see
+                        CarbonMatchPipeline.save_matched_stage)
+            tables: Factor tables the frame was calculated with
+            catalog: Cleaned Ökobaudat rows (CarbonMatchPipeline.oeko_df), needed for swaps
+            transport: Baseline transport model (defaults to load_transport_model())
+            site: Site id used for distance table lookups
+        """
+        if 'conversion_rule' not in matched_df.columns:
+            raise ValueError("Matched frame has no conversion columns. Run calculate_all_co2e() first.")
+        recorded = matched_df['factor_table_version'].iloc[0] if len(matched_df) else tables.version_label
+        if recorded != tables.version_label:
+            logger.warning(f"Matched stage was calculated with factor tables {recorded}, "
+                           f"scenarios use {tables.version_label}")
+        self.base = matched_df.reset_index(drop=True)
+        self.tables = tables
+        self.catalog = catalog.drop_duplicates('Name (de)').set_index('Name (de)') if catalog is not None else None
+        self.transport = transport or load_transport_model()
+        self.site = site
+        self._conversions: Dict[str, pd.DataFrame] = {}
+
+    def matched_frame(self, scenario: Dict) -> pd.DataFrame:
+        """Matched frame with the scenario's material swaps and GWP overrides applied"""
+        frame = self.base
+        swap = scenario.get('swap') or {}
+        if swap:
+            if self.catalog is None:
+                raise ValueError("Material swaps need the Ökobaudat catalog (--oekobaudat)")
+            missing = [name for name in swap.values() if name not in self.catalog.index]
+            if missing:
+                raise ValueError(f"Swap targets not in the Ökobaudat catalog: {missing}")
+            frame = frame.copy()
+            swapped = frame['matched_material'].isin(list(swap))
+            targets = self.catalog.loc[frame.loc[swapped, 'matched_material'].map(swap)]
+            frame.loc[swapped, 'matched_material'] = targets.index.to_numpy()
+            for col, source_col in MATCH_FIELDS.items():
+                if source_col in targets.columns:
+                    frame.loc[swapped, col] = targets[source_col].to_numpy()
+
+        gwp = scenario.get('gwp') or {}
+        if gwp:
+            frame = frame.copy() if frame is self.base else frame
+            override = frame['matched_material'].map(gwp)
+            if 'matched_uuid' in frame.columns:
+                override = override.fillna(frame['matched_uuid'].map(gwp))
+            frame['matched_gwp'] = pd.to_numeric(override, errors='coerce').fillna(
+                pd.to_numeric(frame['matched_gwp'], errors='coerce'))
+        return frame
+
+    def conversions(self, scenario: Dict, frame: pd.DataFrame) -> pd.DataFrame:
+        """
+        Conversion columns under the scenario's factor overrides and swaps
+
+        Only rows whose recorded rule changed or whose match was swapped are
+        converted again; results are shared by scenarios with equal settings.
+        """
+        factors = scenario.get('factors') or {}
+        swap = scenario.get('swap') or {}
+        key = json.dumps({'factors': factors, 'swap': swap}, sort_keys=True)
+        if key in self._conversions:
+            return self._conversions[key]
+
+        conversions = self.base[CONVERSION_COLUMNS]
+        tables = self.tables.with_overrides(factors, source=f"scenario {scenario.get('name')}") if factors else self.tables
+        affected = np.zeros(len(frame), dtype=bool)
+        if factors:
+            changed = self.tables.changed_rule_labels(tables)
+            affected |= affected_rows([self.base['conversion_rule'], self.base['material_rule']], changed)
+        if swap:
+            affected |= self.base['matched_material'].isin(list(swap)).to_numpy()
+
+        if affected.any():
+            updates = convert_units(frame.loc[affected], tables)
+            conversions = conversions.copy()
+            for col in CONVERSION_COLUMNS:
+                # Categorical columns may gain categories - merge as labels
+                merged = conversions[col].astype(object)
+                merged[affected] = updates[col].astype(object).to_numpy()
+                conversions[col] = merged.infer_objects()
+            conversions['conversion_path'] = conversions['conversion_path'].astype(np.int8)
+        logger.info(f"Scenario '{scenario.get('name')}': {int(affected.sum())}/{len(frame)} rows converted again")
+        self._conversions[key] = conversions
+        return conversions
+
+    def transport_arrays(self, scenario: Dict):
+        """
+        Per-row distance and effective emission factor under the scenario
+
+        Returns:
+            (distance_km, emission_factor) float arrays
+        """
+        spec = scenario.get('transport') or {}
+        model = self.transport
+        if spec.get('distances'):
+            model = model.with_distances(load_distance_table(spec['distances']), source=spec['distances'])
+        resolved = model.resolve(self.base['Lieferant'], site=self.site)
+        distance = resolved['transport_distance_km'].to_numpy(dtype=float)
+        factor = resolved['transport_emission_factor'].to_numpy(dtype=float)
+        if 'vehicle' in spec:
+            if spec['vehicle'] not in model.vehicle_factors:
+                raise ValueError(f"Scenario '{scenario.get('name')}' uses unknown vehicle '{spec['vehicle']}'")
+            factor = np.full(len(self.base), model.vehicle_factors[spec['vehicle']])
+        if 'distance_km' in spec:
+            distance = np.full(len(self.base), float(spec['distance_km']))
+        if 'emission_factor' in spec:
+            factor = np.full(len(self.base), float(spec['emission_factor']))
+        return distance, factor
+
+    def scenario_frame(self, scenario: Dict) -> pd.DataFrame:
+        """Matched frame with steps 3-5 recomputed for one scenario (for export or inspection)"""
+        frame = self.matched_frame(scenario).copy()
+        conversions = self.conversions(scenario, frame)
+        results = calculate_frame_co2e(frame, conversions)
+        distance_km, emission_factor = self.transport_arrays(scenario)
+
+        for col in conversions.columns:
+            frame[col] = conversions[col]
+        for col in results.columns:
+            frame[col] = results[col]
+        frame['transport_distance_km'] = distance_km
+        frame['transport_emission_factor'] = emission_factor
+        frame['calculated_co2e_a4'] = frame['mass_kg'].fillna(0).to_numpy() * distance_km * emission_factor
+        frame['total_co2e'] = frame['calculated_co2e_a1_a3'] + frame['calculated_co2e_a4']
+        return frame
+
+    def evaluate(self, scenarios: List[Dict], by: Optional[str] = None) -> pd.DataFrame:
+        """
+        Compare scenarios
+
+        Args:
+            scenarios: Scenario dicts (see module docstring); the first one is the
+                       reference for the deltas (a baseline is prepended when no
+                       scenario is named 'baseline')
+            by: Optional grouping column (e.g. 'Lieferant')
+
+        Returns:
+            One row per scenario (and group) with AGGREGATE_COLUMNS
+        """
+        if not any(scenario.get('name') == BASELINE_SCENARIO for scenario in scenarios):
+            scenarios = [{'name': BASELINE_SCENARIO}] + list(scenarios)
+        names = [scenario.get('name', f"scenario_{i}") for i, scenario in enumerate(scenarios)]
+
+        # Rows × scenarios matrices
+        material = np.zeros((len(self.base), len(scenarios)))
+        success = np.zeros((len(self.base), len(scenarios)))
+        mass = np.zeros((len(self.base), len(scenarios)))
+        known_mass = np.zeros((len(self.base), len(scenarios)), dtype=bool)
+        distance = np.zeros((len(self.base), len(scenarios)))
+        emission_factor = np.zeros((len(self.base), len(scenarios)))
+        for j, scenario in enumerate(scenarios):
+            frame = self.matched_frame(scenario)
+            conversions = self.conversions(scenario, frame)
+            # Factors and swaps change row masses as well as A1-A3
+            results = calculate_frame_co2e(frame, conversions)
+            mass[:, j] = results['mass_kg'].fillna(0).to_numpy(dtype=float)
+            known_mass[:, j] = results['mass_kg'].notna().to_numpy()
+            material[:, j] = results['calculated_co2e_a1_a3'].to_numpy()
+            success[:, j] = is_success(results['calculation_code']).to_numpy()
+            distance[:, j], emission_factor[:, j] = self.transport_arrays(scenario)
+        transport_co2e = mass * distance * emission_factor
+
+        if by:
+            codes, groups = pd.factorize(self.base[by].astype(object).fillna('Unknown'))
+        else:
+            codes, groups = np.zeros(len(self.base), dtype=np.int64), pd.Index(['Project'])
+
+        def group_sums(matrix: np.ndarray) -> np.ndarray:
+            return pd.DataFrame(matrix).groupby(codes).sum().reindex(range(len(groups)), fill_value=0).to_numpy()
+
+        a1_a3, a4, successful = group_sums(material), group_sums(transport_co2e), group_sums(success)
+        mass_kg = group_sums(mass)
+        # Intensity over the known-mass rows only, as in carbomatch_summary.INTENSITY_BASIS
+        mass_co2e = group_sums(np.where(known_mass, material + transport_co2e, 0.0))
+        total = a1_a3 + a4
+        delta = total - total[:, :1]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            delta_pct = np.where(total[:, :1] != 0, delta / total[:, :1] * 100, np.nan)
+            intensity = np.where(mass_kg > 0, mass_co2e / mass_kg, np.nan)
+
+        # Long format: scenario-major, groups within a scenario
+        comparison = pd.DataFrame({
+            'scenario': np.repeat(names, len(groups)),
+            'calculated_co2e_a1_a3': a1_a3.T.ravel(),
+            'calculated_co2e_a4': a4.T.ravel(),
+            'total_co2e': total.T.ravel(),
+            'delta_total_co2e': delta.T.ravel(),
+            'delta_pct': delta_pct.T.ravel(),
+            'successful_calcs': successful.T.ravel().astype(int),
+            'co2e_intensity': intensity.T.ravel(),
+        })
+        if by:
+            comparison.insert(1, by, np.tile(np.asarray(groups, dtype=object), len(scenarios)))
+        return comparison
+
+    def baseline_mismatches(self, comparison: pd.DataFrame) -> Dict[str, tuple]:
+        """
+        Report totals the baseline scenario does not reproduce
+
+        Compares the baseline rows of an evaluate() result with the CO₂e the
+        matched stage was saved with (columns missing from older stages are
+        skipped). A mismatch means the scenarios run with other transport or
+        factor inputs than the report, so their deltas are not against it.
+
+        Returns:
+            {column: (report total, baseline total)} for totals off by more
+            than BASELINE_TOLERANCE (relative)
+        """
+        baseline = comparison[comparison['scenario'] == BASELINE_SCENARIO]
+        mismatches = {}
+        for col in BASELINE_COLUMNS:
+            if col not in self.base.columns:
+                continue
+            expected = float(pd.to_numeric(self.base[col], errors='coerce').fillna(0).sum())
+            actual = float(baseline[col].sum())
+            if not np.isclose(actual, expected, rtol=BASELINE_TOLERANCE, atol=1e-6):
+                mismatches[col] = (expected, actual)
+        return mismatches
+
+
+def main(argv: Optional[List[str]] = None):
+    """Scenario comparison entry point"""
+    parser = argparse.ArgumentParser(description="Compare CarbonMatch what-if scenarios without rematching")
+    parser.add_argument('scenarios', help="scenario JSON file")
+    parser.add_argument('--matched', default=MATCHED_STAGE_FILE,
+                        help=f"matched stage saved with --save-matched (default: {MATCHED_STAGE_FILE})")
+    parser.add_argument('--factors', default=None,
+                        help="conversion factor tables JSON (default: carbomatch_factors.json)")
+    parser.add_argument('--transport', default=None,
+                        help="transport vehicles and defaults JSON (default: carbomatch_transport.json)")
+    parser.add_argument('--distances', default=None,
+                        help="baseline supplier → site distance table CSV (default: as saved with the matched stage)")
+    parser.add_argument('--geocodes', default=None,
+                        help="supplier / site coordinates CSV (default: as saved with the matched stage)")
+    parser.add_argument('--routing-url', default=None,
+                        help="OSRM server for road distances of geocoded pairs (default: as saved with the matched stage)")
+    parser.add_argument('--site', default=None,
+                        help="site id for distance table and geocode lookups (default: as saved with the matched stage)")
+    parser.add_argument('--oekobaudat', default=None, help="Ökobaudat CSV, needed for material swaps")
+    parser.add_argument('--by', default=None, help="also break results down by this column (e.g. Lieferant)")
+    parser.add_argument('--output', default=SCENARIO_FILE, help=f"comparison CSV (default: {SCENARIO_FILE})")
+    args = parser.parse_args(argv)
+
+    configure_logging()
+    scenarios = load_scenarios(args.scenarios)
+    matched_df = read_matched_stage(args.matched)
+    # The baseline uses the report run's site and transport inputs unless overridden
+    stage = matched_stage_settings(matched_df)
+    site = args.site if args.site is not None else stage.get('site')
+    routing_url = args.routing_url or stage.get('routing_url')
+    pipeline = CarbonMatchPipeline(site_id=site, factors_path=args.factors,
+                                   transport_path=args.transport or stage.get('transport'),
+                                   distances_path=args.distances or stage.get('distances'),
+                                   geocodes_path=args.geocodes or stage.get('geocodes'),
+                                   router=OSRMRouter(routing_url) if routing_url else None)
+    pipeline.matched_df = matched_df
+    if args.oekobaudat:
+        pipeline.load_catalog(args.oekobaudat)
+
+    engine = ScenarioEngine(pipeline.matched_df, pipeline.factor_tables, catalog=pipeline.oeko_df,
+                            transport=pipeline.transport_model, site=site)
+    comparison = engine.evaluate(scenarios, by=args.by)
+    comparison.round(4).to_csv(args.output, sep=';', index=False, encoding='utf-8-sig')
+    pipeline.save_route_cache()
+
+    totals = comparison.groupby('scenario', sort=False)[['total_co2e', 'delta_total_co2e']].sum()
+    print(f"\n🔀 SCENARIO COMPARISON ({len(totals)} scenarios)")
+    for name, row in totals.iterrows():
+        print(f"   • {name:<30} {row['total_co2e']:>18,.2f} kg CO₂e ({row['delta_total_co2e']:+,.2f})")
+    for col, (expected, actual) in engine.baseline_mismatches(comparison).items():
+        logger.warning(f"Baseline {col} {actual:,.2f} differs from the matched stage's {expected:,.2f}")
+        print(f"   ⚠️  Baseline {col} is {actual:,.2f}, the report has {expected:,.2f} "
+              f"- deltas are not against the report (check --site / --distances / --geocodes)")
+    print(f"\n📄 Comparison exported to: {args.output}")
+
+
+if __name__ == "__main__":
+    main()
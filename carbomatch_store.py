@@ -0,0 +1,285 @@
+#!/usr/bin/env python3
+"""
+CarbonMatch - Report Store
+==========================
+
+Embedded SQLite database (`carbomatch_reports.db`) holding the report rows
+of every site, so portfolio questions are indexed queries instead of reading
+and filtering each report file:
+
+    python carbomatch_store.py query --where "Lieferant==Sülzle Stahlpartner GmbH" \
+        --where "matched_category~%Betonstahl%" --group-by site
+
+- `report_rows`: STORE_COLUMNS (`site` and the report columns, including the
+  Ökobaudat `matched_uuid`) with SQLite types - REAL values, INTEGER codes, TEXT labels
+- indexes on site, supplier (+ site), Ökobaudat UUID and status code
+- `store_runs`: one row per site with the last load (time, rows, report path,
+  factor table version)
+
+A run replaces its site's rows in one transaction; other sites are kept. The
+database uses WAL journaling, so the dashboard can read while a run loads.
+ReportStore.query() returns rows, ReportStore.aggregate() grouped sums; both
+take filters as (column, op, value) tuples like carbomatch_report.read_report.
+"""
+
+from __future__ import annotations
+
+import argparse
+import logging
+import os
+import sqlite3
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+from carbomatch_lazy import lazy_import
+from carbomatch_co2e import CALC_SUCCESS
+from carbomatch_report import (
+    CODE_COLUMNS, FLOAT_COLUMNS, REPORT_CHUNK_ROWS, REPORT_COLUMNS, SITE_COLUMN, round_report,
+)
+
+pd = lazy_import("pandas")
+
+logger = logging.getLogger(__name__)
+
+STORE_FILE = "carbomatch_reports.db"
+ROWS_TABLE = 'report_rows'
+RUNS_TABLE = 'store_runs'
+
+STORE_COLUMNS = [SITE_COLUMN, *REPORT_COLUMNS]
+
+# Index name -> indexed columns
+STORE_INDEXES = {
+    'idx_rows_site': [SITE_COLUMN],
+    'idx_rows_supplier': ['Lieferant', SITE_COLUMN],
+    'idx_rows_uuid': ['matched_uuid'],
+    'idx_rows_status': ['calculation_code'],
+}
+
+# Aggregate name -> SQL expression
+STORE_MEASURES = {
+    'items': 'COUNT(*)',
+    'successful_items': f'SUM(calculation_code = {CALC_SUCCESS})',
+    'mass_kg': 'SUM(mass_kg)',
+    'calculated_co2e_a1_a3': 'SUM(calculated_co2e_a1_a3)',
+    'calculated_co2e_a4': 'SUM(calculated_co2e_a4)',
+    'total_co2e': 'SUM(total_co2e)',
+}
+
+# Filter operators -> SQL ('in' takes a list of values)
+FILTER_OPERATORS = {'==': '=', '!=': '!=', '<': '<', '<=': '<=', '>': '>', '>=': '>=', 'like': 'LIKE', 'in': 'IN'}
+# Operators of --where expressions, longest first ('~' is LIKE)
+WHERE_OPERATORS = [('==', '=='), ('!=', '!='), ('<=', '<='), ('>=', '>='), ('~', 'like'), ('<', '<'), ('>', '>')]
+
+
+def _column_type(col: str) -> str:
+    if col in FLOAT_COLUMNS:
+        return 'REAL'
+    if col in CODE_COLUMNS:
+        return 'INTEGER'
+    return 'TEXT'
+
+
+def _quote(col: str) -> str:
+    """Quoted SQL identifier of a store column (rejects unknown columns)"""
+    if col not in STORE_COLUMNS:
+        raise ValueError(f"Unknown report store column: {col}")
+    return '"' + col.replace('"', '""') + '"'
+
+
+def _where(filters) -> Tuple[str, List]:
+    """SQL WHERE clause and parameters for (column, op, value) filters"""
+    clauses, params = [], []
+    for col, op, value in filters or []:
+        if op not in FILTER_OPERATORS:
+            raise ValueError(f"Unsupported report store filter: {op}")
+        if op == 'in':
+            values = list(value)
+            clauses.append(f"{_quote(col)} IN ({', '.join('?' * len(values))})")
+            params.extend(values)
+        else:
+            clauses.append(f"{_quote(col)} {FILTER_OPERATORS[op]} ?")
+            params.append(value)
+    return (' WHERE ' + ' AND '.join(clauses)) if clauses else '', params
+
+
+def parse_where(expression: str) -> Tuple[str, str, object]:
+    """
+    Filter tuple of a command line expression
+
+    `Lieferant==Sülzle`, `matched_category~%Betonstahl%` (LIKE),
+    `total_co2e>=1000`; values of numeric columns are converted to numbers.
+    """
+    for token, op in WHERE_OPERATORS:
+        col, found, value = expression.partition(token)
+        if found:
+            col = col.strip()
+            if col in FLOAT_COLUMNS or col in CODE_COLUMNS:
+                value = float(value) if col in FLOAT_COLUMNS else int(value)
+            return col, op, value
+    raise ValueError(f"Cannot parse filter expression: {expression!r}")
+
+
+class ReportStore:
+    """SQLite store of report rows, indexed by site, supplier, Ökobaudat UUID and status"""
+
+    def __init__(self, path: str = STORE_FILE):
+        self.path = path
+        conn = self._connect()
+        try:
+            with conn:
+                columns = ', '.join(f"{_quote(col)} {_column_type(col)}" for col in STORE_COLUMNS)
+                conn.execute(f"CREATE TABLE IF NOT EXISTS {ROWS_TABLE} ({columns})")
+                for name, cols in STORE_INDEXES.items():
+                    conn.execute(f"CREATE INDEX IF NOT EXISTS {name} ON {ROWS_TABLE} ({', '.join(map(_quote, cols))})")
+                conn.execute(f"CREATE TABLE IF NOT EXISTS {RUNS_TABLE} (site TEXT PRIMARY KEY, loaded_at TEXT, "
+                             f"rows INTEGER, report TEXT, factor_table_version TEXT)")
+        finally:
+            conn.close()
+
+    def _connect(self) -> sqlite3.Connection:
+        # Writers of parallel sites wait for each other instead of failing
+        conn = sqlite3.connect(self.path, timeout=300)
+        conn.execute("PRAGMA journal_mode=WAL")
+        # WAL stays consistent without a sync per commit; a larger page cache speeds up index updates
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute("PRAGMA cache_size=-262144")
+        return conn
+
+    def replace_site(self, site: str, frames: Iterable[pd.DataFrame], report: str = '',
+                     factor_table_version: str = '', chunk_rows: int = REPORT_CHUNK_ROWS) -> int:
+        """
+        Replace a site's rows with the given report rows (one transaction)
+
+        Args:
+            site: Site id ('' for runs without one)
+            frames: Frames holding the report columns (e.g. previous and new rows)
+            report: Report path recorded for the load
+            factor_table_version: Factor table version recorded for the load
+            chunk_rows: Rows converted and inserted per batch
+
+        Returns:
+            Number of rows stored
+        """
+        columns = STORE_COLUMNS[1:]
+        insert = (f"INSERT INTO {ROWS_TABLE} ({', '.join(map(_quote, STORE_COLUMNS))}) "
+                  f"VALUES ({', '.join('?' * len(STORE_COLUMNS))})")
+        rows = 0
+        conn = self._connect()
+        try:
+            with conn:
+                conn.execute(f"DELETE FROM {ROWS_TABLE} WHERE site = ?", (site,))
+                for frame in frames:
+                    for start in range(0, len(frame), chunk_rows):
+                        chunk = round_report(frame.iloc[start:start + chunk_rows].reindex(columns=columns))
+                        # Python values per column; NaN / NA become NULL
+                        values = [chunk[col].astype(object).where(chunk[col].notna(), None).tolist()
+                                  for col in columns]
+                        conn.executemany(insert, zip([site] * len(chunk), *values))
+                        rows += len(chunk)
+                conn.execute(f"INSERT OR REPLACE INTO {RUNS_TABLE} VALUES (?, ?, ?, ?, ?)",
+                             (site, datetime.now().isoformat(timespec='seconds'), rows, report,
+                              factor_table_version))
+        finally:
+            conn.close()
+        logger.info(f"Stored {rows:,} report rows of site {site or '(none)'} in {self.path}")
+        return rows
+
+    def _read(self, sql: str, params: Sequence = ()) -> pd.DataFrame:
+        conn = self._connect()
+        try:
+            return pd.read_sql_query(sql, conn, params=list(params))
+        finally:
+            conn.close()
+
+    def runs(self) -> pd.DataFrame:
+        """Last load per site"""
+        return self._read(f"SELECT * FROM {RUNS_TABLE} ORDER BY site")
+
+    def values(self, column: str, filters=None) -> List:
+        """Distinct values of a column (e.g. suppliers for a filter list)"""
+        where, params = _where(filters)
+        sql = f"SELECT DISTINCT {_quote(column)} FROM {ROWS_TABLE}{where} ORDER BY 1"
+        return self._read(sql, params).iloc[:, 0].tolist()
+
+    def query(self, columns: Optional[Sequence[str]] = None, filters=None, limit: Optional[int] = None) -> pd.DataFrame:
+        """
+        Report rows matching all filters
+
+        Args:
+            columns: Columns to return (default STORE_COLUMNS)
+            filters: (column, op, value) tuples, op one of FILTER_OPERATORS,
+                     e.g. [('Lieferant', '==', 'Sülzle'), ('matched_category', 'like', '%Betonstahl%')]
+            limit: Maximum number of rows
+        """
+        where, params = _where(filters)
+        sql = f"SELECT {', '.join(map(_quote, columns or STORE_COLUMNS))} FROM {ROWS_TABLE}{where}"
+        if limit is not None:
+            sql += f" LIMIT {int(limit)}"
+        return self._read(sql, params)
+
+    def aggregate(self, group_by: Sequence[str] = (SITE_COLUMN,), filters=None,
+                  measures: Optional[Dict[str, str]] = None) -> pd.DataFrame:
+        """
+        Grouped sums of the rows matching all filters (see query for filters)
+
+        Args:
+            group_by: Grouping columns (empty for one total row)
+            measures: Result column -> SQL aggregate (default STORE_MEASURES)
+
+        Returns:
+            One row per group, ordered by descending total CO₂e when measured
+        """
+        measures = STORE_MEASURES if measures is None else measures
+        where, params = _where(filters)
+        groups = [_quote(col) for col in group_by]
+        select = groups + [f'{expression} AS "{name}"' for name, expression in measures.items()]
+        sql = f"SELECT {', '.join(select)} FROM {ROWS_TABLE}{where}"
+        if groups:
+            sql += f" GROUP BY {', '.join(groups)}"
+            sql += ' ORDER BY "total_co2e" DESC' if 'total_co2e' in measures else f" ORDER BY {', '.join(groups)}"
+        return self._read(sql, params)
+
+
+def main(argv: Optional[List[str]] = None):
+    """Report store query entry point"""
+    parser = argparse.ArgumentParser(description="Query the CarbonMatch report store")
+    parser.add_argument('--db', default=STORE_FILE, help=f"report store database (default: {STORE_FILE})")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    subparsers.add_parser('runs', help="sites in the store with their last load")
+
+    query_parser = subparsers.add_parser('query', help="filtered rows or grouped totals")
+    query_parser.add_argument('--where', action='append', default=[], metavar='EXPR',
+                              help="filter like Lieferant==X, matched_category~%%Beton%%, total_co2e>=1000 (repeatable)")
+    query_parser.add_argument('--group-by', type=lambda value: [col.strip() for col in value.split(',') if col.strip()],
+                              default=None, metavar='COLUMNS', help="aggregate by these columns (e.g. site,Lieferant)")
+    query_parser.add_argument('--total', action='store_true', help="aggregate all matching rows into one total")
+    query_parser.add_argument('--columns', default=None, help="comma-separated columns of listed rows")
+    query_parser.add_argument('--limit', type=int, default=50, help="maximum listed rows (default: 50)")
+    query_parser.add_argument('--output', default=None, help="also export the result as CSV")
+    args = parser.parse_args(argv)
+
+    if not os.path.exists(args.db):
+        parser.error(f"report store {args.db} does not exist - run the pipeline with --store first")
+    store = ReportStore(args.db)
+
+    if args.command == 'runs':
+        result = store.runs()
+        print(f"🗄️  Report store {args.db}: {len(result)} site(s), {int(result['rows'].sum()):,} rows")
+    else:
+        filters = [parse_where(expression) for expression in args.where]
+        if args.group_by or args.total:
+            result = store.aggregate(group_by=args.group_by or [], filters=filters)
+        else:
+            columns = [col.strip() for col in args.columns.split(',')] if args.columns else [
+                SITE_COLUMN, 'Lieferant', 'Artikel', 'matched_material', 'calculation_code', 'total_co2e']
+            result = store.query(columns=columns, filters=filters, limit=args.limit)
+        print(f"🔎 {len(result):,} result row(s)")
+    print(result.to_string(index=False))
+    if getattr(args, 'output', None):
+        result.to_csv(args.output, sep=';', index=False, encoding='utf-8-sig')
+        print(f"\n📄 Result exported to: {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,134 @@
+#!/usr/bin/env python3
+"""
+CarbonMatch - Report Summary
+============================
+
+The project figures of a report as one small object: totals, success rate,
+intensity, material-to-transport ratio, status counts and top contributors.
+It is derived from the report rollups (carbomatch_rollup) - the single pass
+over the rows has already happened - returned by the pipeline and written as
+JSON next to the report (`carbomatch_report.summary.json`), so the
+dashboard, alerting and portfolio rollups read it without touching rows.
+
+Keys follow the dashboard KPIs:
+
+    total_items, successful_items, failed_items, success_rate (%),
+    known_mass_items, known_mass_pct (%), total_mass_kg, mass_co2e,
+    material_co2e (A1-A3), transport_co2e (A4), total_co2e, material_pct (%),
+    intensity (kg CO₂e per kg, see INTENSITY_BASIS; None without known
+    masses or for rollups without mass_co2e), intensity_basis, material_transport_ratio (None
+    without A4),
+    avg_similarity, status_counts {label: items},
+    top_contributors [{Artikel, total_co2e}]
+
+plus `format`, `generated_at` and the metadata passed to summarize()
+(site, report path, factor table version).
+"""
+
+from __future__ import annotations
+
+import json
+import logging
+import math
+import os
+from datetime import datetime
+from typing import Dict, Optional
+
+from carbomatch_lazy import lazy_import
+from carbomatch_co2e import CALCULATION_CODE_LABELS
+from carbomatch_report import strip_compression
+from carbomatch_rollup import TOP_DIMENSION, rollup
+
+pd = lazy_import("pandas")
+
+logger = logging.getLogger(__name__)
+
+SUMMARY_FORMAT = 2
+SUMMARY_SUFFIX = ".summary.json"
+SUMMARY_TOP_CONTRIBUTORS = 5
+
+# Rows without a known mass have CO₂e but no weight, so both sides of the
+# intensity cover only the known-mass rows (rollup measure mass_co2e)
+INTENSITY_BASIS = "A1-A3 + A4 CO₂e of the rows with known mass / their mass_kg"
+
+
+def summary_path(report_path: str) -> str:
+    """Summary file written next to a report (`carbomatch_report.csv` -> `carbomatch_report.summary.json`)"""
+    return os.path.splitext(strip_compression(report_path.rstrip(os.sep)))[0] + SUMMARY_SUFFIX
+
+
+def _number(value) -> Optional[float]:
+    """Plain float for JSON (None for NaN / infinite values)"""
+    value = float(value)
+    return value if math.isfinite(value) else None
+
+
+def _status_label(code: str) -> str:
+    return CALCULATION_CODE_LABELS.get(int(code), code) if code else 'Unknown'
+
+
+def summarize(rollups: pd.DataFrame, top_n: int = SUMMARY_TOP_CONTRIBUTORS, **metadata) -> Dict:
+    """
+    Project summary from a rollup table (constant time in the report rows)
+
+    Args:
+        rollups: Rollup table (carbomatch_rollup.ROLLUP_COLUMNS); needs the
+                 project dimension, status and top rows are optional
+        top_n: Number of top contributors by total CO₂e
+        **metadata: Extra entries stored with the summary (e.g. site='A')
+
+    Returns:
+        JSON-serializable dict (keys see module docstring)
+    """
+    projects = rollup(rollups, 'project')
+    project = projects.iloc[0] if len(projects) else pd.Series(0.0, index=rollups.columns.drop(['dimension', 'key']))
+    total_items = int(project['items'])
+    successful_items = int(project['successful_items'])
+    mass_kg = float(project['mass_kg'])
+    mass_co2e = float(project['mass_co2e'])
+    material = float(project['calculated_co2e_a1_a3'])
+    transport = float(project['calculated_co2e_a4'])
+    total = float(project['total_co2e'])
+    status = rollup(rollups, 'status').sort_values('items', ascending=False, kind='stable')
+    top = rollup(rollups, TOP_DIMENSION).nlargest(top_n, 'total_co2e')
+
+    return {
+        'format': SUMMARY_FORMAT,
+        'generated_at': datetime.now().isoformat(timespec='seconds'),
+        **metadata,
+        'total_items': total_items,
+        'successful_items': successful_items,
+        'failed_items': total_items - successful_items,
+        'success_rate': successful_items / total_items * 100 if total_items else 0.0,
+        'known_mass_items': int(project['mass_items']),
+        'known_mass_pct': int(project['mass_items']) / total_items * 100 if total_items else 0.0,
+        'total_mass_kg': mass_kg,
+        'mass_co2e': _number(mass_co2e),
+        'material_co2e': material,
+        'transport_co2e': transport,
+        'total_co2e': total,
+        'material_pct': material / total * 100 if total > 0 else 0.0,
+        'intensity': _number(mass_co2e / mass_kg) if mass_kg > 0 else None,
+        'intensity_basis': INTENSITY_BASIS,
+        'material_transport_ratio': material / transport if transport > 0 else None,
+        'avg_similarity': _number(project['similarity_sum'] / total_items) if total_items else None,
+        'status_counts': {_status_label(code): int(items) for code, items in status['items'].items()},
+        'top_contributors': [{'Artikel': artikel, 'total_co2e': _number(value)}
+                             for artikel, value in top['total_co2e'].items()],
+    }
+
+
+def write_summary(summary: Dict, path: str) -> str:
+    """Write a summary as JSON (atomic replace)"""
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(summary, f, ensure_ascii=False, indent=2)
+    os.replace(tmp_path, path)
+    logger.info(f"Summary exported to {path}")
+    return path
+
+
+def read_summary(path: str) -> Dict:
+    """Load a summary written by write_summary()"""
+    with open(path, encoding='utf-8') as f:
+        return json.load(f)
@@ -0,0 +1,269 @@
+#!/usr/bin/env python3
+"""
+CarbonMatch - Transport Model (A4)
+==================================
+
+Transport CO₂e per delivery row from a supplier → site distance table and
+vehicle emission factors, instead of one flat distance and factor.
+
+- Vehicles (`carbomatch_transport.json`): emission factor in kg CO₂e per kg
+  per km at full load, load factor and empty return share. The effective
+  factor is `emission_factor / load_factor × (1 + empty_return)`.
+- Distance table (`carbomatch_distances.csv`, semicolon-separated):
+  `Lieferant;site;distance_km;vehicle`. An empty `site` applies to every
+  site, an empty `vehicle` uses the default vehicle.
+- Geocodes (`carbomatch_geocodes.csv`, see carbomatch_geo): pairs without a
+  site entry get a routed or geodesic (haversine × road detour) distance.
+
+Rows are resolved per distinct (supplier, site) pair - site-specific entry,
+routed / geodesic distance, supplier entry, then the configured default - by
+joining on integer codes, and the chosen level is recorded in
+`distance_source`. Changing the distance
+table only repeats those joins, so A4 of a whole portfolio is recomputed in
+milliseconds (`python carbomatch_bench.py transport`).
+"""
+
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+from typing import Dict, Optional
+
+from carbomatch_lazy import lazy_import
+from carbomatch_geo import (
+    DEFAULT_DETOUR_FACTOR, GEOCODES_FILE, ROUTE_CACHE_FILE, GeoDistances, RouteCache, RoutingService, load_geocodes,
+)
+
+np = lazy_import("numpy")
+pd = lazy_import("pandas")
+
+TRANSPORT_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "carbomatch_transport.json")
+DISTANCES_FILE = "carbomatch_distances.csv"
+
+# Where a row's distance came from
+DISTANCE_SITE = 'site'            # supplier entry for this site
+DISTANCE_ROUTED = 'routed'        # routing service (memoized in carbomatch_routes.json)
+DISTANCE_GEODESIC = 'geodesic'    # haversine between geocodes × road detour factor
+DISTANCE_SUPPLIER = 'supplier'    # supplier entry for all sites
+DISTANCE_DEFAULT = 'default'      # default_distance_km
+DISTANCE_SOURCES = [DISTANCE_SITE, DISTANCE_ROUTED, DISTANCE_GEODESIC, DISTANCE_SUPPLIER, DISTANCE_DEFAULT]
+
+DISTANCE_COLUMNS = ['Lieferant', 'site', 'distance_km', 'vehicle']
+TRANSPORT_COLUMNS = ['transport_distance_km', 'distance_source', 'transport_vehicle',
+                     'transport_emission_factor', 'calculated_co2e_a4']
+
+
+def load_distance_table(path: str) -> pd.DataFrame:
+    """
+    Read and check a supplier → site distance table
+
+    Raises:
+        ValueError: If columns are missing, distances are not positive numbers
+                    or a (supplier, site) pair occurs twice
+    """
+    table = pd.read_csv(path, sep=';', dtype=str, encoding='utf-8-sig', keep_default_na=False)
+    for col in ['site', 'vehicle']:
+        if col not in table.columns:
+            table[col] = ''
+    missing = [col for col in ['Lieferant', 'distance_km'] if col not in table.columns]
+    if missing:
+        raise ValueError(f"Distance table {path} is missing columns: {missing}")
+    table = table[DISTANCE_COLUMNS].copy()
+    table['distance_km'] = pd.to_numeric(table['distance_km'].str.replace(',', '.', regex=False), errors='coerce')
+    invalid = ~(table['distance_km'] >= 0)
+    if invalid.any():
+        raise ValueError(f"Distance table {path} has invalid distances for: {sorted(table.loc[invalid, 'Lieferant'])}")
+    duplicated = table.duplicated(['Lieferant', 'site'])
+    if duplicated.any():
+        raise ValueError(f"Distance table {path} lists suppliers twice: {sorted(table.loc[duplicated, 'Lieferant'])}")
+    return table
+
+
+class TransportModel:
+    """Vehicle factors plus the supplier → site distance table"""
+
+    def __init__(self, config: Dict, distances: Optional[pd.DataFrame] = None, source: str = "",
+                 geo: Optional[GeoDistances] = None):
+        """
+        Args:
+            config: Parsed transport configuration (see carbomatch_transport.json)
+            distances: Distance table (see load_distance_table), None for defaults only
+            source: Where the configuration came from (for messages)
+            geo: Geocoded pair distances for pairs without a site entry
+
+        Raises:
+            ValueError: If a vehicle is malformed or the table names unknown vehicles
+        """
+        self.source = source
+        self.config = config
+        self.version = str(config.get('version', 'unversioned'))
+        self.default_distance_km = float(config['default_distance_km'])
+        self.default_vehicle = config['default_vehicle']
+        self.vehicles = config['vehicles']
+        self.geo = geo
+        if self.default_vehicle not in self.vehicles:
+            raise ValueError(f"Transport configuration {source}: unknown default vehicle '{self.default_vehicle}'")
+
+        self.vehicle_factors: Dict[str, float] = {}
+        for name, vehicle in self.vehicles.items():
+            load_factor = float(vehicle.get('load_factor', 1.0))
+            if not 0 < load_factor <= 1:
+                raise ValueError(f"Vehicle '{name}' needs a load_factor in (0, 1], got {load_factor}")
+            self.vehicle_factors[name] = (float(vehicle['emission_factor']) / load_factor
+                                          * (1 + float(vehicle.get('empty_return', 0.0))))
+
+        self.vehicle_names = list(self.vehicle_factors)
+        self.factor_array = np.array([self.vehicle_factors[name] for name in self.vehicle_names])
+
+        self.distances = distances if distances is not None else pd.DataFrame(columns=DISTANCE_COLUMNS)
+        vehicle = self.distances['vehicle'].astype(object)
+        vehicle_codes = pd.Categorical(vehicle.where(vehicle != '', self.default_vehicle),
+                                       categories=self.vehicle_names).codes
+        if (vehicle_codes < 0).any():
+            raise ValueError(f"Distance table uses unknown vehicles: {sorted(pd.unique(vehicle[vehicle_codes < 0]))}")
+
+        # Entry arrays with the configured default appended, so entry -1 means "default"
+        default_code = self.vehicle_names.index(self.default_vehicle)
+        self.entry_km = np.append(pd.to_numeric(self.distances['distance_km']).to_numpy(dtype=float),
+                                  self.default_distance_km)
+        self.entry_vehicle = np.append(vehicle_codes, default_code).astype(np.int64)
+        self.entry_is_supplier = (self.distances['site'].astype(object) == '').to_numpy()
+
+        digest = hashlib.sha256(json.dumps(config, sort_keys=True).encode('utf-8'))
+        digest.update(pd.util.hash_pandas_object(self.distances, index=False).to_numpy().tobytes())
+        if geo is not None:
+            digest.update(pd.util.hash_pandas_object(geo.geocodes, index=False).to_numpy().tobytes())
+            digest.update((geo.router.name if geo.router else '').encode('utf-8'))
+        self.digest = digest.hexdigest()
+
+    @property
+    def version_label(self) -> str:
+        """Version plus short content hash of configuration and distance table"""
+        return f"{self.version}+{self.digest[:8]}"
+
+    def with_distances(self, distances: pd.DataFrame, source: str = "") -> 'TransportModel':
+        """Same vehicles and geocodes with another distance table"""
+        return TransportModel(self.config, distances, source=source or self.source, geo=self.geo)
+
+    def resolve(self, lieferant: pd.Series, site=None) -> pd.DataFrame:
+        """
+        Distance, source, vehicle and effective factor per row
+
+        Args:
+            lieferant: Supplier per row
+            site: Site id (scalar, per-row Series, or None for single-site runs)
+
+        Returns:
+            Frame with transport_distance_km, distance_source (categorical),
+            transport_vehicle (categorical) and transport_emission_factor,
+            aligned with lieferant.index
+        """
+        # One lookup per distinct (supplier, site) pair, gathered back through the codes
+        supplier_codes, suppliers = pd.factorize(lieferant, use_na_sentinel=False)
+        if isinstance(site, pd.Series):
+            site_codes, sites = pd.factorize(site, use_na_sentinel=False)
+        else:
+            site_codes, sites = np.zeros(len(lieferant), dtype=np.int64), pd.Index(['' if site is None else site])
+        n_sites = len(sites)
+        codes, pair_codes = pd.factorize(supplier_codes.astype(np.int64) * n_sites + site_codes)
+
+        # Table entries located by integer codes instead of string joins
+        entry_suppliers = suppliers.get_indexer(self.distances['Lieferant'])
+        entry_sites = sites.get_indexer(self.distances['site'])
+
+        supplier_entry = np.full(len(suppliers), -1)
+        known = self.entry_is_supplier & (entry_suppliers >= 0)
+        supplier_entry[entry_suppliers[known]] = np.flatnonzero(known)
+        supplier_entry = supplier_entry[pair_codes // n_sites]
+
+        site_entry = np.full(len(pair_codes), -1)
+        known = ~self.entry_is_supplier & (entry_suppliers >= 0) & (entry_sites >= 0)
+        positions = pd.Index(pair_codes).get_indexer(entry_suppliers[known] * n_sites + entry_sites[known])
+        site_entry[positions[positions >= 0]] = np.flatnonzero(known)[positions >= 0]
+
+        # Geocoded distance for pairs without a site entry
+        geo_km = np.full(len(pair_codes), np.nan)
+        routed = np.zeros(len(pair_codes), dtype=bool)
+        if self.geo is not None:
+            need = np.flatnonzero(site_entry < 0)
+            geo_km[need], routed[need] = self.geo.pair_distances(
+                np.asarray(suppliers, dtype=object)[pair_codes[need] // n_sites],
+                np.asarray(sites, dtype=object)[pair_codes[need] % n_sites])
+        has_geo = ~np.isnan(geo_km)
+
+        # Vehicle from the site or supplier entry even when the distance is geocoded
+        entry = np.where(site_entry >= 0, site_entry, supplier_entry)
+        has_site = site_entry >= 0
+        source = np.select([has_site, has_geo & routed, has_geo, supplier_entry >= 0], [0, 1, 2, 3], 4).astype(np.int8)
+        distance = np.where(has_geo & ~has_site, geo_km, self.entry_km[entry])
+        vehicle_codes = self.entry_vehicle[entry]
+
+        return pd.DataFrame({
+            'transport_distance_km': distance[codes],
+            'distance_source': pd.Categorical.from_codes(source[codes], categories=DISTANCE_SOURCES),
+            'transport_vehicle': pd.Categorical.from_codes(vehicle_codes[codes], categories=self.vehicle_names),
+            'transport_emission_factor': self.factor_array[vehicle_codes][codes],
+        }, index=lieferant.index)
+
+    def apply(self, lieferant: pd.Series, mass_kg: pd.Series, site=None) -> pd.DataFrame:
+        """
+        Transport CO₂e (A4) per row
+
+        Args:
+            lieferant: Supplier per row
+            mass_kg: Transported mass per row
+            site: Site id (scalar, per-row Series, or None)
+
+        Returns:
+            Frame with TRANSPORT_COLUMNS aligned with lieferant.index
+        """
+        transport = self.resolve(lieferant, site)
+        transport['calculated_co2e_a4'] = (mass_kg.to_numpy(dtype=float)
+                                           * transport['transport_distance_km'].to_numpy()
+                                           * transport['transport_emission_factor'].to_numpy())
+        return transport
+
+
+_LOADED: Dict[tuple, TransportModel] = {}
+
+
+def load_transport_model(path: Optional[str] = None, distances_path: Optional[str] = None,
+                         geocodes_path: Optional[str] = None, router: Optional[RoutingService] = None,
+                         route_cache_path: str = ROUTE_CACHE_FILE) -> TransportModel:
+    """
+    Load the transport configuration, distance table and geocodes (once per file version)
+
+    Args:
+        path: JSON transport configuration (defaults to carbomatch_transport.json
+              next to this module)
+        distances_path: Distance table CSV (defaults to carbomatch_distances.csv
+                        in the working directory, if present)
+        geocodes_path: Geocode table CSV (defaults to carbomatch_geocodes.csv in
+                       the working directory, if present)
+        router: Routing service for geocoded pairs, None for geodesic distances
+        route_cache_path: Persisted route memo loaded when a router is given
+
+    Returns:
+        TransportModel
+    """
+    path = os.path.abspath(path or TRANSPORT_FILE)
+    if distances_path is None and os.path.exists(DISTANCES_FILE):
+        distances_path = DISTANCES_FILE
+    if geocodes_path is None and os.path.exists(GEOCODES_FILE):
+        geocodes_path = GEOCODES_FILE
+    files = [path] + [os.path.abspath(p) for p in (distances_path, geocodes_path) if p]
+    key = tuple((f, os.stat(f).st_mtime_ns) for f in files) + (router.name if router else None,)
+    if key not in _LOADED:
+        with open(path, encoding='utf-8') as f:
+            config = json.load(f)
+        distances = load_distance_table(distances_path) if distances_path else None
+        geo = None
+        if geocodes_path:
+            cache = RouteCache()
+            if router is not None:
+                cache.load(route_cache_path)
+            geo = GeoDistances(load_geocodes(geocodes_path),
+                               float(config.get('road_detour_factor', DEFAULT_DETOUR_FACTOR)), router, cache)
+        _LOADED[key] = TransportModel(config, distances, source=" + ".join(files), geo=geo)
+    return _LOADED[key]
@@ -0,0 +1,343 @@
+#!/usr/bin/env python3
+"""
+CarbonMatch - Monte Carlo Uncertainty
+=====================================
+
+Propagates the uncertainty behind the material CO₂e point estimate:
+
+- conversion factors: layer thicknesses, piece weights and weights per metre
+  vary by how they were obtained (table default, keyword rule, DIN value
+  table, formula - see the rule recorded in `conversion_rule`)
+- GWP values of the matched Ökobaudat entries
+- the match itself: each draw picks one of the top-k catalog candidates
+  with softmax(similarity / temperature) probabilities
+
+Draws are made per distinct Artikel (one seeded generator per article), so
+all deliveries of an article share their factor, GWP and match draw and
+totals keep that correlation. Rows × samples are evaluated as NumPy arrays
+in row blocks of at most `block_elements` values; per-row percentiles are
+taken per block while supplier and project totals are accumulated per
+sample. Results are reproducible for a given seed regardless of block size.
+"""
+
+from __future__ import annotations
+
+import json
+import logging
+from typing import Dict, List, Optional, Tuple
+
+from carbomatch_lazy import lazy_import
+from carbomatch_dimensions import DIMENSION_COLUMNS
+from carbomatch_factors import DEFAULT_RULE_ID, FORMULA_RULE_ID, FactorTables
+from carbomatch_conversion import convert_units
+from carbomatch_co2e import calculate_frame_co2e
+
+np = lazy_import("numpy")
+pd = lazy_import("pandas")
+
+logger = logging.getLogger(__name__)
+
+UNCERTAINTY_FILE = "carbomatch_uncertainty.csv"
+UNCERTAINTY_SUMMARY_FILE = "carbomatch_uncertainty_summary.csv"
+
+PERCENTILES = [5, 50, 95]
+PERCENTILE_COLUMNS = [f"co2e_a1_a3_p{p}" for p in PERCENTILES]
+
+# Distribution codes; `spread` is sigma of ln(multiplier) for lognormal and
+# the relative half-width for uniform / triangular (multiplier in 1 ± spread)
+DIST_LOGNORMAL = 0
+DIST_UNIFORM = 1
+DIST_TRIANGULAR = 2
+DISTRIBUTIONS = {'lognormal': DIST_LOGNORMAL, 'uniform': DIST_UNIFORM, 'triangular': DIST_TRIANGULAR}
+
+# Factor sources, derived from the rule label of each converted row
+SOURCE_NONE = 'none'          # kg / m³ rows - no conversion factor involved
+SOURCE_DEFAULT = 'default'    # table default (nothing matched)
+SOURCE_KEYWORD = 'keyword'    # keyword rule
+SOURCE_VALUE = 'value'        # value table keyed on an extracted dimension (DIN rebar / mesh)
+SOURCE_FORMULA = 'formula'    # formula on an extracted dimension
+
+DEFAULT_UNCERTAINTY = {
+    'factors': {
+        SOURCE_NONE: {'distribution': 'lognormal', 'spread': 0.0},
+        SOURCE_DEFAULT: {'distribution': 'lognormal', 'spread': 0.5},
+        SOURCE_KEYWORD: {'distribution': 'lognormal', 'spread': 0.25},
+        SOURCE_VALUE: {'distribution': 'triangular', 'spread': 0.05},
+        SOURCE_FORMULA: {'distribution': 'triangular', 'spread': 0.05},
+    },
+    'gwp': {'distribution': 'lognormal', 'spread': 0.1},
+    'matching': {'top_k': 5, 'temperature': 0.01},
+}
+
+DEFAULT_BLOCK_ELEMENTS = 1 << 23
+
+
+def load_uncertainty_config(path: Optional[str] = None) -> Dict:
+    """
+    Uncertainty settings: DEFAULT_UNCERTAINTY, overridden by a JSON file
+
+    Args:
+        path: Optional JSON with any of the `factors`, `gwp` and `matching` sections
+
+    Returns:
+        Merged configuration
+
+    Raises:
+        ValueError: If a distribution name is unknown
+    """
+    config = json.loads(json.dumps(DEFAULT_UNCERTAINTY))
+    if path:
+        with open(path, encoding='utf-8') as f:
+            overrides = json.load(f)
+        config['factors'].update(overrides.get('factors', {}))
+        config['gwp'].update(overrides.get('gwp', {}))
+        config['matching'].update(overrides.get('matching', {}))
+    for spec in list(config['factors'].values()) + [config['gwp']]:
+        if spec['distribution'] not in DISTRIBUTIONS:
+            raise ValueError(f"Unknown distribution '{spec['distribution']}' (use one of {list(DISTRIBUTIONS)})")
+    return config
+
+
+def factor_sources(rule: pd.Series, tables: FactorTables) -> np.ndarray:
+    """Factor source (SOURCE_*) per row from its recorded rule label"""
+    labels = pd.Categorical(rule.astype(object))
+    sources = []
+    for label in labels.categories:
+        name, rule_id = str(label).rsplit('.', 1)
+        if rule_id == DEFAULT_RULE_ID:
+            sources.append(SOURCE_DEFAULT)
+        elif rule_id == FORMULA_RULE_ID:
+            sources.append(SOURCE_FORMULA)
+        elif tables[name].key:
+            sources.append(SOURCE_VALUE)
+        else:
+            sources.append(SOURCE_KEYWORD)
+    lookup = np.array(sources + [SOURCE_NONE], dtype=object)
+    return lookup[labels.codes]
+
+
+def factor_spread(conversions: pd.DataFrame, tables: FactorTables, config: Dict) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Distribution code and spread of the conversion factor per row
+
+    Piece weights combine the piece rule and the material multiplier rule;
+    their spreads add in quadrature and the piece rule's distribution is used.
+
+    Returns:
+        Tuple of (distribution codes, spreads)
+    """
+    specs = config['factors']
+    dist_of = {source: DISTRIBUTIONS[spec['distribution']] for source, spec in specs.items()}
+    spread_of = {source: float(spec['spread']) for source, spec in specs.items()}
+
+    sources = factor_sources(conversions['conversion_rule'], tables)
+    material = factor_sources(conversions['material_rule'], tables)
+    dist = np.array([dist_of[s] for s in sources], dtype=np.int8)
+    spread = np.hypot(np.array([spread_of[s] for s in sources], dtype=float),
+                      np.array([spread_of[s] for s in material], dtype=float))
+    return dist, spread
+
+
+def candidate_probabilities(similarity: np.ndarray, temperature: float) -> np.ndarray:
+    """Softmax(similarity / temperature) per row; missing candidates (NaN) get 0"""
+    logits = np.where(np.isnan(similarity), -np.inf, similarity / temperature)
+    logits = logits - logits.max(axis=1, keepdims=True)
+    weights = np.exp(logits)
+    return weights / weights.sum(axis=1, keepdims=True)
+
+
+def candidate_frames(matched_df: pd.DataFrame, candidates: pd.DataFrame, top_k: int) -> List[pd.DataFrame]:
+    """
+    Matched frame once per candidate rank (rank 0 = the reported match)
+
+    Args:
+        matched_df: Calculated matched frame
+        candidates: Alternative matches (Artikel, candidate_rank >= 1, matched_* fields)
+        top_k: Number of candidates per Artikel including the reported match
+
+    Returns:
+        List of top_k frames aligned with matched_df.index; frames of ranks
+        without a candidate hold NaN match fields
+    """
+    match_columns = [col for col in candidates.columns if col not in ('Artikel', 'candidate_rank')]
+    carried = ['Artikel', 'Menge'] + [col for col in ['Einheit'] + DIMENSION_COLUMNS if col in matched_df.columns]
+    frames = [matched_df]
+    for rank in range(1, top_k):
+        ranked = candidates[candidates['candidate_rank'] == rank].drop_duplicates('Artikel').set_index('Artikel')
+        frame = matched_df[carried].copy()
+        aligned = ranked[match_columns].reindex(matched_df['Artikel'])
+        for col in match_columns:
+            frame[col] = aligned[col].to_numpy()
+        frames.append(frame)
+    return frames
+
+
+def _inverse_cdf(dist: int, spread, z: np.ndarray, u: Optional[np.ndarray]) -> np.ndarray:
+    """Multiplier draws (median 1) of one distribution from normal (z) or uniform (u) draws"""
+    if dist == DIST_LOGNORMAL:
+        return np.exp(spread * z)
+    if dist == DIST_UNIFORM:
+        return 1 + spread * (2 * u - 1)
+    # Symmetric triangular on 1 ± spread
+    v = np.sqrt(2 * np.minimum(u, 1 - u)) - 1
+    return 1 + spread * np.where(u < 0.5, v, -v)
+
+
+def _multiplier(dist: np.ndarray, spread: np.ndarray, z: np.ndarray, u: Optional[np.ndarray]) -> np.ndarray:
+    """Multiplier draws (median 1) for per-element distribution codes"""
+    present = np.unique(dist)
+    if len(present) == 1:
+        return _inverse_cdf(int(present[0]), spread, z, u)
+    out = np.empty(z.shape)
+    for code in present:
+        m = dist == code
+        out[m] = _inverse_cdf(int(code), spread[m], z[m], None if u is None else u[m])
+    return out
+
+
+def _article_draws(articles: np.ndarray, samples: int, seed: int, uniform: bool) -> Dict[str, np.ndarray]:
+    """Draws per article from a generator seeded by (seed, article code)"""
+    z_factor = np.empty((len(articles), samples))
+    z_gwp = np.empty((len(articles), samples))
+    u_choice = np.empty((len(articles), samples))
+    u_factor = np.empty((len(articles), samples)) if uniform else None
+    u_gwp = np.empty((len(articles), samples)) if uniform else None
+    for i, article in enumerate(articles):
+        rng = np.random.default_rng([seed, int(article)])
+        z_factor[i], z_gwp[i] = rng.standard_normal((2, samples))
+        u_choice[i] = rng.random(samples)
+        if uniform:
+            u_factor[i], u_gwp[i] = rng.random((2, samples))
+    return {'z_factor': z_factor, 'z_gwp': z_gwp, 'u_choice': u_choice, 'u_factor': u_factor, 'u_gwp': u_gwp}
+
+
+def simulate_co2e(base: np.ndarray, dist: np.ndarray, spread: np.ndarray, probabilities: np.ndarray,
+                  artikel_codes: np.ndarray, groups: np.ndarray, samples: int, gwp_spec: Dict,
+                  seed: int = 0, block_elements: int = DEFAULT_BLOCK_ELEMENTS
+                  ) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Sample material CO₂e for every row, group and the project
+
+    Args:
+        base: Point CO₂e per row and candidate (rows × k, 0 where not calculable)
+        dist: Factor distribution code per distinct Artikel and candidate (articles × k)
+        spread: Factor spread per distinct Artikel and candidate (articles × k)
+        probabilities: Candidate probabilities per distinct Artikel (articles × k)
+        artikel_codes: Distinct-Artikel code per row
+        groups: Group code per row (e.g. supplier), 0..n_groups-1
+        samples: Number of draws
+        gwp_spec: {'distribution', 'spread'} of the GWP multiplier
+        seed: Random seed
+        block_elements: Upper bound of rows × samples values per block
+
+    Returns:
+        Tuple of (row percentiles rows × len(PERCENTILES), group percentiles
+        groups × len(PERCENTILES), project percentiles)
+    """
+    n_rows, top_k = base.shape
+    n_groups = int(groups.max()) + 1 if n_rows else 0
+    gwp_dist = DISTRIBUTIONS[gwp_spec['distribution']]
+    gwp_spread = float(gwp_spec['spread'])
+    uniform = bool((dist != DIST_LOGNORMAL).any()) or gwp_dist != DIST_LOGNORMAL
+    cumulative = np.cumsum(probabilities, axis=1)
+
+    row_percentiles = np.empty((n_rows, len(PERCENTILES)))
+    group_totals = np.zeros((n_groups, samples))
+    project_totals = np.zeros(samples)
+
+    # Rows of one article are adjacent, so each block draws for few articles
+    order = np.argsort(artikel_codes, kind='stable')
+    rows_per_block = max(1, block_elements // max(samples, 1))
+    for start in range(0, n_rows, rows_per_block):
+        rows = order[start:start + rows_per_block]
+        rows = rows[np.argsort(groups[rows], kind='stable')]
+        articles, local = np.unique(artikel_codes[rows], return_inverse=True)
+        draws = _article_draws(articles, samples, seed, uniform)
+
+        # Candidate choice and multipliers per article and draw, then gathered onto the rows
+        choice = np.zeros((len(articles), samples), dtype=np.int64)
+        for k in range(top_k - 1):
+            choice += draws['u_choice'] > cumulative[articles, k:k + 1]
+        multiplier = _multiplier(np.take_along_axis(dist[articles], choice, axis=1),
+                                 np.take_along_axis(spread[articles], choice, axis=1),
+                                 draws['z_factor'], draws['u_factor'])
+        multiplier *= _inverse_cdf(gwp_dist, gwp_spread, draws['z_gwp'], draws['u_gwp'])
+
+        values = np.take_along_axis(base[rows], choice[local], axis=1)
+        values *= multiplier[local]
+
+        row_percentiles[rows] = np.percentile(values, PERCENTILES, axis=1).T
+        project_totals += values.sum(axis=0)
+        block_groups = groups[rows]
+        starts = np.flatnonzero(np.r_[True, block_groups[1:] != block_groups[:-1]])
+        group_totals[block_groups[starts]] += np.add.reduceat(values, starts, axis=0)
+
+    group_percentiles = np.percentile(group_totals, PERCENTILES, axis=1).T if n_groups else np.empty((0, 3))
+    return row_percentiles, group_percentiles, np.percentile(project_totals, PERCENTILES)
+
+
+def estimate_uncertainty(matched_df: pd.DataFrame, candidates: pd.DataFrame, tables: FactorTables,
+                         samples: int, config: Dict, seed: int = 0, cache=None,
+                         block_elements: int = DEFAULT_BLOCK_ELEMENTS) -> Tuple[pd.DataFrame, pd.DataFrame]:
+    """
+    Monte Carlo P5/P50/P95 of material CO₂e (A1-A3) per row, supplier and project
+
+    Args:
+        matched_df: Calculated matched frame (after calculate_all_co2e)
+        candidates: Alternative matches (see CarbonMatchPipeline.match_candidates)
+        tables: Factor tables used for the candidates' conversions
+        samples: Number of draws
+        config: See load_uncertainty_config()
+        seed: Random seed
+        cache: Optional ConversionCache for the candidates' conversions
+        block_elements: Upper bound of rows × samples values held at once
+
+    Returns:
+        Tuple of (row frame aligned with matched_df.index holding
+        PERCENTILE_COLUMNS, summary frame with level, name, point estimate
+        and percentiles per supplier and for the project)
+    """
+    top_k = max(1, int(config['matching']['top_k']))
+    frames = candidate_frames(matched_df, candidates, top_k)
+
+    # The factor rule depends on the article and its match only, so it is taken per distinct Artikel
+    artikel_codes, artikel_uniques = pd.factorize(matched_df['Artikel'], use_na_sentinel=False)
+    first_rows = np.flatnonzero(~pd.Series(artikel_codes).duplicated().to_numpy())
+
+    base = np.zeros((len(matched_df), top_k))
+    dist = np.zeros((len(artikel_uniques), top_k), dtype=np.int8)
+    spread = np.zeros((len(artikel_uniques), top_k))
+    for k, frame in enumerate(frames):
+        if k == 0:
+            conversions, co2e = matched_df, matched_df['calculated_co2e_a1_a3']
+        else:
+            conversions = convert_units(frame, tables, cache=cache)
+            co2e = calculate_frame_co2e(frame, conversions)['calculated_co2e_a1_a3']
+        base[:, k] = co2e.to_numpy(dtype=float)
+        dist[:, k], spread[:, k] = factor_spread(conversions.iloc[first_rows], tables, config)
+
+    similarity = np.full((len(artikel_uniques), top_k), np.nan)
+    similarity[:, 0] = matched_df['similarity_score'].to_numpy(dtype=float)[first_rows]
+    if top_k > 1 and len(candidates):
+        ranked = candidates.pivot_table(index='Artikel', columns='candidate_rank', values='similarity_score',
+                                        aggfunc='first')
+        ranked = ranked.reindex(index=artikel_uniques, columns=range(1, top_k))
+        similarity[:, 1:] = ranked.to_numpy(dtype=float)
+    # Deliveries without a match (no embedding) have no alternatives either
+    similarity[:, 0] = np.where(np.isnan(similarity[:, 0]), 0.0, similarity[:, 0])
+    probabilities = candidate_probabilities(similarity, float(config['matching']['temperature']))
+
+    supplier_codes, suppliers = pd.factorize(matched_df['Lieferant'].astype(object).fillna('Unknown'))
+    rows, by_supplier, project = simulate_co2e(base, dist, spread, probabilities, artikel_codes, supplier_codes,
+                                               samples, config['gwp'], seed=seed, block_elements=block_elements)
+
+    row_df = pd.DataFrame(rows, columns=PERCENTILE_COLUMNS, index=matched_df.index)
+    point = matched_df['calculated_co2e_a1_a3'].groupby(supplier_codes).sum().reindex(range(len(suppliers)), fill_value=0)
+    summary = pd.concat([
+        pd.DataFrame({'level': ['project'], 'name': ['Project'],
+                      'calculated_co2e_a1_a3': [matched_df['calculated_co2e_a1_a3'].sum()],
+                      **{col: [value] for col, value in zip(PERCENTILE_COLUMNS, project)}}),
+        pd.DataFrame({'level': 'supplier', 'name': list(suppliers), 'calculated_co2e_a1_a3': point.to_numpy(),
+                      **{col: by_supplier[:, i] for i, col in enumerate(PERCENTILE_COLUMNS)}}),
+    ], ignore_index=True)
+    return row_df, summary
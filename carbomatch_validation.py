@@ -0,0 +1,159 @@
+#!/usr/bin/env python3
+"""
+CarbonMatch - Ingestion Validation
+==================================
+
+Schema validation for delivery data, run once at ingestion:
+- Required fields present and non-blank
+- Quantities numeric (German decimal commas accepted) and within range
+- Delivery units from a known vocabulary
+
+Every check is a vectorized boolean mask over the whole frame. Rows failing
+any check are split off into a rejects frame carrying pipe-separated reason
+codes, so the downstream stages can assume clean, typed input.
+"""
+
+from __future__ import annotations
+
+from typing import Dict, List, Tuple
+
+from carbomatch_lazy import lazy_import
+
+np = lazy_import("numpy")
+pd = lazy_import("pandas")
+
+# Columns the delivery workbook must provide
+REQUIRED_DELIVERY_COLUMNS = ['Lieferant', 'Artikel-Nummer', 'Artikel', 'Menge', 'Einheit']
+
+# Columns the Ökobaudat export must provide
+REQUIRED_OEKOBAUDAT_COLUMNS = ['UUID', 'Name (de)', 'Modul', 'GWPtotal (A2)', 'Bezugseinheit']
+
+# Reject reason codes (written to the rejects sidecar)
+REJECT_MISSING_SUPPLIER = 'MISSING_SUPPLIER'
+REJECT_MISSING_ARTIKEL = 'MISSING_ARTIKEL'
+REJECT_NON_NUMERIC_MENGE = 'NON_NUMERIC_MENGE'
+REJECT_NON_POSITIVE_MENGE = 'NON_POSITIVE_MENGE'
+REJECT_MENGE_OUT_OF_RANGE = 'MENGE_OUT_OF_RANGE'
+REJECT_MISSING_UNIT = 'MISSING_UNIT'
+REJECT_UNKNOWN_UNIT = 'UNKNOWN_UNIT'
+REJECT_NON_MATERIAL_UNIT = 'NON_MATERIAL_UNIT'
+
+# Upper bound for a single delivery line quantity
+MAX_MENGE = 1e9
+
+# Delivery units seen on material delivery notes (lower-cased)
+MATERIAL_DELIVERY_UNITS = {
+    'kg', 't', 'to',
+    'm', 'lfm', 'm²', 'm2', 'qm', 'm³', 'm3', 'cbm', 'l', 'liter',
+    'stk', 'st', 'stück', 'pcs', 'pcs.',
+    'säcke', 'sack', 'bündel', 'bund', 'pack', 'pkt', 'pal', 'palette',
+    'rolle', 'rolle(n)', 'rollen', 'eim', 'eimer', 'karton', 'karton(s)', 'kit', 'satz',
+}
+
+# Delivery units that bill services rather than materials
+NON_MATERIAL_DELIVERY_UNITS = {'service(s)', 'service', 'pauschal', 'psch'}
+
+REJECT_REASON_COLUMN = 'reject_reason'
+SOURCE_ROW_COLUMN = 'source_row'
+
+
+def check_required_columns(df: pd.DataFrame, required: List[str], source: str) -> None:
+    """
+    Raise if a loaded frame lacks any of the required columns
+
+    Args:
+        df: Loaded input frame
+        required: Column names that must be present
+        source: Human-readable name of the input for the error message
+    """
+    missing = [col for col in required if col not in df.columns]
+    if missing:
+        raise ValueError(f"{source} is missing required columns: {missing}")
+
+
+def parse_menge_column(values: pd.Series) -> pd.Series:
+    """
+    Convert a quantity column to float, accepting German decimal commas
+
+    Unparseable values become NaN instead of raising.
+    """
+    if pd.api.types.is_numeric_dtype(values):
+        return values.astype(float)
+    cleaned = values.astype(str).str.strip().str.replace(',', '.', regex=False)
+    return pd.to_numeric(cleaned, errors='coerce')
+
+
+def _blank_mask(values: pd.Series) -> np.ndarray:
+    """True where a text field is missing or whitespace only"""
+    return (values.isna() | values.astype(str).str.strip().isin(['', 'nan', 'None'])).to_numpy()
+
+
+def delivery_check_masks(df: pd.DataFrame) -> Dict[str, np.ndarray]:
+    """
+    Evaluate every delivery check as a boolean mask (True = row fails)
+
+    Expects `Menge` to be parsed to float already.
+    """
+    menge = df['Menge'].to_numpy(dtype=float)
+    unit = df['Einheit'].astype(str).str.strip().str.lower()
+    unit_missing = _blank_mask(df['Einheit'])
+    non_numeric = np.isnan(menge)
+
+    return {
+        REJECT_MISSING_SUPPLIER: _blank_mask(df['Lieferant']),
+        REJECT_MISSING_ARTIKEL: _blank_mask(df['Artikel']),
+        REJECT_NON_NUMERIC_MENGE: non_numeric,
+        REJECT_NON_POSITIVE_MENGE: ~non_numeric & (menge <= 0),
+        REJECT_MENGE_OUT_OF_RANGE: ~non_numeric & (menge > MAX_MENGE),
+        REJECT_MISSING_UNIT: unit_missing,
+        REJECT_NON_MATERIAL_UNIT: ~unit_missing & unit.isin(NON_MATERIAL_DELIVERY_UNITS).to_numpy(),
+        REJECT_UNKNOWN_UNIT: ~unit_missing & ~unit.isin(MATERIAL_DELIVERY_UNITS | NON_MATERIAL_DELIVERY_UNITS).to_numpy(),
+    }
+
+
+def validate_deliveries(df: pd.DataFrame) -> Tuple[pd.DataFrame, pd.DataFrame]:
+    """
+    Validate raw delivery rows and split them into clean and rejected rows
+
+    Args:
+        df: Delivery frame as read from the workbook
+
+    Returns:
+        Tuple of (clean_df, rejects_df). clean_df has typed columns
+        (`Menge` float, text columns str) and a fresh index; rejects_df keeps
+        the original values plus `source_row` and `reject_reason`.
+    """
+    check_required_columns(df, REQUIRED_DELIVERY_COLUMNS, "Delivery data")
+
+    typed = df.copy()
+    typed['Menge'] = parse_menge_column(typed['Menge'])
+    masks = delivery_check_masks(typed)
+
+    # Collect reason codes per row, one column operation per check
+    reasons = pd.Series('', index=typed.index, dtype=object)
+    for code, mask in masks.items():
+        reasons = reasons.mask(mask, reasons + '|' + code)
+    reasons = reasons.str.lstrip('|')
+    rejected = (reasons != '').to_numpy()
+
+    rejects_df = df[rejected].copy()
+    rejects_df.insert(0, SOURCE_ROW_COLUMN, df.index[rejected])
+    rejects_df[REJECT_REASON_COLUMN] = reasons[rejected].to_numpy()
+
+    clean_df = typed[~rejected].reset_index(drop=True)
+    # Missing optional text (e.g. Artikel-Nummer) becomes '', never the string 'nan';
+    # numeric article numbers read as float (because of a gap) keep no '.0'
+    for col in ['Lieferant', 'Artikel-Nummer', 'Artikel', 'Einheit']:
+        values = clean_df[col]
+        if pd.api.types.is_float_dtype(values) and (values.dropna() % 1 == 0).all():
+            values = values.astype('Int64')
+        clean_df[col] = values.astype(object).fillna('').astype(str).str.strip()
+
+    return clean_df, rejects_df.reset_index(drop=True)
+
+
+def summarize_rejects(rejects_df: pd.DataFrame) -> Dict[str, int]:
+    """Count rejected rows per reason code (a row may carry several codes)"""
+    if rejects_df is None or len(rejects_df) == 0:
+        return {}
+    return rejects_df[REJECT_REASON_COLUMN].str.split('|').explode().value_counts().to_dict()
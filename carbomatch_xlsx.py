@@ -0,0 +1,390 @@
+#!/usr/bin/env python3
+"""
+CarbonMatch - Streaming XLSX Export
+===================================
+
+Writes report-sized workbooks (`carbomatch_report.xlsx`) without holding
+them in memory, for clients who want the audit report in Excel:
+
+- Rows are appended chunk by chunk; each sheet's XML streams to a temporary
+  file and the workbook is zipped together on close (atomic replace).
+- Text cells go through one shared string table: a supplier, material or
+  `calculation_status` text is stored once however many rows repeat it,
+  and each distinct label is escaped once per chunk, not per cell.
+- Cell XML is built column by column from arrays (number text, shared
+  string index); no cell objects are created.
+- Sheets hold at most XLSX_MAX_ROWS rows; longer reports continue on
+  `Report (2)`, `Report (3)`, ...
+
+openpyxl's write-only mode streams rows too, but it writes every string
+inline (no shared string table) and builds an element per cell, which makes
+it about five times slower on report rows (`python carbomatch_bench.py xlsx`).
+Text is always written as text, so article names starting with `=` never
+become formulas.
+"""
+
+from __future__ import annotations
+
+import logging
+import os
+import re
+import shutil
+import tempfile
+import zipfile
+from typing import Dict, List, Optional, Sequence
+from xml.sax.saxutils import escape, quoteattr
+
+from carbomatch_lazy import lazy_import
+
+np = lazy_import("numpy")
+pd = lazy_import("pandas")
+
+logger = logging.getLogger(__name__)
+
+XLSX_MAX_ROWS = 1_048_576      # Excel's row limit per sheet (header included)
+XLSX_BATCH_ROWS = 5_000        # rows whose cell XML is built at once
+SHEET_NAME_LENGTH = 31
+REPORT_SHEET = 'Report'
+ROLLUPS_SHEET = 'Rollups'
+
+# Characters XML 1.0 cannot carry (dropped from cell text)
+ILLEGAL_XML_CHARACTERS = re.compile('[\x00-\x08\x0b\x0c\x0e-\x1f]')
+SHEET_NAME_CHARACTERS = re.compile(r'[\[\]:*?/\\]')
+
+MAIN_NS = "http://schemas.openxmlformats.org/spreadsheetml/2006/main"
+REL_NS = "http://schemas.openxmlformats.org/officeDocument/2006/relationships"
+PACKAGE_REL_NS = "http://schemas.openxmlformats.org/package/2006/relationships"
+XML_HEADER = '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+
+# Two cell formats: 0 default, 1 bold (header row)
+STYLES_XML = (
+    f'{XML_HEADER}<styleSheet xmlns="{MAIN_NS}">'
+    '<fonts count="2"><font><sz val="11"/><name val="Calibri"/></font>'
+    '<font><b/><sz val="11"/><name val="Calibri"/></font></fonts>'
+    '<fills count="2"><fill><patternFill patternType="none"/></fill>'
+    '<fill><patternFill patternType="gray125"/></fill></fills>'
+    '<borders count="1"><border><left/><right/><top/><bottom/><diagonal/></border></borders>'
+    '<cellStyleXfs count="1"><xf numFmtId="0" fontId="0" fillId="0" borderId="0"/></cellStyleXfs>'
+    '<cellXfs count="2"><xf numFmtId="0" fontId="0" fillId="0" borderId="0" xfId="0"/>'
+    '<xf numFmtId="0" fontId="1" fillId="0" borderId="0" xfId="0" applyFont="1"/></cellXfs>'
+    '<cellStyles count="1"><cellStyle name="Normal" xfId="0" builtinId="0"/></cellStyles>'
+    '</styleSheet>'
+)
+# Used range (written on close, when the row count is known); header row frozen while scrolling
+SHEET_HEAD_XML = (
+    f'{XML_HEADER}<worksheet xmlns="{MAIN_NS}"><dimension ref="{{ref}}"/><sheetViews><sheetView workbookViewId="0">'
+    '<pane ySplit="1" topLeftCell="A2" activePane="bottomLeft" state="frozen"/>'
+    '</sheetView></sheetViews><sheetData>'
+)
+SHEET_TAIL_XML = '</sheetData></worksheet>'
+
+
+def is_xlsx(path: str) -> bool:
+    return path.endswith('.xlsx')
+
+
+def column_letter(index: int) -> str:
+    """Excel column name of a 0-based column index (0 -> A, 26 -> AA)"""
+    letters = ''
+    index += 1
+    while index:
+        index, remainder = divmod(index - 1, 26)
+        letters = chr(65 + remainder) + letters
+    return letters
+
+
+def sheet_name(label: str, taken: Sequence[str]) -> str:
+    """Valid sheet name for a label (31 characters, no []:*?/\\, unique ignoring case)"""
+    name = SHEET_NAME_CHARACTERS.sub('_', str(label)).strip("'") or 'Sheet'
+    name = name[:SHEET_NAME_LENGTH]
+    existing = {sheet.lower() for sheet in taken}
+    number = 2
+    candidate = name
+    while candidate.lower() in existing:
+        suffix = f" ({number})"
+        candidate = name[:SHEET_NAME_LENGTH - len(suffix)] + suffix
+        number += 1
+    return candidate
+
+
+class _Sheet:
+    """One worksheet being streamed to a temporary file"""
+
+    def __init__(self, name: str, columns: List[str]):
+        self.name = name
+        self.columns = columns
+        self.letters = [column_letter(i) for i in range(len(columns))]
+        self.rows = 0
+        self.handle = tempfile.TemporaryFile()
+
+    @property
+    def dimension(self) -> str:
+        """Used cell range, e.g. `A1:AB1200` (`A1` for a sheet without columns)"""
+        if not self.letters:
+            return 'A1'
+        return f"A1:{self.letters[-1]}{max(self.rows, 1)}"
+
+
+class XlsxWriter:
+    """
+    Streams frames into the sheets of one workbook
+
+    Usage:
+        writer = XlsxWriter("carbomatch_report.xlsx")
+        writer.append('Report', chunk, split_by='Lieferant')   # first append fixes the columns
+        writer.append('Report', next_chunk, split_by='Lieferant')
+        writer.append('Rollups', rollups)
+        writer.close()
+    """
+
+    def __init__(self, path: str):
+        """Workbook written to `path` on close (under a temporary name until then)"""
+        self.path = path
+        self._tmp_path = f"{path}.tmp"
+        self._sheets: List[_Sheet] = []
+        self._current: Dict[str, _Sheet] = {}  # sheet label -> sheet receiving its rows
+        self._strings: Dict[str, int] = {}
+        self._headers: Dict[tuple, tuple] = {}  # columns -> header row cell XML
+
+    @property
+    def sheet_names(self) -> List[str]:
+        return [sheet.name for sheet in self._sheets]
+
+    def append(self, label: str, frame: pd.DataFrame, split_by: Optional[str] = None) -> None:
+        """
+        Append rows to the sheet of a label (created with a header row on first use)
+
+        Args:
+            label: Sheet label; the sheet name is derived from it (sheet_name())
+            frame: Rows; the columns of the first append are kept for the sheet
+            split_by: Also append each value's rows of this column to the
+                      sheet labelled with the value (cell XML is built once)
+        """
+        sheet = self._current.get(label) or self._open(label, list(frame.columns))
+        frame = frame.reindex(columns=sheet.columns)
+        if split_by:
+            codes, uniques = pd.factorize(frame[split_by].astype(object), use_na_sentinel=False)
+            labels = ['Unknown' if pd.isna(value) or value == '' else str(value) for value in uniques]
+        # Batches bound the cell strings held at once
+        for start in range(0, len(frame), XLSX_BATCH_ROWS):
+            batch = frame.iloc[start:start + XLSX_BATCH_ROWS]
+            rows = list(zip(*[self._cells(batch.iloc[:, i]) for i in range(batch.shape[1])]))
+            self._write(label, sheet.columns, rows)
+            if split_by:
+                batch_codes = codes[start:start + XLSX_BATCH_ROWS]
+                order = np.argsort(batch_codes, kind='stable')
+                bounds = np.concatenate([[0], np.cumsum(np.bincount(batch_codes, minlength=len(labels)))])
+                for code in np.flatnonzero(np.diff(bounds)):
+                    self._write(labels[code], sheet.columns, [rows[i] for i in order[bounds[code]:bounds[code + 1]]])
+
+    def _open(self, label: str, columns: List[str]) -> _Sheet:
+        """New sheet for a label, starting with the bold header row"""
+        sheet = _Sheet(sheet_name(label, self.sheet_names), columns)
+        self._sheets.append(sheet)
+        self._current[label] = sheet
+        header = self._headers.get(tuple(columns))
+        if header is None:
+            header = self._headers[tuple(columns)] = tuple(f' t="s"><v>{index}</v></c>'
+                                                           for index in self._shared(map(str, columns)))
+        self._write_rows(sheet, [header], style=1)
+        return sheet
+
+    def _write(self, label: str, columns: List[str], rows: List[tuple]) -> None:
+        """Write rows of cell XML to a label's sheet, continuing on a new sheet at XLSX_MAX_ROWS"""
+        sheet = self._current.get(label) or self._open(label, columns)
+        start = 0
+        while start < len(rows):
+            if sheet.rows >= XLSX_MAX_ROWS:
+                sheet = self._open(label, columns)
+            stop = start + XLSX_MAX_ROWS - sheet.rows
+            self._write_rows(sheet, rows[start:stop])
+            start = stop
+
+    def _shared(self, labels: Sequence) -> List[int]:
+        """Shared string index of each label (added to the table on first use)"""
+        strings = self._strings
+        indexes = []
+        for label in labels:
+            index = strings.get(label)
+            if index is None:
+                index = strings[label] = len(strings)
+            indexes.append(index)
+        return indexes
+
+    def _cells(self, values: pd.Series) -> List[str]:
+        """Cell XML following `<c r="A1"` per row (number, shared string index or empty)"""
+        if pd.api.types.is_numeric_dtype(values.dtype) and not pd.api.types.is_bool_dtype(values.dtype):
+            integral = pd.api.types.is_integer_dtype(values.dtype)
+            numbers = values.to_numpy(dtype=float, na_value=np.nan)
+            finite = np.isfinite(numbers)
+            return [(f'><v>{int(number) if integral else number!r}</v></c>' if ok else '/>')
+                    for number, ok in zip(numbers.tolist(), finite.tolist())]
+        codes, uniques = pd.factorize(values.astype(object), use_na_sentinel=True)
+        texts = [ILLEGAL_XML_CHARACTERS.sub('', str(label)) for label in uniques]
+        # Missing values (code -1) pick the empty cell at the end
+        suffixes = [f' t="s"><v>{index}</v></c>' for index in self._shared(texts)] + ['/>']
+        return [suffixes[code] for code in codes.tolist()]
+
+    def _write_rows(self, sheet: _Sheet, rows: List[tuple], style: int = 0) -> None:
+        style_attr = f' s="{style}"' if style else ''
+        lines = []
+        for row, cells in enumerate(rows, sheet.rows + 1):
+            lines.append(f'<row r="{row}">')
+            lines.extend(f'<c r="{letter}{row}"{style_attr}{cell}' for letter, cell in zip(sheet.letters, cells))
+            lines.append('</row>')
+        sheet.handle.write(''.join(lines).encode('utf-8'))
+        sheet.rows += len(rows)
+
+    def close(self) -> None:
+        """Zip the sheets, shared strings and workbook parts and move the file into place"""
+        if not self._sheets:
+            self._open(REPORT_SHEET, [])
+        sheets = self._sheets
+        overrides = ''.join(
+            f'<Override PartName="/xl/worksheets/sheet{i}.xml" '
+            f'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>'
+            for i in range(1, len(sheets) + 1))
+        content_types = (
+            f'{XML_HEADER}<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+            '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+            '<Default Extension="xml" ContentType="application/xml"/>'
+            '<Override PartName="/xl/workbook.xml" '
+            'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>'
+            f'{overrides}'
+            '<Override PartName="/xl/styles.xml" '
+            'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.styles+xml"/>'
+            '<Override PartName="/xl/sharedStrings.xml" '
+            'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sharedStrings+xml"/>'
+            '</Types>'
+        )
+        package_rels = (
+            f'{XML_HEADER}<Relationships xmlns="{PACKAGE_REL_NS}">'
+            f'<Relationship Id="rId1" Type="{REL_NS}/officeDocument" Target="xl/workbook.xml"/>'
+            '</Relationships>'
+        )
+        workbook = (
+            f'{XML_HEADER}<workbook xmlns="{MAIN_NS}" xmlns:r="{REL_NS}"><sheets>'
+            + ''.join(f'<sheet name={quoteattr(sheet.name)} sheetId="{i}" r:id="rId{i}"/>'
+                      for i, sheet in enumerate(sheets, 1))
+            + '</sheets></workbook>'
+        )
+        workbook_rels = (
+            f'{XML_HEADER}<Relationships xmlns="{PACKAGE_REL_NS}">'
+            + ''.join(f'<Relationship Id="rId{i}" Type="{REL_NS}/worksheet" Target="worksheets/sheet{i}.xml"/>'
+                      for i in range(1, len(sheets) + 1))
+            + f'<Relationship Id="rId{len(sheets) + 1}" Type="{REL_NS}/styles" Target="styles.xml"/>'
+            + f'<Relationship Id="rId{len(sheets) + 2}" Type="{REL_NS}/sharedStrings" Target="sharedStrings.xml"/>'
+            + '</Relationships>'
+        )
+
+        try:
+            with zipfile.ZipFile(self._tmp_path, 'w', compression=zipfile.ZIP_DEFLATED, compresslevel=1) as archive:
+                archive.writestr('[Content_Types].xml', content_types)
+                archive.writestr('_rels/.rels', package_rels)
+                archive.writestr('xl/workbook.xml', workbook)
+                archive.writestr('xl/_rels/workbook.xml.rels', workbook_rels)
+                archive.writestr('xl/styles.xml', STYLES_XML)
+                with archive.open('xl/sharedStrings.xml', 'w', force_zip64=True) as f:
+                    f.write(f'{XML_HEADER}<sst xmlns="{MAIN_NS}" uniqueCount="{len(self._strings)}">'.encode('utf-8'))
+                    for text in self._strings:
+                        f.write(f'<si><t xml:space="preserve">{escape(text)}</t></si>'.encode('utf-8'))
+                    f.write(b'</sst>')
+                for i, sheet in enumerate(sheets, 1):
+                    sheet.handle.seek(0)
+                    with archive.open(f'xl/worksheets/sheet{i}.xml', 'w', force_zip64=True) as f:
+                        f.write(SHEET_HEAD_XML.format(ref=sheet.dimension).encode('utf-8'))
+                        shutil.copyfileobj(sheet.handle, f, 1 << 20)
+                        f.write(SHEET_TAIL_XML.encode('utf-8'))
+        except BaseException:
+            self.abort()
+            raise
+        self._release()
+        os.replace(self._tmp_path, self.path)
+        logger.info(f"Workbook exported to {self.path} ({len(sheets)} sheet(s), "
+                    f"{len(self._strings):,} shared strings)")
+
+    def abort(self) -> None:
+        """Discard the partial workbook (an existing file stays in place)"""
+        self._release()
+        if os.path.exists(self._tmp_path):
+            os.remove(self._tmp_path)
+
+    def _release(self) -> None:
+        for sheet in self._sheets:
+            sheet.handle.close()
+
+
+def check_roundtrip(directory: Optional[str] = None) -> List[str]:
+    """
+    Write a small workbook and read it back with openpyxl
+
+    Compares every sheet's used range (`max_row`/`max_column`), every cell
+    value and the shared string count with what was written. Covers repeated
+    and missing texts, formula-like and control characters, integer and
+    float columns and the per-supplier sheets of `split_by`.
+
+    Returns:
+        Description of every mismatch (empty when the workbook reads back intact)
+    """
+    import openpyxl
+
+    frame = pd.DataFrame({
+        'Lieferant': ['Sülzle Stahlpartner GmbH', 'Heidelberger Beton', None, 'Sülzle Stahlpartner GmbH'],
+        'Artikel': ['=SUM(A1)', 'Beton C25/30 <lose> & "frei"', 'Dämmung\x01 100 mm', '=SUM(A1)'],
+        'Menge': pd.array([12, 3, None, 7], dtype='Int64'),
+        'total_co2e': [1234.5678, float('nan'), 0.1, -2.0],
+    })
+    # Control characters are dropped, missing values read back as empty cells
+    rows = [
+        ['Lieferant', 'Artikel', 'Menge', 'total_co2e'],
+        ['Sülzle Stahlpartner GmbH', '=SUM(A1)', 12, 1234.5678],
+        ['Heidelberger Beton', 'Beton C25/30 <lose> & "frei"', 3, None],
+        [None, 'Dämmung 100 mm', None, 0.1],
+        ['Sülzle Stahlpartner GmbH', '=SUM(A1)', 7, -2.0],
+    ]
+    expected = {
+        'Report': rows,
+        'Sülzle Stahlpartner GmbH': [rows[0], rows[1], rows[4]],
+        'Heidelberger Beton': [rows[0], rows[2]],
+        'Unknown': [rows[0], rows[3]],
+    }
+    distinct = {text for row in rows for text in row if isinstance(text, str)}
+
+    mismatches = []
+    with tempfile.TemporaryDirectory(dir=directory) as scratch:
+        path = os.path.join(scratch, 'roundtrip.xlsx')
+        writer = XlsxWriter(path)
+        writer.append(REPORT_SHEET, frame, split_by='Lieferant')
+        writer.close()
+        # Read-only mode takes the used range from the <dimension> element
+        workbook = openpyxl.load_workbook(path, read_only=True)
+        if workbook.sheetnames != list(expected):
+            mismatches.append(f"sheets {workbook.sheetnames}, expected {list(expected)}")
+        for name, sheet_rows in expected.items():
+            if name not in workbook.sheetnames:
+                continue
+            sheet = workbook[name]
+            shape = (sheet.max_row, sheet.max_column)
+            if shape != (len(sheet_rows), len(frame.columns)):
+                mismatches.append(f"{name}: max_row/max_column {shape}, expected "
+                                  f"{(len(sheet_rows), len(frame.columns))}")
+            values = [list(row) for row in sheet.iter_rows(values_only=True)]
+            if values != sheet_rows:
+                mismatches.append(f"{name}: cells {values}, expected {sheet_rows}")
+        workbook.close()
+        with zipfile.ZipFile(path) as archive:
+            shared = archive.read('xl/sharedStrings.xml').decode('utf-8')
+        count = shared.count('<si>')
+        if count != len(distinct):
+            mismatches.append(f"{count} shared strings, expected {len(distinct)}")
+    return mismatches
+
+
+if __name__ == "__main__":
+    import sys
+
+    failed = check_roundtrip()
+    for mismatch in failed:
+        print(f"❌ {mismatch}")
+    print(f"{'❌' if failed else '✅'} XLSX round trip {'failed' if failed else 'passed'}")
+    sys.exit(1 if failed else 0)